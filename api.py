@@ -1,66 +1,356 @@
-from urllib.request import build_opener, HTTPCookieProcessor, Request
+import gzip
+import heapq
+import http.client
+import io
+import queue
+import random
+import sys
+import threading
 import urllib
+import urllib.error
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin, urlsplit
 # Wrapper which does retries
-from time import sleep
-from http.cookiejar import Cookie, CookieJar
+from time import monotonic, sleep, time
+from typing import Generator, Optional
+
+import yaml
+
+from archive import PageArchive
+from args import script_args
+from cache import ResponseCache
 from logger import logger
+from metrics import cache_hits_total, rate_limit_wait_seconds, request_seconds, response_bytes_total, responses_total, \
+    retries_total
+
+# Requests per second allowed for each host, every host has its own budget
+HOST_RATES = {
+    'ncode.syosetu.com': 4.0,
+    'novel18.syosetu.com': 4.0,
+    'novelcom.syosetu.com': 4.0,
+    'novelcom18.syosetu.com': 4.0,
+    'api.syosetu.com': 1.0,
+}
+DEFAULT_RATE = 2.0
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second with bursts of up to `burst` requests.
+    The rate is halved when the host asks us to slow down and recovers gradually on success.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0, min_rate: float = 0.05):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = burst
+
+        self.tokens = burst
+        self.updated = monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._refill(now)
+
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+
+            sleep(wait)
+
+    def slow_down(self, delay: float):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+            self.blocked_until = max(self.blocked_until, monotonic() + delay)
+
+    def speed_up(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RateLimiter:
+    def __init__(self, rates: dict, default_rate: float):
+        self.rates = rates
+        self.default_rate = default_rate
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url: str) -> TokenBucket:
+        host = urlsplit(url).hostname
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.rates.get(host, self.default_rate))
+                self._buckets[host] = bucket
+            return bucket
+
+
+def backoff_delay(attempt: int, base=1.0, cap=60.0) -> float:
+    """
+    Exponential backoff with full jitter
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Session:
+    """
+    Keeps connections open between requests so that every page doesn't pay for a new TCP and TLS handshake.
+    Idle connections are pooled per host, each connection is only used by one thread at a time.
+    host_override sends every request over plain http to another address, keeping the original Host header,
+    see fixture_server.py.
+    """
+
+    max_redirects = 5
+
+    def __init__(self, cookies: dict, cookie_domain: str, pool_size=16, timeout=60, host_override: Optional[str] = None):
+        self.cookie_header = '; '.join(f'{name}={value}' for name, value in cookies.items())
+        self.cookie_domain = cookie_domain
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.host_override = host_override
+
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _get_pool(self, key) -> queue.LifoQueue:
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = queue.LifoQueue(maxsize=self.pool_size)
+                self._pools[key] = pool
+            return pool
+
+    def _new_connection(self, scheme: str, host: str) -> http.client.HTTPConnection:
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, timeout=self.timeout)
+        return http.client.HTTPConnection(host, timeout=self.timeout)
+
+    def _headers(self, host: str) -> dict:
+        headers = {
+            'Accept-Encoding': 'gzip',
+            'Connection': 'keep-alive',
+            'User-Agent': f'Python-urllib/{sys.version_info.major}.{sys.version_info.minor}',
+        }
+        hostname = host.split(':')[0]
+        if hostname == self.cookie_domain or hostname.endswith('.' + self.cookie_domain):
+            headers['Cookie'] = self.cookie_header
+        return headers
+
+    def _send(self, scheme: str, host: str, path: str, headers: Optional[dict] = None):
+        address, connection_scheme = host, scheme
+        request_headers = {**self._headers(host), **(headers or {})}
+        if self.host_override:
+            address, connection_scheme = self.host_override, 'http'
+            request_headers['Host'] = host
+
+        pool = self._get_pool((connection_scheme, address))
+
+        try:
+            connection = pool.get_nowait()
+            reused = True
+        except queue.Empty:
+            connection = self._new_connection(connection_scheme, address)
+            reused = False
+
+        try:
+            connection.request('GET', path, headers=request_headers)
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            connection.close()
+            if not reused:
+                raise
+            # the server closed an idle keep-alive connection, try again on a fresh one
+            return self._send(scheme, host, path, headers)
+        except Exception:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+
+        return response, body
+
+    def fetch(self, url: str, headers: Optional[dict] = None) -> tuple[int, bytes, http.client.HTTPMessage]:
+        """
+        Returns the status, body and headers of the response after following redirects.
+        Raises urllib.error.HTTPError for error statuses, like urllib's opener does.
+        """
+        for _ in range(self.max_redirects + 1):
+            parts = urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+
+            response, body = self._send(parts.scheme, parts.netloc, path, headers)
+
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                url = urljoin(url, response.getheader('Location'))
+                continue
+
+            if body and response.getheader('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+
+            if response.status >= 400:
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(body))
+
+            return response.status, body, response.headers
+
+        raise urllib.error.HTTPError(url, response.status, 'Too many redirects', response.headers, None)
+
+    def open(self, url: str) -> bytes:
+        return self.fetch(url)[1]
+
+
+# Shared by every module, the over18 cookie is only set once
+session = Session(cookies={'over18': 'yes'}, cookie_domain='syosetu.com', host_override=script_args.host_override)
+
+if script_args.rate_limit:
+    rate_limiter = RateLimiter({}, script_args.rate_limit)
+else:
+    rate_limiter = RateLimiter(HOST_RATES, DEFAULT_RATE)
+
+
+# Raw pages kept on disk with --cache-dir and --archive-dir, api responses change too often to be worth keeping
+response_cache = None
+if script_args.cache_dir:
+    response_cache = ResponseCache(script_args.cache_dir, script_args.cache_size_mb * 1024 * 1024)
+elif script_args.offline:
+    raise SystemExit('--offline needs --cache-dir')
+
+page_archive = PageArchive(script_args.archive_dir) if script_args.archive_dir else None
+
+
+def is_page_url(url: str) -> bool:
+    return urlsplit(url).hostname != 'api.syosetu.com'
+
+
+class RequestFailed(Exception):
+    """
+    Raised when a request still fails after every retry. Unlike a 404 it says nothing about whether the page exists.
+    """
 
 
 def request_with_retries(url, max_attempts=5):
+    """
+    Returns the body, or None for a 404 and for pages missing from the cache with --offline.
+    Raises RequestFailed once throttling, server errors or connection errors outlast the retries.
+    """
+    cached = response_cache.get(url) if response_cache is not None and is_page_url(url) else None
+
+    host = urlsplit(url).hostname
+
+    if script_args.offline:
+        if cached is None:
+            logger.warning(f'{url} is not in the cache')
+            return None
+        cache_hits_total.inc(host=host, kind='offline')
+        return cached.body
+
+    # the server only sends the body again if it has changed
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+
     attempts = 0
 
     success = False
     last_exception = None
 
-    # Create a cookie for the over18 check
-    c = Cookie(
-        version=0,
-        name='over18',
-        value='yes',
-        port=None,
-        port_specified=False,
-        domain='.syosetu.com',
-        domain_specified=True,
-        domain_initial_dot=True,
-        path='/',
-        path_specified=True,
-        secure=False,
-        expires=None,
-        discard=True,
-        comment=None,
-        comment_url=None,
-        rest={},
-        rfc2109=False,
-    )
-
-    cj = CookieJar()
-    cj.set_cookie(c)
-
-    opener = build_opener(HTTPCookieProcessor(cj))
+    bucket = rate_limiter.bucket(url)
 
     while not success and attempts < max_attempts:
+        with rate_limit_wait_seconds.time(host=host):
+            bucket.acquire()
         try:
-            response = opener.open(url)
+            with request_seconds.time(host=host):
+                status, response, response_headers = session.fetch(url, headers)
             success = True
+            bucket.speed_up()
+            responses_total.inc(host=host, status=status)
+            response_bytes_total.inc(len(response), host=host)
+
+            if status == 304 and cached is not None:
+                cache_hits_total.inc(host=host, kind='revalidated')
+                response = cached.body
+            elif is_page_url(url):
+                if response_cache is not None:
+                    response_cache.put(url, response, response_headers.get('ETag'), response_headers.get('Last-Modified'))
+                if page_archive is not None:
+                    page_archive.append(url, response)
         except urllib.error.HTTPError as e:
+            responses_total.inc(host=host, status=e.code)
             if e.code == 404:
                 logger.warning(f'404 error for {url}')
                 return None
 
-            # no need to wait if http error
             last_exception = e
             attempts += 1
 
+            if e.code in (429, 503):
+                # the host is throttling us, every request to it has to wait
+                delay = parse_retry_after(e.headers.get('Retry-After') if e.headers else None)
+                if delay is None:
+                    delay = backoff_delay(attempts)
+                logger.warning(f'HTTP {e.code} for {url}, slowing down for {delay:.1f}s')
+                bucket.slow_down(delay)
+                retries_total.inc(host=host, reason='throttled')
+            elif attempts < max_attempts:
+                retries_total.inc(host=host, reason='http_error')
+                sleep(backoff_delay(attempts))
+
         except Exception as e:
             last_exception = e
             # If the request failed, increment the number of attempts
             attempts += 1
+            responses_total.inc(host=host, status=0)
             logger.warning(f'Failed to request {url}, retrying...')
-            sleep(1)
+            if attempts < max_attempts:
+                retries_total.inc(host=host, reason='connection')
+                sleep(backoff_delay(attempts))
 
     if success:
         # Do something with the response
-        return response.read()
+        return response
     else:
         # If the request failed after the maximum number of attempts, print an error message
         logger.error('Error: Unable to complete the request ' + url)
@@ -69,4 +359,82 @@ def request_with_retries(url, max_attempts=5):
             logger.warning(f'HTTP Error: {last_exception.code}')
         else:
             logger.error(last_exception)
-            raise last_exception
+        raise RequestFailed(f'Unable to complete the request {url}') from last_exception
+
+
+def parse_api_datetime(value) -> datetime:
+    # yaml already parses most timestamps
+    if isinstance(value, datetime):
+        return value
+    return datetime.strptime(str(value), '%Y-%m-%d %H:%M:%S')
+
+
+# novelapi only allows st from 1 to 2000, pages of 500 starting at st=1, 501, 1001 and 1501 reach the 2000th result
+api_max_results = 2000
+
+
+def query_api(url: str) -> list:
+    """
+    Parsed response of novelapi or novel18api. Raises RequestFailed when there is no response, so that a missing
+    page of results is never mistaken for an empty one.
+    """
+    response = request_with_retries(url)
+    if response is None:
+        raise RequestFailed(f'No response from {url}')
+    return yaml.safe_load(response.decode('utf-8'))
+
+
+def _query_window(api: str, time_field: str, start: int, end: int, of: str):
+    """
+    Returns the novels in the window, or None if the window has too many to page through
+    """
+    request_url = f'https://api.syosetu.com/{api}/api/?lim=500&of={of}&{time_field}={start}-{end}'
+    data = query_api(request_url)
+    total_count = int(data[0]['allcount'])
+
+    if total_count > api_max_results:
+        if start < end:
+            return None
+        logger.warning(f'{total_count} novels at {start}, only {api_max_results} can be retrieved')
+
+    novels = data[1:]
+
+    curr_retrieved = 500
+    while curr_retrieved < min(total_count, api_max_results):
+        data = query_api(f'{request_url}&st={curr_retrieved + 1}')
+        novels.extend(data[1:])
+        curr_retrieved += 500
+
+    return novels
+
+
+def query_novels_between(time_field: str, start: int, end: int, of: str, api='novelapi',
+                         workers=1) -> Generator[list[dict], None, None]:
+    """
+    Yields batches of novels whose time_field (lastup, firstup, ...) is between start and end in unix time, inclusive.
+    The api can only page through 2000 results, so larger windows are split in half until every part fits.
+    Windows are queried concurrently when workers > 1, but batches are yielded in the order of their windows.
+    A window that fails raises RequestFailed, and nothing after it has been yielded by then, so the newest saved
+    time never moves past a window that is missing.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='novelapi') as executor:
+        pending = {executor.submit(_query_window, api, time_field, start, end, of): (start, end)}
+        # finished windows by their start, held back while a window before them is pending
+        finished = []
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                window_start, window_end = pending.pop(future)
+                novels = future.result()
+
+                if novels is None:
+                    middle = (window_start + window_end) // 2
+                    for window in ((window_start, middle), (middle + 1, window_end)):
+                        pending[executor.submit(_query_window, api, time_field, *window, of)] = window
+                elif novels:
+                    heapq.heappush(finished, (window_start, novels))
+
+            first_pending = min((window_start for window_start, _ in pending.values()), default=None)
+            while finished and (first_pending is None or finished[0][0] < first_pending):
+                yield heapq.heappop(finished)[1]
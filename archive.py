@@ -0,0 +1,162 @@
+import gzip
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from time import time
+from typing import Iterator, NamedTuple, Optional
+
+segment_size = 1024 * 1024 * 1024
+
+url_kinds = (
+    ('detail', re.compile(r'/novelview/infotop/ncode/(n\w+)/$', re.IGNORECASE)),
+    ('impression', re.compile(r'/impression/list/ncode/\d+/(\?p=\d+)?$')),
+    ('chapter', re.compile(r'syosetu\.com/(n\w+)/\d+/$', re.IGNORECASE)),
+    ('toc', re.compile(r'syosetu\.com/(n\w+)/$', re.IGNORECASE)),
+)
+
+
+def classify_url(url: str) -> tuple[Optional[str], Optional[str]]:
+    """
+    Kind of page and the nid it belongs to, impression pages only show the nid in their content
+    """
+    for kind, pattern in url_kinds:
+        match = pattern.search(url)
+        if match:
+            nid = match.group(1).upper() if kind != 'impression' else None
+            return kind, nid
+    return None, None
+
+
+class RecordLocation(NamedTuple):
+    url: str
+    segment: str
+    offset: int
+    length: int
+
+
+def read_record(directory: str, location: RecordLocation) -> bytes:
+    """
+    Every record is its own gzip member, so it can be read without the rest of the segment
+    """
+    with open(os.path.join(directory, location.segment), 'rb') as f:
+        f.seek(location.offset)
+        record = gzip.decompress(f.read(location.length))
+
+    _, body = record.split(b'\r\n\r\n', 1)
+    # records end with two line breaks
+    return body[:-4]
+
+
+class PageArchive:
+    """
+    Append-only archive of every downloaded page, for extracting fields again after the site layout changes.
+    Pages are written as WARC resource records to segment files of up to 1GB, each record compressed on its own.
+    index.db has the segment, offset and fetch time of every record.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.execute('PRAGMA synchronous = NORMAL')
+        self._connection.execute("""
+CREATE TABLE IF NOT EXISTS records(
+url text,
+kind text NULL,
+nid VARCHAR(7) NULL,
+fetched_timestamp REAL,
+segment text,
+offset integer,
+length integer
+)""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS records_url ON records (url, fetched_timestamp)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS records_nid ON records (nid)")
+        self._connection.commit()
+
+        segments = sorted(name for name in os.listdir(directory) if name.endswith('.warc.gz'))
+        self._segment = segments[-1] if segments else self._segment_name(1)
+
+    @staticmethod
+    def _segment_name(number: int) -> str:
+        return f'pages-{number:05d}.warc.gz'
+
+    def append(self, url: str, body: bytes):
+        fetched = time()
+        header = (
+            'WARC/1.0\r\n'
+            'WARC-Type: resource\r\n'
+            f'WARC-Target-URI: {url}\r\n'
+            f'WARC-Date: {datetime.fromtimestamp(fetched, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}\r\n'
+            'Content-Type: text/html\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            '\r\n'
+        ).encode('utf-8')
+        record = gzip.compress(header + body + b'\r\n\r\n')
+        kind, nid = classify_url(url)
+
+        with self._lock:
+            path = os.path.join(self.directory, self._segment)
+            offset = os.path.getsize(path) if os.path.exists(path) else 0
+            if offset and offset + len(record) > segment_size:
+                self._segment = self._segment_name(int(self._segment[6:11]) + 1)
+                path = os.path.join(self.directory, self._segment)
+                offset = 0
+
+            with open(path, 'ab') as f:
+                f.write(record)
+
+            self._connection.execute(
+                "INSERT INTO records (url, kind, nid, fetched_timestamp, segment, offset, length) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, kind, nid, fetched, self._segment, offset, len(record))
+            )
+            self._connection.commit()
+
+    def latest(self, url: str) -> Optional[RecordLocation]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT url, segment, offset, length FROM records WHERE url = ? ORDER BY fetched_timestamp DESC LIMIT 1",
+                (url,)
+            ).fetchone()
+        return RecordLocation(*row) if row else None
+
+    def read(self, url: str) -> Optional[bytes]:
+        location = self.latest(url)
+        return read_record(self.directory, location) if location else None
+
+    def _stream(self, sql: str) -> Iterator[tuple]:
+        # a connection of its own, so that the whole index is never fetched at once
+        connection = sqlite3.connect(os.path.join(self.directory, 'index.db'))
+        try:
+            yield from connection.execute(sql)
+        finally:
+            connection.close()
+
+    def nids(self) -> Iterator[str]:
+        for row in self._stream("SELECT DISTINCT nid FROM records WHERE kind = 'detail' ORDER BY nid"):
+            yield row[0]
+
+    def latest_of_nid(self, nid: str) -> list[tuple[str, RecordLocation]]:
+        """
+        Kind and location of the latest record of every url of a novel, except its impressions
+        """
+        with self._lock:
+            # sqlite takes the other columns from the row with the largest fetched_timestamp
+            rows = self._connection.execute(
+                "SELECT kind, url, segment, offset, length, MAX(fetched_timestamp) FROM records WHERE nid = ? GROUP BY url",
+                (nid,)
+            ).fetchall()
+        return [(row[0], RecordLocation(*row[1:5])) for row in rows]
+
+    def latest_impression_pages(self) -> Iterator[RecordLocation]:
+        for row in self._stream("SELECT url, segment, offset, length, MAX(fetched_timestamp) FROM records "
+                                "WHERE kind = 'impression' GROUP BY url"):
+            yield RecordLocation(*row[:4])
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
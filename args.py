@@ -1,4 +1,6 @@
 import argparse
+import os
+import sys
 
 parser = argparse.ArgumentParser(
     description="""
@@ -18,6 +20,51 @@ parser = argparse.ArgumentParser(
 
     4. To specify the location of the log file:
     python3 main.py --log-file ./logs/scrape.log 
+
+    5. To scrape a range of novels with 8 concurrent workers:
+    python3 main.py --start-from N1955HZ --end-with N1000HZ --workers 8
+
+    6. To only re-scrape novels updated since a date:
+    python3 main.py --since 2023-04-01
+
+    7. To find every existing nid through the api and then scrape them:
+    python3 retrieve_all_nids.py
+    python3 main.py --from-queue
+
+    8. To split a range between several machines:
+    export NAROU_COORDINATOR_TOKEN=shared-secret
+    python3 coordinator.py --start-from N9999ZZ --end-with N0000AA --serve-port 8765 --serve-host 0.0.0.0
+    python3 main.py --coordinator http://coordinator-host:8765
+
+    9. To merge the databases of several machines into novels.db:
+    python3 merge.py --shards narou-1.db narou-2.db
+
+    10. To scrape again from cached pages only, e.g. after fixing a parser:
+    python3 main.py --start-from N9999ZZ --end-with N0000AA --cache-dir cache --offline --ignore-checkpoint
+
+    11. To keep every downloaded page and extract the fields from them again later:
+    python3 main.py --start-from N9999ZZ --end-with N0000AA --archive-dir archive
+    python3 reextract.py --archive-dir archive
+
+    12. To expose request, parse and database metrics to Prometheus while scraping:
+    python3 main.py --start-from N9999ZZ --end-with N0000AA --metrics-port 9100
+
+    13. To find out where a long crawl spends its time, one flame graph every 10 minutes:
+    python3 main.py --start-from N9999ZZ --end-with N0000AA --profile --profile-window 600
+    flamegraph.pl profile-20240101-120000.folded > profile.svg
+
+    14. To download, parse and save pages at the same time, with 16 download threads:
+    python3 main.py --start-from N9999ZZ --end-with N0000AA --pipeline --fetchers 16
+
+    15. To get the info of novels from the api, 500 novels per request:
+    python3 main.py --since 2023-04-01 --info-source api
+
+    16. To save chapter text compressed, and to compress the chapters saved before:
+    python3 main.py --start-from N9999ZZ --end-with N0000AA --compress-content
+    python3 compress_content.py --train-dictionary
+
+    17. To scrape again the novels which were skipped because their requests kept failing:
+    python3 main.py --retry-failed
     
     このスクリプトはなろう小説をスクレイピングします。
     novels.dbという名前のsqliteデータベースに保存されます。
@@ -35,6 +82,51 @@ parser = argparse.ArgumentParser(
 
     4. ログファイルの場所を指定するには:
     python3 main.py --log-file ./logs/scrape.log 
+
+    5. 8つのワーカーで並行して範囲をスクレイピングするには:
+    python3 main.py --start-from N1955HZ --end-with N1000HZ --workers 8
+
+    6. 指定日以降に更新された小説だけを再スクレイピングするには:
+    python3 main.py --since 2023-04-01
+
+    7. APIで存在するnidをすべて取得してからスクレイピングするには:
+    python3 retrieve_all_nids.py
+    python3 main.py --from-queue
+
+    8. 範囲を複数のマシンで分担するには:
+    export NAROU_COORDINATOR_TOKEN=shared-secret
+    python3 coordinator.py --start-from N9999ZZ --end-with N0000AA --serve-port 8765 --serve-host 0.0.0.0
+    python3 main.py --coordinator http://coordinator-host:8765
+
+    9. 複数のマシンのデータベースをnovels.dbに統合するには:
+    python3 merge.py --shards narou-1.db narou-2.db
+
+    10. キャッシュしたページだけで再度スクレイピングするには:
+    python3 main.py --start-from N9999ZZ --end-with N0000AA --cache-dir cache --offline --ignore-checkpoint
+
+    11. ダウンロードしたページをすべて保存し、後で再度フィールドを抽出するには:
+    python3 main.py --start-from N9999ZZ --end-with N0000AA --archive-dir archive
+    python3 reextract.py --archive-dir archive
+
+    12. スクレイピング中にリクエスト、パース、データベースのメトリクスをPrometheusに公開するには:
+    python3 main.py --start-from N9999ZZ --end-with N0000AA --metrics-port 9100
+
+    13. 長時間のスクレイピングで時間がかかっている箇所を調べるには(10分ごとにフレームグラフを出力):
+    python3 main.py --start-from N9999ZZ --end-with N0000AA --profile --profile-window 600
+    flamegraph.pl profile-20240101-120000.folded > profile.svg
+
+    14. ダウンロード、パース、保存を同時に行うには(ダウンロードは16スレッド):
+    python3 main.py --start-from N9999ZZ --end-with N0000AA --pipeline --fetchers 16
+
+    15. 小説の情報をAPIから500件ずつ取得するには:
+    python3 main.py --since 2023-04-01 --info-source api
+
+    16. 本文を圧縮して保存し、以前に保存した本文も圧縮するには:
+    python3 main.py --start-from N9999ZZ --end-with N0000AA --compress-content
+    python3 compress_content.py --train-dictionary
+
+    17. リクエストが失敗し続けてスキップされた小説を再度スクレイピングするには:
+    python3 main.py --retry-failed
     
     """,
     epilog="""
@@ -60,7 +152,188 @@ parser.add_argument("--skip-impression", action="store_true", default=False,
                     help="When this is enabled, it will skip scraping novel impression(default: %(default)s)")
 parser.add_argument("--skip-existing", action="store_true", default=False,
                     help="When this is enabled, it will skip scraping data has been previously scraped(default: %(default)s)")
+parser.add_argument("--workers", type=int, default=1,
+                    help="Number of novels to scrape concurrently in range mode (default: %(default)s)")
+parser.add_argument("--rate-limit", type=float, default=None,
+                    help="Maximum requests per second to each host, overrides the per host defaults in api.py (default: %(default)s)")
+parser.add_argument("--refresh-content", action="store_true", default=False,
+                    help="Fetch every chapter again, even if its timestamps haven't changed since it was stored (default: %(default)s)")
+parser.add_argument("--since", type=str,
+                    help="Only scrape novels updated since this datetime (ISO format, Japan time unless it has an offset) "
+                         "and not yet scraped after their update. "
+                         "If this is set, --start-from and --end-with are ignored")
+parser.add_argument("--updated-between", type=str, nargs=2, metavar=('START', 'END'),
+                    help="Like --since, but only for novels updated between the two datetimes (ISO format, inclusive)")
+parser.add_argument("--html-parser", type=str, default="auto", choices=["auto", "lxml", "html.parser"],
+                    help="Parser used by BeautifulSoup, auto uses lxml when it is installed (default: %(default)s)")
+parser.add_argument("--db-batch-size", type=int, default=100,
+                    help="Number of chapters written to the database with one statement (default: %(default)s)")
+parser.add_argument("--db-cache-mb", type=int, default=64,
+                    help="Size of the sqlite page cache in megabytes (default: %(default)s)")
+parser.add_argument("--checkpoint-pages", type=int, default=50,
+                    help="Commit and record progress every this many impression pages or chapters (default: %(default)s)")
+parser.add_argument("--ignore-checkpoint", action="store_true", default=False,
+                    help="Start a range from --start-from even if a previous run of the same range was interrupted (default: %(default)s)")
+parser.add_argument("--dead-nid-ttl-days", type=float, default=30,
+                    help="Nids which returned an error page are skipped by range sweeps for up to this many days (default: %(default)s)")
+parser.add_argument("--recheck-dead", action="store_true", default=False,
+                    help="Probe nids which are known to have no novel in range sweeps (default: %(default)s)")
+parser.add_argument("--from-queue", action="store_true", default=False,
+                    help="Scrape the nids found by retrieve_all_nids.py which haven't been scraped yet. "
+                         "If this is set, --start-from and --end-with are ignored (default: %(default)s)")
+parser.add_argument("--retry-failed", action="store_true", default=False,
+                    help="Scrape the novels which were skipped because their requests kept failing. "
+                         "If this is set, --start-from and --end-with are ignored (default: %(default)s)")
+parser.add_argument("--shard", type=str,
+                    help="Only scrape part INDEX of COUNT equal parts of the range, formatted as INDEX/COUNT (e.g. 0/4)")
+parser.add_argument("--interleave-shards", action="store_true", default=False,
+                    help="Shards take every COUNT-th nid instead of a contiguous block of the range (default: %(default)s)")
+parser.add_argument("--coordinator", type=str,
+                    help="Scrape batches leased from a coordinator, either its url or the path of its queue database. "
+                         "If this is set, --start-from and --end-with are ignored")
+parser.add_argument("--worker-id", type=str,
+                    help="Name of this worker for the coordinator (default: hostname and pid)")
+parser.add_argument("--lease-seconds", type=float, default=600,
+                    help="Batches leased by a worker which stops renewing them are given to other workers after this long (default: %(default)s)")
+parser.add_argument("--coordinator-token", type=str, default=os.environ.get('NAROU_COORDINATOR_TOKEN'),
+                    help="Shared secret between coordinator.py and its workers, "
+                         "defaults to the NAROU_COORDINATOR_TOKEN environment variable")
+parser.add_argument("--pipeline", action='store_true',
+                    help="Download, parse and save pages in separate stages which run at the same time")
+parser.add_argument("--fetchers", type=int, default=8,
+                    help="Number of threads downloading pages with --pipeline (default: %(default)s)")
+parser.add_argument("--parsers", type=int, default=os.cpu_count() or 1,
+                    help="Number of processes parsing pages with --pipeline (default: number of CPUs)")
+parser.add_argument("--impression-workers", type=int, default=4,
+                    help="Number of impression pages of a novel downloaded concurrently (default: %(default)s)")
+parser.add_argument("--refresh-impressions", action='store_true',
+                    help="Walk every impression page instead of stopping at impressions which were already scraped")
+parser.add_argument("--cache-dir", type=str, default=None,
+                    help="Keep downloaded pages in this directory and only download them again if they have changed")
+parser.add_argument("--cache-size-mb", type=int, default=10240,
+                    help="Size of --cache-dir after which the least recently used pages are removed (default: %(default)s)")
+parser.add_argument("--offline", action='store_true',
+                    help="Only read pages from --cache-dir, pages which are not cached are treated as missing")
+parser.add_argument("--archive-dir", type=str, default=None,
+                    help="Append every downloaded page to an archive in this directory, see reextract.py")
+parser.add_argument("--compress-content", action='store_true',
+                    help="Save chapter text compressed in novel_content_text instead of novel_content, see compress_content.py. "
+                         "The text columns of novel_content are NULL for compressed chapters, read them with models.load_novel_contents")
+parser.add_argument("--info-source", type=str, choices=['html', 'api'], default='html',
+                    help="Where novel info comes from, api gets the info of 500 novels per request. "
+                         "api scrapes one novel at a time and can't be combined with --workers or --pipeline (default: %(default)s)")
+parser.add_argument("--host-override", type=str, default=None, metavar='HOST:PORT',
+                    help="Send every request over http to this address instead, e.g. to fixture_server.py")
+parser.add_argument("--metrics-port", type=int, default=None,
+                    help="Serve counters and histograms in the Prometheus text format on http://localhost:PORT/metrics")
+parser.add_argument("--metrics-host", type=str, default="127.0.0.1",
+                    help="Address the metrics endpoint listens on, 0.0.0.0 to let other machines scrape it (default: %(default)s)")
+parser.add_argument("--metrics-interval", type=float, default=60,
+                    help="Seconds between metric summaries in the log, 0 to disable (default: %(default)s)")
+parser.add_argument("--profile", action="store_true",
+                    help="Sample the stacks of every thread and write them as collapsed stacks for flamegraph.pl or speedscope")
+parser.add_argument("--profile-interval-ms", type=float, default=10,
+                    help="Milliseconds between stack samples (default: %(default)s)")
+parser.add_argument("--profile-window", type=float, default=300,
+                    help="Seconds of samples in every output file, 0 for one file at exit (default: %(default)s)")
+parser.add_argument("--profile-output", type=str, default="profile.folded",
+                    help="Output files are named after it with the start of the window appended (default: %(default)s)")
+
+
+# Flags of the scripts other than main.py, only the script which is running accepts them and lists them in its --help
+tool_arguments = {}
+
+
+def arguments_of(*scripts: str):
+    def register(add_arguments):
+        for script in scripts:
+            tool_arguments.setdefault(script, []).append(add_arguments)
+        return add_arguments
+    return register
+
+
+@arguments_of('fixture_server', 'benchmark')
+def add_fixture_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('fixture_server.py')
+    group.add_argument("--fixture-port", type=int, default=8800,
+                       help="Port of fixture_server.py and benchmark.py (default: %(default)s)")
+    group.add_argument("--fixture-archive", type=str, default=None,
+                       help="Make fixture_server.py replay the pages of this --archive-dir instead of generating them")
+    group.add_argument("--fixture-chapters", type=int, default=20,
+                       help="Chapters of every generated novel (default: %(default)s)")
+    group.add_argument("--fixture-impression-pages", type=int, default=3,
+                       help="Impression pages of every generated novel (default: %(default)s)")
+    group.add_argument("--fixture-dead-rate", type=float, default=0.2,
+                       help="Share of nids which return an error page (default: %(default)s)")
+    group.add_argument("--fixture-latency-ms", type=float, default=0,
+                       help="Delay before every fixture response (default: %(default)s)")
+    group.add_argument("--fixture-error-rate", type=float, default=0,
+                       help="Share of fixture responses which fail with 503 (default: %(default)s)")
+
+
+@arguments_of('benchmark')
+def add_benchmark_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('benchmark.py')
+    group.add_argument("--benchmark-novels", type=int, default=50,
+                       help="Number of nids scraped by every benchmark mode (default: %(default)s)")
+    group.add_argument("--benchmark-modes", type=str, nargs='+', choices=['serial', 'workers', 'pipeline'],
+                       default=['serial', 'workers', 'pipeline'], help="Modes compared by benchmark.py (default: all)")
+
+
+@arguments_of('coordinator')
+def add_coordinator_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('coordinator.py')
+    group.add_argument("--queue-db", type=str, default="queue.db",
+                       help="Queue database of coordinator.py (default: %(default)s)")
+    group.add_argument("--batch-size", type=int, default=1000,
+                       help="Number of nids in each batch created by coordinator.py (default: %(default)s)")
+    group.add_argument("--serve-port", type=int,
+                       help="Port coordinator.py serves the queue on, without it workers need to share the queue database file")
+    group.add_argument("--serve-host", type=str, default="127.0.0.1",
+                       help="Address coordinator.py serves the queue on, other machines need e.g. 0.0.0.0 and --coordinator-token "
+                            "(default: %(default)s)")
+
+
+@arguments_of('merge')
+def add_merge_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('merge.py')
+    group.add_argument("--shards", type=str, nargs='+', metavar='SHARD',
+                       help="Databases merged into novels.db by merge.py")
+
+
+@arguments_of('compress_content')
+def add_compression_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('compress_content.py')
+    group.add_argument("--train-dictionary", action='store_true',
+                       help="Train a new compression dictionary on stored chapters before compressing them with compress_content.py")
+    group.add_argument("--dictionary-samples", type=int, default=2000,
+                       help="Number of chapters the compression dictionary is trained on (default: %(default)s)")
+
+
+@arguments_of('retrieve_all_nids')
+def add_discovery_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('retrieve_all_nids.py')
+    group.add_argument("--discovery-workers", type=int, default=4,
+                       help="Number of concurrent api requests in retrieve_all_nids.py (default: %(default)s)")
+    group.add_argument("--full-discovery", action="store_true", default=False,
+                       help="Make retrieve_all_nids.py page through the whole catalogue instead of only new novels (default: %(default)s)")
+
 
 parser.set_defaults(log_file="scrape.log", reset=False, start_from="N9999ZZ", end_with="N0000AA", skip_r18=False)
 
+script_name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+for add_arguments in tool_arguments.get(script_name, []):
+    add_arguments(parser)
+
 script_args = parser.parse_args()
+
+# the modules of the other scripts can still be imported, their flags keep the defaults
+tool_defaults = argparse.ArgumentParser(add_help=False)
+for add_arguments in dict.fromkeys(add for adds in tool_arguments.values() for add in adds):
+    add_arguments(tool_defaults)
+for name, value in vars(tool_defaults.parse_args([])).items():
+    if not hasattr(script_args, name):
+        setattr(script_args, name, value)
+
+if script_args.info_source == 'api' and (script_args.workers > 1 or script_args.pipeline):
+    parser.error("--info-source api can't be combined with --workers or --pipeline")
@@ -0,0 +1,124 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer
+
+from args import script_args
+from content import get_chapter_text
+from fixture_server import (FixtureSite, chapter_page, detail_page, fixture_site_from_args, impression_page,
+                            start_fixture_server, table_of_contents_page)
+from impression import extract_impressions
+from logger import logger
+from nid import Nid
+from novel_info import extract_novel_info
+from soup import impression_strainer, make_soup, table_of_contents_strainer
+
+# Extra arguments of main.py for every mode
+modes = {
+    'serial': [],
+    'workers': ['--workers', '4'],
+    'pipeline': ['--pipeline'],
+}
+
+
+def benchmark_parsers(site: FixtureSite, repeat=200) -> dict[str, float]:
+    """
+    Milliseconds to parse and extract one page of each kind
+    """
+    nid = 'N1234AB'
+    pages = {
+        'detail': (detail_page(nid), lambda body: extract_novel_info(make_soup(body))),
+        'toc': (table_of_contents_page(nid, site.chapters),
+                lambda body: make_soup(body, parse_only=table_of_contents_strainer).select('.index_box dl')),
+        # chapters are extracted without a soup
+        'chapter': (chapter_page(nid, 1, site.paragraphs), get_chapter_text),
+        'impression': (impression_page(nid, 1, site.impression_pages, site.comments),
+                       lambda body: extract_impressions(make_soup(body, parse_only=impression_strainer))),
+    }
+
+    results = {}
+    for kind, (page, extract) in pages.items():
+        body = page.encode('utf-8')
+        start_time = default_timer()
+        for _ in range(repeat):
+            extract(body)
+        results[kind] = (default_timer() - start_time) / repeat * 1000
+    return results
+
+
+def count_rows(database: str) -> int:
+    connection = sqlite3.connect(database)
+    try:
+        return sum(connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                   for table in ('novel_info', 'novel_content', 'novel_impression'))
+    finally:
+        connection.close()
+
+
+def benchmark_mode(site: FixtureSite, mode: str, start_from: Nid, end_with: Nid) -> dict:
+    """
+    Scrapes the range from the fixture server with main.py in a fresh directory.
+    main.py runs in its own process so that its peak RSS can be measured.
+    """
+    directory = tempfile.mkdtemp(prefix=f'narou-benchmark-{mode}-')
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py'),
+        '--start-from', start_from.id, '--end-with', end_with.id,
+        '--host-override', f'127.0.0.1:{script_args.fixture_port}',
+        '--rate-limit', str(script_args.rate_limit or 1000),
+        *modes[mode],
+    ]
+
+    requests_before = site.requests
+    start_time = default_timer()
+    process = subprocess.Popen(command, cwd=directory, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = default_timer() - start_time
+
+    if status != 0:
+        logger.error(f'Benchmark of {mode} failed, see {directory}/scrape.log')
+        return {'mode': mode, 'failed': True, 'directory': directory}
+
+    rows = count_rows(os.path.join(directory, 'novels.db'))
+    pages = site.requests - requests_before
+    novels = abs(start_from.distance(end_with)) + 1
+
+    return {
+        'mode': mode,
+        'seconds': elapsed,
+        'novels_per_second': novels / elapsed,
+        'pages_per_second': pages / elapsed,
+        'rows_per_second': rows / elapsed,
+        # kilobytes on linux, parser processes of the pipeline are not included
+        'peak_rss_mb': usage.ru_maxrss / 1024,
+        'directory': directory,
+    }
+
+
+if __name__ == '__main__':
+    site = fixture_site_from_args()
+    server = start_fixture_server(site, script_args.fixture_port)
+
+    parse_results = benchmark_parsers(site)
+    for kind, milliseconds in parse_results.items():
+        print(f'parse {kind:<10} {milliseconds:8.2f} ms/page')
+
+    start_from = Nid('N5000AA')
+    end_with = start_from - (script_args.benchmark_novels - 1)
+
+    results = []
+    for mode in script_args.benchmark_modes:
+        result = benchmark_mode(site, mode, start_from, end_with)
+        results.append(result)
+
+        if result.get('failed'):
+            print(f'{mode:<10} failed, see {result["directory"]}')
+            continue
+        print(f'{mode:<10} {result["novels_per_second"]:8.2f} novels/s {result["pages_per_second"]:8.2f} pages/s '
+              f'{result["rows_per_second"]:9.1f} rows/s {result["peak_rss_mb"]:7.1f} MB peak RSS')
+
+    logger.info(f'Benchmark {json.dumps({"parse_ms": parse_results, "modes": results})}')
+    server.shutdown()
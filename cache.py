@@ -0,0 +1,151 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import zlib
+from time import time
+from typing import NamedTuple, Optional
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+class ResponseCache:
+    """
+    Raw responses on disk, compressed and stored by the sha256 of their body so identical pages are only stored once.
+    index.db maps urls to bodies and keeps the validators for conditional requests.
+    When the bodies grow over max_bytes, the least recently used urls are evicted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.execute('PRAGMA synchronous = NORMAL')
+        self._connection.execute("""
+CREATE TABLE IF NOT EXISTS responses(
+url text PRIMARY KEY,
+digest text,
+etag text NULL,
+last_modified text NULL,
+fetched_timestamp REAL,
+accessed_timestamp REAL
+)""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_timestamp)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_digest ON responses (digest)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS blobs(digest text PRIMARY KEY, size integer)")
+        self._connection.commit()
+
+        self.total_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT digest, etag, last_modified FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        digest, etag, last_modified = row
+        try:
+            with open(self._blob_path(digest), 'rb') as f:
+                body = zlib.decompress(f.read())
+        except FileNotFoundError:
+            return None
+
+        self.touch(url)
+        return CachedResponse(body, etag, last_modified)
+
+    def touch(self, url: str):
+        with self._lock:
+            self._connection.execute("UPDATE responses SET accessed_timestamp = ? WHERE url = ?", (time(), url))
+            self._connection.commit()
+
+    def put(self, url: str, body: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        digest = hashlib.sha256(body).hexdigest()
+
+        with self._lock:
+            stored = self._connection.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        # compressed outside the lock, most pages are new
+        compressed = zlib.compress(body) if stored is None else None
+
+        now = time()
+        with self._lock:
+            # checked again in the same hold as the insert, the blob may have been evicted in the meantime
+            if self._connection.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone() is None:
+                if compressed is None:
+                    compressed = zlib.compress(body)
+                self._write_blob(digest, compressed)
+                self._connection.execute("INSERT INTO blobs (digest, size) VALUES (?, ?)", (digest, len(compressed)))
+                self.total_bytes += len(compressed)
+
+            previous = self._connection.execute("SELECT digest FROM responses WHERE url = ?", (url,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (url, digest, etag, last_modified, fetched_timestamp, accessed_timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, digest, etag, last_modified, now, now)
+            )
+            if previous is not None and previous[0] != digest:
+                self._remove_unused_blob(previous[0])
+
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self._connection.commit()
+
+    def _write_blob(self, digest: str, compressed: bytes):
+        path = self._blob_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written under another name first, so a crash never leaves a truncated blob
+        temporary_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(compressed)
+        os.replace(temporary_path, path)
+
+    def _remove_unused_blob(self, digest: str):
+        if self._connection.execute("SELECT 1 FROM responses WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+            return
+
+        size = self._connection.execute("SELECT size FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        self._connection.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        if size is not None:
+            self.total_bytes -= size[0]
+
+        try:
+            os.remove(self._blob_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        # leave some room so that every put doesn't have to evict
+        target = self.max_bytes * 0.9
+
+        while self.total_bytes > target:
+            rows = self._connection.execute(
+                "SELECT url, digest FROM responses ORDER BY accessed_timestamp LIMIT 100"
+            ).fetchall()
+            if not rows:
+                return
+
+            for url, digest in rows:
+                self._connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self._remove_unused_blob(digest)
+                if self.total_bytes <= target:
+                    return
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,107 @@
+from html.parser import HTMLParser
+from typing import Optional
+
+# Sections of a chapter page in the order they are returned
+section_ids = ('novel_p', 'novel_honbun', 'novel_a')
+
+
+class ChapterTextParser(HTMLParser):
+    """
+    Collects the paragraphs of the chapter sections while tokenizing, no tree is built.
+    Matches content.get_content_string: only <p> with an id starting with L are kept, the text of every node
+    in them is stripped and concatenated like get_text(strip=True), and empty paragraphs become line breaks.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = {section_id: [] for section_id in section_ids}
+
+        # the open section, its tag and how many tags of that name are open inside it
+        self._section: Optional[str] = None
+        self._section_tag: Optional[str] = None
+        self._depth = 0
+
+        # texts of the open paragraph and of its current node
+        self._paragraph: Optional[list[str]] = None
+        self._data: list[str] = []
+
+    def _end_node(self):
+        if self._data:
+            text = ''.join(self._data).strip()
+            if text:
+                self._paragraph.append(text)
+            self._data = []
+
+    def _end_paragraph(self):
+        self._end_node()
+        text = ''.join(self._paragraph)
+        self.paragraphs[self._section].append(text or '\n')
+        self._paragraph = None
+
+    def handle_starttag(self, tag, attrs):
+        if self._section is None:
+            element_id = dict(attrs).get('id')
+            if element_id in self.paragraphs:
+                self._section, self._section_tag, self._depth = element_id, tag, 1
+            return
+
+        if tag == self._section_tag:
+            self._depth += 1
+
+        if tag == 'p':
+            # a <p> closes the one before it
+            if self._paragraph is not None:
+                self._end_paragraph()
+            if (dict(attrs).get('id') or '').startswith('L'):
+                self._paragraph = []
+        elif self._paragraph is not None:
+            self._end_node()
+
+    def handle_startendtag(self, tag, attrs):
+        if self._paragraph is not None:
+            self._end_node()
+
+    def handle_endtag(self, tag):
+        if self._section is None:
+            return
+
+        if self._paragraph is not None:
+            if tag == 'p':
+                self._end_paragraph()
+            else:
+                self._end_node()
+
+        if tag == self._section_tag:
+            self._depth -= 1
+            if self._depth == 0:
+                if self._paragraph is not None:
+                    self._end_paragraph()
+                self._section = self._section_tag = None
+
+    def handle_data(self, data):
+        if self._paragraph is not None:
+            self._data.append(data)
+
+    def handle_comment(self, data):
+        # comments are separate nodes which get_text leaves out
+        if self._paragraph is not None:
+            self._end_node()
+
+    def close(self):
+        super().close()
+        if self._paragraph is not None:
+            self._end_paragraph()
+
+    def sections(self) -> tuple[str, str, str]:
+        pre, content, post = ('\n'.join(self.paragraphs[section_id]) for section_id in section_ids)
+        return pre, content, post
+
+
+def extract_chapter_text(body: bytes) -> tuple[str, str, str]:
+    """
+    Pre, main and post text of a chapter page
+    """
+    parser = ChapterTextParser()
+    parser.feed(body.decode('utf-8', errors='replace'))
+    parser.close()
+    return parser.sections()
@@ -0,0 +1,85 @@
+from datetime import datetime
+
+from args import script_args
+from compression import TextCompressor, default_codec, has_zstandard, pack_text, save_dictionary, train_dictionary
+from logger import logger
+from models import connect, db_name, get_content_compressor, initialize_db
+
+
+def train(connection, sample_count: int) -> int:
+    """
+    Trains a dictionary on random chapters, text compressed after this uses it
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT pre_content, content, post_content FROM novel_content WHERE content IS NOT NULL ORDER BY RANDOM() LIMIT ?",
+        (sample_count,)
+    )
+    samples = [pack_text(*row) for row in cursor.fetchall()]
+    if not samples:
+        raise SystemExit('There is no uncompressed content to train on')
+
+    codec = default_codec()
+    if not has_zstandard:
+        logger.warning('zstandard is not installed, training a zlib dictionary instead')
+    dictionary = train_dictionary(samples, codec)
+    dictionary_id = save_dictionary(cursor, codec, dictionary, datetime.now())
+    connection.commit()
+
+    logger.info(f'Trained a {len(dictionary)} byte {codec} dictionary on {len(samples)} chapters')
+    return dictionary_id
+
+
+def compress_existing(connection, compressor: TextCompressor, batch_size: int):
+    """
+    Moves uncompressed text from novel_content to novel_content_text, one committed batch at a time
+    """
+    cursor = connection.cursor()
+    last_rowid = 0
+    compressed = original = 0
+
+    while True:
+        cursor.execute(
+            """
+            SELECT rowid, nid, created_datetime, pre_content, content, post_content FROM novel_content
+            WHERE rowid > ? AND content IS NOT NULL ORDER BY rowid LIMIT ?
+            """,
+            (last_rowid, batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+
+        texts = []
+        for rowid, nid, created, pre, content, post in rows:
+            text = pack_text(pre, content, post)
+            data = compressor.compress(text)
+            original += len(text)
+            compressed += len(data)
+            texts.append((nid, created, compressor.codec, compressor.dictionary_id, data))
+
+        cursor.executemany(
+            'INSERT OR REPLACE INTO novel_content_text (nid, created_datetime, codec, dictionary_id, data) VALUES (?, ?, ?, ?, ?)',
+            texts
+        )
+        cursor.executemany(
+            "UPDATE novel_content SET content = NULL, pre_content = NULL, post_content = NULL WHERE rowid = ?",
+            [(row[0],) for row in rows]
+        )
+        connection.commit()
+
+        last_rowid = rows[-1][0]
+        logger.info(f'Compressed {original} bytes of text to {compressed} bytes')
+
+    logger.info('Run VACUUM on the database to give the freed pages back to the file system')
+
+
+if __name__ == '__main__':
+    initialize_db()
+    conn = connect(db_name)
+
+    if script_args.train_dictionary:
+        train(conn, script_args.dictionary_samples)
+
+    compress_existing(conn, get_content_compressor(conn.cursor()), script_args.db_batch_size)
+    conn.close()
@@ -0,0 +1,104 @@
+import json
+import threading
+import zlib
+from collections import Counter
+from typing import Optional
+
+try:
+    import zstandard
+    has_zstandard = True
+except ImportError:
+    has_zstandard = False
+
+# zlib only looks back 32KB, a larger preset dictionary is wasted
+zlib_dictionary_size = 32 * 1024
+zstd_dictionary_size = 112 * 1024
+
+
+def default_codec() -> str:
+    return 'zstd' if has_zstandard else 'zlib'
+
+
+def pack_text(pre: Optional[str], content: Optional[str], post: Optional[str]) -> bytes:
+    return json.dumps([pre, content, post], ensure_ascii=False).encode('utf-8')
+
+
+def unpack_text(data: bytes) -> tuple[Optional[str], Optional[str], Optional[str]]:
+    pre, content, post = json.loads(data.decode('utf-8'))
+    return pre, content, post
+
+
+def train_dictionary(samples: list[bytes], codec: str) -> bytes:
+    """
+    zstd trains its own dictionary. zlib can only use a preset window, so it gets the most common lines of the
+    samples with the most common ones last, where back references to them are shortest.
+    """
+    if codec == 'zstd':
+        return zstandard.train_dictionary(zstd_dictionary_size, samples).as_bytes()
+
+    counts = Counter()
+    for sample in samples:
+        # a line counts once per sample, so that a single repetitive chapter doesn't dominate.
+        # pack_text escapes line breaks
+        counts.update(set(line for line in sample.split(b'\\n') if len(line) > 3))
+
+    dictionary = b''
+    for line, count in counts.most_common():
+        if count < 2:
+            break
+        if len(dictionary) + len(line) + 2 > zlib_dictionary_size:
+            continue
+        dictionary = line + b'\\n' + dictionary
+    return dictionary
+
+
+class TextCompressor:
+    """
+    Compresses chapter text with a dictionary from the compression_dictionaries table.
+    Compression contexts are kept per thread, zstd contexts can't be shared between threads.
+    """
+
+    def __init__(self, codec: str, dictionary_id: Optional[int] = None, dictionary: Optional[bytes] = None):
+        if codec == 'zstd' and not has_zstandard:
+            raise RuntimeError('zstandard is not installed')
+
+        self.codec = codec
+        self.dictionary_id = dictionary_id
+        self.dictionary = dictionary
+        self._local = threading.local()
+
+    def _zstd_dictionary(self) -> Optional['zstandard.ZstdCompressionDict']:
+        return zstandard.ZstdCompressionDict(self.dictionary) if self.dictionary else None
+
+    def compress(self, data: bytes) -> bytes:
+        if self.codec == 'zstd':
+            compressor = getattr(self._local, 'compressor', None)
+            if compressor is None:
+                compressor = self._local.compressor = zstandard.ZstdCompressor(level=10, dict_data=self._zstd_dictionary())
+            return compressor.compress(data)
+
+        compressor = zlib.compressobj(9, zdict=self.dictionary) if self.dictionary else zlib.compressobj(9)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.codec == 'zstd':
+            decompressor = getattr(self._local, 'decompressor', None)
+            if decompressor is None:
+                decompressor = self._local.decompressor = zstandard.ZstdDecompressor(dict_data=self._zstd_dictionary())
+            return decompressor.decompress(data)
+
+        decompressor = zlib.decompressobj(zdict=self.dictionary) if self.dictionary else zlib.decompressobj()
+        return decompressor.decompress(data) + decompressor.flush()
+
+
+def load_compressors(cursor) -> dict[int, TextCompressor]:
+    cursor.execute("SELECT id, codec, dictionary FROM compression_dictionaries")
+    return {dictionary_id: TextCompressor(codec, dictionary_id, dictionary)
+            for dictionary_id, codec, dictionary in cursor.fetchall()}
+
+
+def save_dictionary(cursor, codec: str, dictionary: bytes, created) -> int:
+    cursor.execute("INSERT INTO compression_dictionaries (codec, dictionary, created_datetime) VALUES (?, ?, ?)",
+                   (codec, dictionary, created))
+    return cursor.lastrowid
+
@@ -1,15 +1,17 @@
 import unicodedata
 from datetime import datetime
-from typing import Generator, Optional
+from typing import Dict, Generator, Optional
 from urllib.parse import urljoin
 
-from bs4 import BeautifulSoup
-
 from api import request_with_retries
+from chapter_text import extract_chapter_text
 from logger import logger
-from models import NovelContentModel, NovelInfoModel
+from metrics import extract_seconds, timed
+from models import ContentRecord, NovelInfoModel
+from soup import make_soup, table_of_contents_strainer
 
 
+@timed(extract_seconds, page='single_page')
 def get_content_string(content_page_soup) -> (Optional[str], str, Optional[str]):
     def get_as_str(soup):
         if soup is None:
@@ -32,50 +34,47 @@ def get_content_string(content_page_soup) -> (Optional[str], str, Optional[str])
     return pre, content, post
 
 
-def novel_content_generator(nid: str, info: NovelInfoModel, is_r18=False) -> Generator[NovelContentModel, None, None]:
+@timed(extract_seconds, page='chapter')
+def get_chapter_text(body: bytes) -> tuple[str, str, str]:
     """
-    Use generator to save memory
+    Same result as get_content_string on the soup of the page, without building the soup. See chapter_text.py
     """
+    return extract_chapter_text(body)
 
-    url = f'https://ncode.syosetu.com/{nid}/'
-    if is_r18:
-        url = f'https://novel18.syosetu.com/{nid}/'
-
-    response = request_with_retries(url)
-    list_page_soup = BeautifulSoup(response, 'html.parser')
 
+def single_page_content(nid: str, info: NovelInfoModel, list_page_soup) -> ContentRecord:
+    """
+    Short stories have their content on the table of contents page
+    """
+    pre, content, post = get_content_string(list_page_soup)
+
+    return ContentRecord(
+        nid=nid,
+        title=info.title,
+        last_updated_datetime=info.last_updated_datetime,
+        created_datetime=info.released_datetime,
+        part=None,
+        content=content,
+        pre_content=pre,
+        post_content=post,
+        page_num=1  # an assumption
+    )
+
+
+@timed(extract_seconds, page='toc')
+def table_of_contents_entries(list_page_soup, url: str) -> list[tuple[str, str, datetime, Optional[datetime], Optional[str]]]:
+    """
+    Url, title, created and last updated datetime and chapter title of every page in the table of contents
+    """
+    entries = []
     chapter_title = None
 
-    num_of_pages = len(list_page_soup.select('.index_box dl.novel_sublist2'))
-    count = 0
-
-    # This is when there is no table of content
-    if list_page_soup.select_one('.index_box') is None:
-        content_page_soup = list_page_soup
-        get_content_string(content_page_soup)
-        pre, content, post = get_content_string(content_page_soup)
-
-        count += 1
-        novel_content = NovelContentModel(
-            nid=nid,
-            title=info.title,
-            last_updated_datetime=info.last_updated_datetime,
-            created_datetime=info.released_datetime,
-            part=chapter_title,
-            content=content,
-            pre_content=pre,
-            post_content=post,
-            page_num=count  # an assumption
-        )
-        yield novel_content
-        return
-
     for tag in list_page_soup.select_one('.index_box').children:
         if tag.name == 'div' and 'chapter_title' in tag.get('class', []):
             chapter_title = tag.text.strip()
             chapter_title = unicodedata.normalize('NFKD', chapter_title)
         elif tag.name == 'dl' and 'novel_sublist2' in tag.get('class', []):
-            url = urljoin(url, tag.dd.a['href'])
+            page_url = urljoin(url, tag.dd.a['href'])
             title = tag.dd.a.text.strip()
 
             created_str = tag.dt.text.split("（")[0].strip()
@@ -87,21 +86,62 @@ def novel_content_generator(nid: str, info: NovelInfoModel, is_r18=False) -> Gen
             else:
                 last_update = None
 
-            response = request_with_retries(url)
-            content_page_soup = BeautifulSoup(response, 'html.parser')
-            pre, content, post = get_content_string(content_page_soup)
-
-            count += 1
-            novel_content = NovelContentModel(
-                nid=nid,
-                title=title,
-                last_updated_datetime=last_update,
-                created_datetime=created,
-                part=chapter_title,
-                content=content,
-                pre_content=pre,
-                post_content=post,
-                page_num=count  # an assumption
-            )
-            logger.info(f'[{count}/{num_of_pages}] {nid} content')
-            yield novel_content
+            entries.append((page_url, title, created, last_update, chapter_title))
+
+    return entries
+
+
+def novel_content_generator(nid: str, info: NovelInfoModel, is_r18=False,
+                            stored_chapters: Optional[Dict[datetime, Optional[datetime]]] = None,
+                            skip_pages=0) -> Generator[ContentRecord, None, None]:
+    """
+    Use generator to save memory
+    stored_chapters maps created_datetime to last_updated_datetime of chapters already in the database,
+    chapters whose timestamps in the table of contents haven't changed are not fetched again.
+    The first skip_pages chapters are not fetched either, they were saved by an interrupted run.
+    """
+    stored_chapters = stored_chapters or {}
+
+    url = f'https://ncode.syosetu.com/{nid}/'
+    if is_r18:
+        url = f'https://novel18.syosetu.com/{nid}/'
+
+    response = request_with_retries(url)
+    list_page_soup = make_soup(response, parse_only=table_of_contents_strainer)
+
+    # This is when there is no table of content
+    if list_page_soup.select_one('.index_box') is None:
+        yield single_page_content(nid, info, list_page_soup)
+        return
+
+    entries = table_of_contents_entries(list_page_soup, url)
+    # only the entries are kept while the chapters are fetched, decompose breaks the reference cycles of the tree
+    # so that it is freed right away instead of at the next garbage collection
+    list_page_soup.decompose()
+    del response, list_page_soup
+    num_of_pages = len(entries)
+    skipped = 0
+
+    for count, (url, title, created, last_update, chapter_title) in enumerate(entries, start=1):
+        if count <= skip_pages or (created in stored_chapters and stored_chapters[created] == last_update):
+            skipped += 1
+            continue
+
+        pre, content, post = get_chapter_text(request_with_retries(url))
+
+        novel_content = ContentRecord(
+            nid=nid,
+            title=title,
+            last_updated_datetime=last_update,
+            created_datetime=created,
+            part=chapter_title,
+            content=content,
+            pre_content=pre,
+            post_content=post,
+            page_num=count  # an assumption
+        )
+        logger.info(f'[{count}/{num_of_pages}] {nid} content')
+        yield novel_content
+
+    if skipped:
+        logger.info(f'Skipped {skipped} unchanged chapters of {nid}')
@@ -0,0 +1,249 @@
+import hmac
+import json
+import sqlite3
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from typing import Optional
+
+from args import script_args
+from logger import logger
+from nid import Nid, int_to_nid, nid_range
+
+
+class WorkQueue:
+    """
+    Batches of a nid range shared by crawler nodes, stored in a sqlite file.
+    A worker leases a batch for a limited time. If it doesn't complete or renew the lease before it expires,
+    the batch is handed to the next worker that asks, so batches of crashed nodes are not lost.
+    Batches are stored as python range arguments over the integers from nid.nid_to_int.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        connection = self._connect()
+        connection.execute("""
+CREATE TABLE IF NOT EXISTS batches(
+id integer PRIMARY KEY,
+range_start integer,
+range_stop integer,
+range_step integer,
+status text,
+worker text NULL,
+lease_expires REAL NULL,
+attempts integer DEFAULT 0,
+result text NULL,
+completed_datetime DATETIME NULL
+)""")
+        connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # transactions are started explicitly, so that leasing can lock the file before reading
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.execute('PRAGMA journal_mode = WAL')
+        return connection
+
+    def create_batches(self, nids: range, batch_size: int) -> int:
+        """
+        Splits nids into batches, does nothing if the queue already has batches
+        """
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            if connection.execute('SELECT COUNT(*) FROM batches').fetchone()[0]:
+                connection.execute('ROLLBACK')
+                return 0
+
+            batches = [nids[i:i + batch_size] for i in range(0, len(nids), batch_size)]
+            connection.executemany(
+                "INSERT INTO batches (range_start, range_stop, range_step, status) VALUES (?, ?, ?, 'pending')",
+                [(batch.start, batch.stop, batch.step) for batch in batches]
+            )
+            connection.execute('COMMIT')
+            return len(batches)
+        finally:
+            connection.close()
+
+    def lease(self, worker: str, lease_seconds: float) -> Optional[dict]:
+        connection = self._connect()
+        try:
+            now = time()
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(
+                """
+                SELECT id, range_start, range_stop, range_step FROM batches
+                WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?)
+                ORDER BY id LIMIT 1
+                """,
+                (now,)
+            ).fetchone()
+
+            if row is None:
+                connection.execute('ROLLBACK')
+                return None
+
+            connection.execute(
+                "UPDATE batches SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker, now + lease_seconds, row[0])
+            )
+            connection.execute('COMMIT')
+            return {'id': row[0], 'start': row[1], 'stop': row[2], 'step': row[3]}
+        finally:
+            connection.close()
+
+    def _update_lease(self, sql: str, parameters: tuple) -> bool:
+        connection = self._connect()
+        try:
+            return connection.execute(sql, parameters).rowcount == 1
+        finally:
+            connection.close()
+
+    def renew(self, batch_id: int, worker: str, lease_seconds: float) -> bool:
+        return self._update_lease(
+            "UPDATE batches SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+            (time() + lease_seconds, batch_id, worker)
+        )
+
+    def complete(self, batch_id: int, worker: str, result: dict) -> bool:
+        """
+        Returns False if the lease was lost to another worker, the batch still counts as done
+        """
+        completed = self._update_lease(
+            "UPDATE batches SET status = 'done', result = ?, completed_datetime = ? WHERE id = ? AND worker = ?",
+            (json.dumps(result), datetime.now(), batch_id, worker)
+        )
+        if not completed:
+            self._update_lease(
+                "UPDATE batches SET status = 'done', result = ?, completed_datetime = ? WHERE id = ? AND status != 'done'",
+                (json.dumps(result), datetime.now(), batch_id)
+            )
+        return completed
+
+    def release(self, batch_id: int, worker: str) -> bool:
+        """
+        Gives a batch back immediately when a worker fails, instead of waiting for the lease to expire
+        """
+        return self._update_lease(
+            "UPDATE batches SET status = 'pending', worker = NULL, lease_expires = NULL WHERE id = ? AND worker = ? AND status = 'leased'",
+            (batch_id, worker)
+        )
+
+    def status(self) -> dict:
+        connection = self._connect()
+        try:
+            now = time()
+            counts = {'pending': 0, 'leased': 0, 'expired': 0, 'done': 0}
+            for status, expired, count in connection.execute(
+                    "SELECT status, status = 'leased' AND lease_expires < ?, COUNT(*) FROM batches GROUP BY 1, 2", (now,)):
+                counts['expired' if expired else status] += count
+            return counts
+        finally:
+            connection.close()
+
+
+class HttpWorkQueue:
+    """
+    Same interface as WorkQueue for workers on other machines, talks to a coordinator started with --serve-port
+    """
+
+    def __init__(self, url: str, token: Optional[str] = None):
+        self.url = url.rstrip('/')
+        self.token = token
+
+    def _call(self, method: str, **kwargs):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        request = urllib.request.Request(f'{self.url}/{method}', data=json.dumps(kwargs).encode('utf-8'), headers=headers)
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return json.loads(response.read())
+
+    def lease(self, worker: str, lease_seconds: float) -> Optional[dict]:
+        return self._call('lease', worker=worker, lease_seconds=lease_seconds)
+
+    def renew(self, batch_id: int, worker: str, lease_seconds: float) -> bool:
+        return self._call('renew', batch_id=batch_id, worker=worker, lease_seconds=lease_seconds)
+
+    def complete(self, batch_id: int, worker: str, result: dict) -> bool:
+        return self._call('complete', batch_id=batch_id, worker=worker, result=result)
+
+    def release(self, batch_id: int, worker: str) -> bool:
+        return self._call('release', batch_id=batch_id, worker=worker)
+
+    def status(self) -> dict:
+        return self._call('status')
+
+
+def open_work_queue(location: str, token: Optional[str] = None):
+    if location.startswith('http://') or location.startswith('https://'):
+        return HttpWorkQueue(location, token)
+    return WorkQueue(location)
+
+
+def make_handler(work_queue: WorkQueue, token: Optional[str] = None):
+    """
+    With a token, requests without the same token in their Authorization header are refused
+    """
+    methods = {
+        'lease': work_queue.lease,
+        'renew': work_queue.renew,
+        'complete': work_queue.complete,
+        'release': work_queue.release,
+        'status': work_queue.status,
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if token and not hmac.compare_digest(self.headers.get('Authorization', ''), f'Bearer {token}'):
+                self.send_error(403)
+                return
+
+            method = methods.get(self.path.strip('/'))
+            if method is None:
+                self.send_error(404)
+                return
+
+            length = int(self.headers.get('Content-Length', 0))
+            kwargs = json.loads(self.rfile.read(length) or b'{}')
+            body = json.dumps(method(**kwargs)).encode('utf-8')
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f'coordinator {self.address_string()} {format % args}')
+
+    return Handler
+
+
+def make_server(work_queue: WorkQueue, host: str, port: int, token: Optional[str] = None) -> ThreadingHTTPServer:
+    if not token and host not in ('127.0.0.1', 'localhost', '::1'):
+        raise SystemExit(f'Serving the queue on {host} needs --coordinator-token, anyone who can reach it could lease batches')
+    server = ThreadingHTTPServer((host, port), make_handler(work_queue, token))
+    server.daemon_threads = True
+    return server
+
+
+def describe_batch(batch: dict) -> str:
+    nids = range(batch['start'], batch['stop'], batch['step'])
+    return f'{int_to_nid(nids[0])} to {int_to_nid(nids[-1])}'
+
+
+if __name__ == '__main__':
+    queue = WorkQueue(script_args.queue_db)
+
+    nids = nid_range(Nid(script_args.start_from), Nid(script_args.end_with))
+    created = queue.create_batches(nids, script_args.batch_size)
+    if created:
+        logger.info(f'Created {created} batches from {script_args.start_from} to {script_args.end_with}')
+    logger.info(f'Batches: {queue.status()}')
+
+    if script_args.serve_port:
+        server = make_server(queue, script_args.serve_host, script_args.serve_port, script_args.coordinator_token)
+        logger.info(f'Coordinator listening on {script_args.serve_host}:{script_args.serve_port}')
+        server.serve_forever()
@@ -0,0 +1,96 @@
+import threading
+import zlib
+from time import time
+from typing import Optional
+
+from nid import nid_space, nid_to_int
+
+
+class DeadNidSet:
+    """
+    Nids which returned an error page, stored as bitmaps over the whole nid space (845KB each).
+    New entries go into the current bitmap. Once it is older than ttl / 2 it becomes the previous bitmap
+    and the old previous bitmap is dropped, so a dead nid is probed again between ttl / 2 and ttl after it was found.
+    """
+
+    def __init__(self, ttl: float, current: Optional[bytes] = None, current_created: Optional[float] = None,
+                 previous: Optional[bytes] = None, previous_created: Optional[float] = None):
+        self.ttl = ttl
+
+        self.current = bytearray(current) if current else bytearray(nid_space // 8)
+        self.current_created = current_created or time()
+        self.previous = bytearray(previous) if previous else None
+        self.previous_created = previous_created
+
+        self._lock = threading.Lock()
+        self._rotate()
+
+    def _rotate(self):
+        now = time()
+
+        if self.previous is not None and now - self.previous_created > self.ttl:
+            self.previous = None
+            self.previous_created = None
+
+        if now - self.current_created > self.ttl / 2:
+            if now - self.current_created > self.ttl:
+                # nothing in it is still valid
+                self.previous = None
+                self.previous_created = None
+            else:
+                self.previous = self.current
+                self.previous_created = self.current_created
+            self.current = bytearray(nid_space // 8)
+            self.current_created = now
+
+    def __contains__(self, nid: str) -> bool:
+        index = nid_to_int(nid)
+        byte, mask = index >> 3, 1 << (index & 7)
+
+        with self._lock:
+            self._rotate()
+            if self.current[byte] & mask:
+                return True
+            return self.previous is not None and bool(self.previous[byte] & mask)
+
+    def add(self, nid: str):
+        index = nid_to_int(nid)
+        with self._lock:
+            self._rotate()
+            self.current[index >> 3] |= 1 << (index & 7)
+
+    def discard(self, nid: str):
+        index = nid_to_int(nid)
+        mask = ~(1 << (index & 7)) & 0xFF
+        with self._lock:
+            self.current[index >> 3] &= mask
+            if self.previous is not None:
+                self.previous[index >> 3] &= mask
+
+    def __len__(self):
+        with self._lock:
+            bits = int.from_bytes(self.current, 'little')
+            if self.previous is not None:
+                bits |= int.from_bytes(self.previous, 'little')
+            return bits.bit_count()
+
+    def save(self, cursor):
+        """
+        Bitmaps are stored compressed in the dead_nids table, see models.initialize_db
+        """
+        with self._lock:
+            rows = [(0, self.current_created, zlib.compress(self.current))]
+            if self.previous is not None:
+                rows.append((1, self.previous_created, zlib.compress(self.previous)))
+
+        cursor.execute("DELETE FROM dead_nids")
+        cursor.executemany("INSERT INTO dead_nids (generation, created_timestamp, bitmap) VALUES (?, ?, ?)", rows)
+
+    @classmethod
+    def load(cls, cursor, ttl: float) -> 'DeadNidSet':
+        cursor.execute("SELECT generation, created_timestamp, bitmap FROM dead_nids")
+        generations = {generation: (created, zlib.decompress(bitmap)) for generation, created, bitmap in cursor.fetchall()}
+
+        current_created, current = generations.get(0, (None, None))
+        previous_created, previous = generations.get(1, (None, None))
+        return cls(ttl, current, current_created, previous, previous_created)
@@ -0,0 +1,187 @@
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from typing import Optional
+
+from archive import PageArchive
+from args import script_args
+from logger import logger
+from nid import int_to_nid, nid_to_int
+
+error_page = '<html><head><title>エラー</title></head><body><div id="contents_main">エラーが発生しました</div></body></html>'
+
+paragraph = '　{}は剣を握りしめた。「ここで負けるわけにはいかない」と呟き、<ruby>魔物<rp>(</rp><rt>まもの</rt><rp>)</rp></ruby>の群れへ踏み出す。'
+
+
+def impression_id_of(nid: str) -> int:
+    return nid_to_int(nid) + 1
+
+
+def detail_page(nid: str) -> str:
+    return f'''<html><head><title>小説{nid}</title></head><body>
+<div id="head_nav"><ul><li><a href="https://ncode.syosetu.com/{nid.lower()}/">小説TOP</a></li><li><a href="https://ncode.syosetu.com/novelview/infotop/ncode/{nid.lower()}/">小説情報</a></li><li><a href="https://novelcom.syosetu.com/impression/list/ncode/{impression_id_of(nid)}/">感想</a></li></ul></div>
+<div id="contents_main"><h1><a href="https://ncode.syosetu.com/{nid.lower()}/">小説{nid}</a></h1>
+<p title="Nコード">{nid}</p>
+<table id="noveltable1"><tr><th>あらすじ</th><td class="ex">{'あらすじ' * 50}</td></tr>
+<tr><th>作者名</th><td><a href="https://mypage.syosetu.com/{nid_to_int(nid) % 100000}/">作者</a></td></tr>
+<tr><th>キーワード</th><td>ファンタジー\xa0冒険 魔法 ハッピーエンド</td></tr>
+<tr><th>ジャンル</th><td>ハイファンタジー〔ファンタジー〕</td></tr></table>
+<table id="noveltable2"><tr><th>掲載日</th><td>2020年 01月01日 10時00分</td></tr>
+<tr><th>最新部分掲載日</th><td>2020年 01月02日 10時00分</td></tr>
+<tr><th>感想</th><td>12件</td></tr>
+<tr><th>レビュー</th><td>3件</td></tr>
+<tr><th>ブックマーク登録</th><td>1,234件</td></tr>
+<tr><th>総合評価</th><td>5,678pt</td></tr>
+<tr><th>評価ポイント</th><td>3,210pt</td></tr>
+<tr><th>文字数</th><td>12,345文字</td></tr></table>
+<ul class="undernavi"><li><a href="https://mypage.syosetu.com/{nid_to_int(nid) % 100000}/">作者マイページ</a></li></ul>
+</div></body></html>'''
+
+
+def table_of_contents_page(nid: str, chapters: int) -> str:
+    entries = []
+    for chapter in range(1, chapters + 1):
+        if chapter % 10 == 1:
+            entries.append(f'<div class="chapter_title">第{chapter // 10 + 1}章</div>')
+        entries.append(
+            f'<dl class="novel_sublist2"><dd class="subtitle"><a href="/{nid.lower()}/{chapter}/">第{chapter}話</a></dd>'
+            f'<dt class="long_update">2020/01/{chapter % 28 + 1:02d} 10:00</dt></dl>'
+        )
+    return f'''<html><head><title>小説{nid}</title></head><body><div id="novel_contents"><div class="index_box">
+{''.join(entries)}
+</div></div></body></html>'''
+
+
+def chapter_page(nid: str, chapter: int, paragraphs: int) -> str:
+    lines = ''.join(f'<p id="L{i}">{paragraph.format(nid)}</p>' if i % 5 else f'<p id="L{i}"><br /></p>'
+                    for i in range(1, paragraphs + 1))
+    return f'''<html><head><title>第{chapter}話</title></head><body><div id="novel_contents"><div id="novel_color">
+<div id="novel_p" class="novel_view"><p id="Lp1">前書きです</p></div>
+<div id="novel_honbun" class="novel_view">{lines}</div>
+<div id="novel_a" class="novel_view"><p id="La1">後書きです</p></div>
+</div></div></body></html>'''
+
+
+def impression_page(nid: str, page: int, pages: int, comments: int) -> str:
+    navi = ' '.join(f'<a href="?p={p}">{p}</a>' for p in range(1, pages + 1))
+    waku = ''.join(f'''<div class="waku">
+<div class="comment_h2">良い点</div><div class="comment">{'面白いです' * 10}</div>
+<div class="comment_h2">一言</div><div class="comment">更新楽しみにしています</div>
+<div class="comment_info comment_authorbox"><div><a href="https://mypage.syosetu.com/{i + 1}/">読者{i}</a> [2021年 {12 - page % 12:02d}月{28 - i % 28:02d}日 05時06分]</div>
+<span class="no_posted_impression">第{i + 1}部分</span></div>
+</div>''' for i in range(comments))
+    return f'''<html><head><title>感想</title></head><body><div id="container"><div id="contents_main">
+<div class="novel_title"><a href="https://ncode.syosetu.com/{nid.lower()}/">小説{nid}</a></div>
+<div class="naviall">{navi}</div>
+{waku}
+</div></div></body></html>'''
+
+
+class FixtureSite:
+    """
+    Stand-in for the syosetu hosts. Pages are generated from the nid, or replayed from a PageArchive.
+    A share of nids returns error pages and a share of requests fails with 503, both decided at random.
+    """
+
+    def __init__(self, chapters=20, paragraphs=60, impression_pages=3, comments=10, dead_rate=0.2,
+                 latency=0.0, error_rate=0.0, archive: Optional[PageArchive] = None):
+        self.chapters = chapters
+        self.paragraphs = paragraphs
+        self.impression_pages = impression_pages
+        self.comments = comments
+        self.dead_rate = dead_rate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.archive = archive
+
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def is_dead(self, nid: str) -> bool:
+        # the same nids are dead in every run
+        return random.Random(nid).random() < self.dead_rate
+
+    def page(self, host: str, path: str) -> Optional[str]:
+        if match := re.fullmatch(r'/novelview/infotop/ncode/(n\w+)/', path, re.IGNORECASE):
+            nid = match.group(1).upper()
+            return error_page if self.is_dead(nid) else detail_page(nid)
+        if match := re.fullmatch(r'/impression/list/ncode/(\d+)/(?:\?p=(\d+))?', path):
+            nid = int_to_nid(int(match.group(1)) - 1)
+            return impression_page(nid, int(match.group(2) or 1), self.impression_pages, self.comments)
+        if match := re.fullmatch(r'/(n\w+)/(\d+)/', path, re.IGNORECASE):
+            chapter = int(match.group(2))
+            return chapter_page(match.group(1).upper(), chapter, self.paragraphs) if chapter <= self.chapters else None
+        if match := re.fullmatch(r'/(n\w+)/', path, re.IGNORECASE):
+            return table_of_contents_page(match.group(1).upper(), self.chapters)
+        return None
+
+    def respond(self, host: str, path: str) -> tuple[int, bytes]:
+        if self.latency:
+            sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return 503, b'Service Unavailable'
+
+        if self.archive is not None:
+            body = self.archive.read(f'https://{host}{path}')
+        else:
+            page = self.page(host, path)
+            body = page.encode('utf-8') if page is not None else None
+
+        if body is None:
+            return 404, b'Not Found'
+
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += len(body)
+        return 200, body
+
+
+def make_handler(site: FixtureSite):
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, like the real site
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            status, body = site.respond(self.headers.get('Host', ''), self.path)
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html; charset=UTF-8')
+            self.send_header('Content-Length', str(len(body)))
+            if status == 503:
+                self.send_header('Retry-After', '1')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_fixture_server(site: FixtureSite, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(site))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fixture-server', daemon=True).start()
+    return server
+
+
+def fixture_site_from_args() -> FixtureSite:
+    return FixtureSite(
+        chapters=script_args.fixture_chapters,
+        impression_pages=script_args.fixture_impression_pages,
+        dead_rate=script_args.fixture_dead_rate,
+        latency=script_args.fixture_latency_ms / 1000,
+        error_rate=script_args.fixture_error_rate,
+        archive=PageArchive(script_args.fixture_archive) if script_args.fixture_archive else None,
+    )
+
+
+if __name__ == '__main__':
+    server = start_fixture_server(fixture_site_from_args(), script_args.fixture_port)
+    logger.info(f'Fixture server listening on port {script_args.fixture_port}')
+    print(f'Serving syosetu fixtures on 127.0.0.1:{script_args.fixture_port}, '
+          f'scrape them with --host-override 127.0.0.1:{script_args.fixture_port} --rate-limit 1000')
+    threading.Event().wait()
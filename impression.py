@@ -1,25 +1,31 @@
 import re
 import urllib.request
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Generator
+from typing import Generator, Optional
 
 from bs4 import BeautifulSoup
 
 from api import request_with_retries
+from args import script_args
 from logger import logger
-from models import NovelImpressionModel
+from metrics import extract_seconds, timed
+from models import ImpressionRecord, parse_datetime
+from soup import impression_strainer, make_soup, novel_link_pattern
 
 
-def extract_impressions(impression_soup: BeautifulSoup) -> list[NovelImpressionModel]:
+@timed(extract_seconds, page='impression')
+def extract_impressions(impression_soup: BeautifulSoup) -> list[ImpressionRecord]:
     impressions = []
 
     comments = impression_soup.find_all(class_='waku')
-    if comments is None:
+    if not comments:
         return impressions
 
     datetime_regex_pattern = re.compile(r"\d{4}年 \d{2}月\d{2}日 \d{2}時\d{2}分")
 
-    nid = impression_soup.select_one('html body div#container div#contents_main a')['href'].split('/')[-2]
+    nid = impression_soup.find('a', href=novel_link_pattern)['href'].split('/')[-2].upper()
 
     for comment in comments:
         comment_info = comment.find('div', class_='comment_info comment_authorbox')
@@ -42,65 +48,120 @@ def extract_impressions(impression_soup: BeautifulSoup) -> list[NovelImpressionM
         except AttributeError:
             on_part = None
 
-        impression = NovelImpressionModel(
-            nid=nid,
-            user_id=user_id,
-            created_datetime=created_datetime,
-            on_part=on_part
-        )
-
         # Get content of comments
+        hitokoto = yoiten = kininaruten = None
         for comment_header in comment.find_all('div', class_='comment_h2'):
             comment_content = comment_header.find_next_sibling('div').text
             if comment_header.text == '一言':
-                impression.impression_hitokoto = comment_content
+                hitokoto = comment_content
             elif comment_header.text == '良い点':
-                impression.impression_yoiten = comment_content
+                yoiten = comment_content
             elif comment_header.text == '気になる点':
-                impression.impression_kininaruten = comment_content
+                kininaruten = comment_content
 
-        impressions.append(impression)
+        impressions.append(ImpressionRecord(
+            nid=nid,
+            user_id=user_id,
+            created_datetime=created_datetime,
+            impression_hitokoto=hitokoto,
+            impression_yoiten=yoiten,
+            impression_kininaruten=kininaruten,
+            on_part=on_part
+        ))
 
     return impressions
 
 
-def impression_soup_generator(impression_id: int, is_r18=False) -> Generator[BeautifulSoup, None, None]:
+def get_newest_impression_datetime(cursor, nid: str) -> Optional[datetime]:
+    """
+    Newest impression saved by the last walk through every page, None if no walk has finished yet.
+    Impressions written by a walk that was interrupted after it don't count, the pages behind them were never fetched.
+    Both datetimes are in Japan time, see models.site_now.
+    """
+    cursor.execute(
+        """
+        SELECT MAX(i.created_datetime) FROM novel_impression i JOIN scrape_history h ON h.nid = i.nid
+        WHERE i.nid = ? AND i.created_datetime <= h.last_impression_scrape_datetime
+        """,
+        (nid,)
+    )
+    return parse_datetime(cursor.fetchone()[0])
+
+
+def reached_stored_impressions(impressions: list[ImpressionRecord], newest_stored: Optional[datetime]) -> bool:
+    """
+    Pages are newest first, once a page has impressions older than the newest stored one the rest were scraped before.
+    Impressions posted in the same minute as the newest stored one may still be new, so they don't count.
+    """
+    return newest_stored is not None and any(impression.created_datetime < newest_stored for impression in impressions)
+
+
+def get_max_page(impression_soup: BeautifulSoup) -> int:
+    """
+    Number of impression pages according to the first page, 0 if the novel has no impressions
+    """
+    nav = impression_soup.find(class_='naviall')
+
+    # empty navbar
+    if nav is None:
+        # check if there is a single impression
+        if impression_soup.find(class_='comment') is not None:
+            return 1
+        return 0
+
+    tags = nav.find_all('a')
+    # get largest number in navbar
+    return max((int(re.search(r'\d+', tag.text).group(0)) for tag in tags if re.search(r'\d+', tag.text)),
+               default=-1)
+
+
+def impression_soup_generator(impression_id: int, is_r18=False, start_page=1,
+                              incremental=False) -> Generator[BeautifulSoup, None, None]:
     """
     Use generator to save memory
+    Pages before start_page are not yielded, the first page is still fetched to find the number of pages.
+    The other pages are downloaded concurrently but yielded in order.
+    With incremental the caller is expected to stop early, so the downloads ahead start at one page and double with every page.
     """
     url = f'https://novelcom.syosetu.com/impression/list/ncode/{impression_id}/'
     if is_r18:
         url = f'https://novelcom18.syosetu.com/impression/list/ncode/{impression_id}/'
 
     first_impression_soup = request_with_retries(url)
-    first_impression_soup = BeautifulSoup(first_impression_soup, 'html.parser')
+    first_impression_soup = make_soup(first_impression_soup, parse_only=impression_strainer)
 
-    # determine number of pages
-    nav = first_impression_soup.find(class_='naviall')
+    max_page = get_max_page(first_impression_soup)
+    if max_page == 0:
+        return
 
-    # empty navbar
-    if nav is None:
-        # check if there is a single impression
-        if first_impression_soup.find(class_='comment') is not None:
-            max_page = 1
-        else:
-            return
-    else:
-        tags = nav.find_all('a')
-        # get largest number in navbar
-        max_page = max((int(re.search(r'\d+', tag.text).group(0)) for tag in tags if re.search(r'\d+', tag.text)),
-                       default=-1)
-
-    yield first_impression_soup
-
-    # get all impression pages
-    for page in range(2, max_page + 1):
-        logger.info(f'[{page}/{max_page}] impression')
-
-        url = f'https://novelcom.syosetu.com/impression/list/ncode/{impression_id}/?p={page}'
-        impression_page = request_with_retries(url)
-        impression_page = BeautifulSoup(impression_page, 'html.parser')
-        yield impression_page
+    if start_page <= 1:
+        yield first_impression_soup
+
+    # get all impression pages, downloads run ahead of parsing within the host's rate limit
+    pages = range(max(2, start_page), max_page + 1)
+    executor = ThreadPoolExecutor(max_workers=script_args.impression_workers, thread_name_prefix='impression')
+    in_flight = deque()
+    max_ahead = script_args.impression_workers * 2
+    ahead = 1 if incremental else max_ahead
+
+    try:
+        for page in pages:
+            in_flight.append((page, executor.submit(request_with_retries, f'{url}?p={page}')))
+
+            if len(in_flight) >= ahead:
+                yield get_impression_page_soup(*in_flight.popleft(), max_page)
+                ahead = min(ahead * 2, max_ahead)
+
+        while in_flight:
+            yield get_impression_page_soup(*in_flight.popleft(), max_page)
+    finally:
+        # the caller may stop early, pages that weren't downloaded yet are dropped
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def get_impression_page_soup(page: int, response: Future, max_page: int) -> BeautifulSoup:
+    logger.info(f'[{page}/{max_page}] impression')
+    return make_soup(response.result(), parse_only=impression_strainer)
 
 
 def get_impression_id(detail_page_soup: BeautifulSoup) -> int:
@@ -1,71 +1,158 @@
+import atexit
 import os
+import socket
 import sqlite3
-import urllib.request
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from functools import wraps
 from timeit import default_timer
+from typing import Callable, Iterable, Optional
 
-import yaml
-
+from api import RequestFailed, parse_api_datetime, query_novels_between
 from args import script_args
 from content import novel_content_generator
-from impression import extract_impressions, impression_soup_generator
+from coordinator import describe_batch, open_work_queue
+from deadlist import DeadNidSet
+from impression import extract_impressions, get_impression_id, get_newest_impression_datetime, impression_soup_generator, \
+    reached_stored_impressions
 from logger import logger
-from models import db_name, initialize_db
-from nid import Nid
-from novel_info import extract_novel_info, get_detail_page_soup
+from metrics import error_pages_total, novel_seconds, novels_total, start_http_server, start_summary, summary
+from models import NovelContentModel, NovelImpressionModel, NovelInfoModel, batched, connect, db_name, initialize_db, parse_datetime, \
+    save_failed_nid, site_now, site_timestamp
+from nid import Nid, iterate_nids, nid_range, nid_to_int, shard_range
+from novel_info import api_batch_size, extract_novel_info, get_detail_page_soup, query_novel_infos
+from pipeline import run_pipeline, start_parser_pool
+from profiler import start_profiler
+from retrieve_all_nids import mark_scraped, queued_nids
+from writer import DatabaseWriter
+
+
+# Nids known to have no novel, only loaded for range sweeps
+dead_nids: Optional[DeadNidSet] = None
+# Parser processes of --pipeline, started before any other thread
+parser_pool: Optional[ProcessPoolExecutor] = None
 
 
 def timing_decorator(func):
+    """
+    Records the duration of every novel in novel_scrape_seconds, see --metrics-port and --metrics-interval
+    """
     @wraps(func)
     def wrapper(nid, conn):
         start_time = default_timer()
-        logger.info(f"Start scraping {nid}")
+        logger.debug(f"Start scraping {nid}")
         try:
             result = func(nid, conn)
         except Exception as e:
+            novels_total.inc(result='failed')
             logger.error(f"Failed {nid} {e}")
             raise
-        end_time = default_timer()
-        logger.info(f"Scraped {nid} {end_time - start_time}s elapsed")
+        novel_seconds.observe(default_timer() - start_time)
+        novels_total.inc(result='scraped')
         return result
 
     return wrapper
 
 
-def query_nids_between_time(start_inc: datetime, end_inc: datetime) -> list[str]:
-    # convert datetime to uinix timestamp
-    start_inc = int(start_inc.timestamp())
-    end_inc = int(end_inc.timestamp())
+def query_nids_between_time(start_inc: datetime, end_inc: datetime, api='novelapi') -> list[tuple[str, datetime]]:
+    """
+    Returns ncode and general_lastup of every novel updated in the time range.
+    Use api='novel18api' for R18 novels.
+    """
+    # convert datetime to uinix timestamp, the api's datetimes are in Japan time
+    start_inc = site_timestamp(start_inc)
+    end_inc = site_timestamp(end_inc)
+
+    result = []
+    for novels in query_novels_between('lastup', start_inc, end_inc, of='n-gl', api=api):
+        for novel in novels:
+            result.append((novel['ncode'].upper(), parse_api_datetime(novel['general_lastup'])))
+
+    return result
+
+
+def find_stale_nids(updated_novels: list[tuple[str, datetime]], connection: sqlite3.Connection) -> list[str]:
+    """
+    Novels which have not been scraped since their last update according to scrape_history and novel_info.
+    The info is committed before the content is scraped, so a novel only counts as scraped once every stage this run
+    scrapes has finished after the update. Novels with a scrape_progress row were interrupted and are always stale.
+    """
+    cursor = connection.cursor()
+    stale = []
+    seen = set()
+
+    for nid, last_updated in updated_novels:
+        if nid in seen:
+            continue
+        seen.add(nid)
+
+        cursor.execute(
+            """
+            SELECT h.last_info_scrape_datetime, h.last_content_scrape_datetime, i.last_updated_datetime,
+            EXISTS (SELECT 1 FROM scrape_progress p WHERE p.nid = h.nid)
+            FROM scrape_history h LEFT JOIN novel_info i ON i.nid = h.nid
+            WHERE h.nid = ?
+            """,
+            (nid,)
+        )
+        row = cursor.fetchone()
+
+        if row is None or row[3]:
+            stale.append(nid)
+            continue
+
+        last_info_scraped, last_content_scraped, stored_last_updated = map(parse_datetime, row[:3])
+        scraped = [last_info_scraped] if script_args.skip_content else [last_info_scraped, last_content_scraped]
+        # detail pages only show minutes
+        last_updated = last_updated.replace(second=0)
+
+        if None in scraped or min(scraped) < last_updated:
+            stale.append(nid)
+        elif stored_last_updated is not None and stored_last_updated < last_updated:
+            stale.append(nid)
 
-    request_url = f'https://api.syosetu.com/novelapi/api/?lim=500&of=n&lastup={start_inc}-{end_inc}'
-    response_data = urllib.request.urlopen(request_url).read()
+    return stale
 
-    data = yaml.safe_load(response_data.decode('utf-8'))
-    total_count = int(data[0]['allcount'])
 
-    if total_count == 0:
-        return []
+def skip_failed_novel(connection, nid: str, error: RequestFailed):
+    """
+    A novel whose requests keep failing is recorded and skipped, so that it can't stop a sweep at the same nid every run.
+    It is not marked dead, see --retry-failed.
+    """
+    logger.error(f'Skipping {nid} {error}')
+    save_failed_nid(connection.cursor(), nid, error)
+    connection.commit()
 
-    nids = []
 
-    for novel in data[1:]:
-        nids.append(novel['ncode'])
+def failed_nid_remover(since: datetime) -> Callable:
+    def remove(nid: str, connection: sqlite3.Connection):
+        # nids which failed again during this run are kept
+        connection.cursor().execute("DELETE FROM failed_nids WHERE nid = ? AND failed_datetime < ?", (nid, since))
+        connection.commit()
 
-    if total_count > 500:
-        curr_retrieved = 500
+    return remove
 
-        while curr_retrieved < total_count:
-            request_url = f'https://api.syosetu.com/novelapi/api/?lim=500&of=n&lastup={start_inc}-{end_inc}&st={curr_retrieved + 1}'
-            response_data = urllib.request.urlopen(request_url).read()
 
-            data = yaml.safe_load(response_data.decode('utf-8'))
-            for novel in data[1:]:
-                nids.append(novel['ncode'])
+def get_progress(cursor: sqlite3.Cursor, nid: str, stage: str) -> int:
+    """
+    Last page of a stage that was committed before the previous run stopped, 0 if the stage wasn't interrupted
+    """
+    cursor.execute("SELECT page_num FROM scrape_progress WHERE nid = ? AND stage = ?", (nid, stage))
+    result = cursor.fetchone()
+    return result[0] if result else 0
 
-            curr_retrieved += 500
 
-    return nids
+def save_progress(connection: sqlite3.Connection, nid: str, stage: str, page_num: int):
+    """
+    Commits everything written for the novel so far, a crash after this only repeats the pages after page_num
+    """
+    connection.cursor().execute(
+        "INSERT OR REPLACE INTO scrape_progress (nid, stage, page_num) VALUES (?, ?, ?)",
+        (nid, stage, page_num)
+    )
+    connection.commit()
 
 
 @timing_decorator
@@ -73,6 +160,7 @@ def scrape(nid: str, connection: sqlite3.Connection):
     soup = get_detail_page_soup(nid)
 
     is_error = False
+    # None only for a 404, requests which keep failing raise RequestFailed and never mark the nid dead
     if soup is None:
         is_error = True
 
@@ -81,8 +169,15 @@ def scrape(nid: str, connection: sqlite3.Connection):
 
     if is_error:
         logger.info(f'Novel {nid} returned error page')
+        error_pages_total.inc()
+        # offline the page may just not have been cached
+        if dead_nids is not None and not script_args.offline:
+            dead_nids.add(nid)
         return
 
+    if dead_nids is not None:
+        dead_nids.discard(nid)
+
     cursor = connection.cursor()
 
     is_r18 = bool(soup.find('span', {'id': 'age_limit'}))
@@ -102,6 +197,25 @@ def scrape(nid: str, connection: sqlite3.Connection):
         logger.info(f'Skip R18 novel {nid}')
         return
 
+    novel_info = extract_novel_info(soup)
+    novel_info.sqlite_save(cursor)
+
+    cursor.execute(
+        """
+        UPDATE scrape_history SET last_info_scrape_datetime = ? WHERE nid = ?
+        """,
+        (site_now(), nid)
+    )
+
+    scrape_stages(nid, novel_info, is_r18, connection)
+
+
+def scrape_stages(nid: str, novel_info: NovelInfoModel, is_r18: bool, connection: sqlite3.Connection):
+    """
+    Scrapes the impressions and content of a novel whose info has been saved
+    """
+    cursor = connection.cursor()
+
     cursor.execute("SELECT last_impression_scrape_datetime, last_content_scrape_datetime FROM scrape_history WHERE nid = ?", (nid,))
     result = cursor.fetchone()
 
@@ -114,45 +228,305 @@ def scrape(nid: str, connection: sqlite3.Connection):
     if will_skip_impression:
         logger.info(f'Skip impression scraping for {nid}')
 
-    novel_info = extract_novel_info(soup)
-    novel_info.sqlite_save(cursor)
-
-    cursor.execute(
-        """
-        UPDATE scrape_history SET last_info_scrape_datetime = ? WHERE nid = ?
-        """,
-        (datetime.now(), nid)
-    )
+    if not will_skip_impression and novel_info.impression_id is None:
+        # info from the api has no impression id
+        soup = get_detail_page_soup(nid, is_r18=is_r18)
+        if soup is None or soup.find('title').text == 'エラー':
+            # deleted since the api was queried, it is found dead the next time
+            logger.info(f'Novel {nid} returned error page, skip impression scraping')
+            will_skip_impression = True
+        else:
+            novel_info.impression_id = get_impression_id(soup)
+            cursor.execute("UPDATE novel_info SET impression_id = ? WHERE nid = ?", (novel_info.impression_id, nid))
 
     if not will_skip_impression:
-        for impression_soup in impression_soup_generator(novel_info.impression_id, is_r18=is_r18):
+        start_page = get_progress(cursor, nid, 'impression') + 1
+        if start_page > 1:
+            logger.info(f'Resuming impressions of {nid} from page {start_page}')
+
+        # an interrupted walk has to be finished, the pages after it are older than what it saved
+        newest_impression = None
+        if not script_args.refresh_impressions and start_page == 1:
+            newest_impression = get_newest_impression_datetime(cursor, nid)
+
+        impression_soups = impression_soup_generator(novel_info.impression_id, is_r18=is_r18, start_page=start_page,
+                                                     incremental=newest_impression is not None)
+        for page_num, impression_soup in enumerate(impression_soups, start=start_page):
             impressions = extract_impressions(impression_soup)
-            for impression in impressions:
-                impression.sqlite_save(cursor)
+            NovelImpressionModel.sqlite_save_many(cursor, impressions)
+
+            if reached_stored_impressions(impressions, newest_impression):
+                logger.info(f'Reached impressions of {nid} scraped before on page {page_num}')
+                break
+
+            if page_num % script_args.checkpoint_pages == 0:
+                save_progress(connection, nid, 'impression', page_num)
+        impression_soups.close()
 
         # Here we don't need to check for existence because we know row for nid must exist at this point
         cursor.execute(
             """
             UPDATE scrape_history SET last_impression_scrape_datetime = ? WHERE nid = ?
             """,
-            (datetime.now(), nid)
+            (site_now(), nid)
         )
+        cursor.execute("DELETE FROM scrape_progress WHERE nid = ? AND stage = 'impression'", (nid,))
 
     if not will_skip_content:
-        for content in novel_content_generator(nid, novel_info, is_r18=is_r18):
-            content.sqlite_save(cursor)
+        stored_chapters = {}
+        if not script_args.refresh_content:
+            cursor.execute("SELECT created_datetime, last_updated_datetime FROM novel_content WHERE nid = ?", (nid,))
+            stored_chapters = {parse_datetime(created): parse_datetime(updated) for created, updated in cursor.fetchall()}
+
+        skip_pages = get_progress(cursor, nid, 'content')
+        if skip_pages:
+            logger.info(f'Resuming content of {nid} after page {skip_pages}')
+
+        contents = novel_content_generator(nid, novel_info, is_r18=is_r18, stored_chapters=stored_chapters,
+                                           skip_pages=skip_pages)
+        checkpoint = skip_pages
+        for batch in batched(contents, script_args.db_batch_size):
+            NovelContentModel.sqlite_save_many(cursor, batch)
+
+            if batch[-1].page_num - checkpoint >= script_args.checkpoint_pages:
+                checkpoint = batch[-1].page_num
+                save_progress(connection, nid, 'content', checkpoint)
 
         # Similarly, updating without checking for existence
         cursor.execute(
             """
             UPDATE scrape_history SET last_content_scrape_datetime = ? WHERE nid = ?
             """,
-            (datetime.now(), nid)
+            (site_now(), nid)
         )
+        cursor.execute("DELETE FROM scrape_progress WHERE nid = ? AND stage = 'content'", (nid,))
 
     connection.commit()
 
 
+def save_api_infos(nids: list[str], connection: sqlite3.Connection) -> dict[str, tuple[NovelInfoModel, bool]]:
+    """
+    Saves the info of a batch of novels from the api, returns the info and r18 flag of the ones that exist.
+    last_info_scrape_datetime is left to scrape_with_api_info, which sets it when the novel's turn comes.
+    """
+    infos = {nid: (info, False) for nid, info in query_novel_infos(nids).items()}
+    missing = [nid for nid in nids if nid not in infos]
+    if missing and not script_args.skip_r18:
+        infos.update({nid: (info, True) for nid, info in query_novel_infos(missing, api='novel18api').items()})
+
+    cursor = connection.cursor()
+    cursor.execute(
+        f"SELECT nid, impression_id FROM novel_info WHERE nid IN ({','.join('?' * len(infos))})", list(infos)
+    )
+    stored_impression_ids = dict(cursor.fetchall())
+
+    for nid, (info, is_r18) in infos.items():
+        # keep the impression id from the detail page, the api doesn't have it
+        info.impression_id = stored_impression_ids.get(nid)
+        info.sqlite_save(cursor)
+        cursor.execute("INSERT OR IGNORE INTO scrape_history (nid, r18) VALUES (?, ?)", (nid, is_r18))
+    connection.commit()
+
+    return infos
+
+
+def scrape_with_api_info(nids: Iterable[str], connection: sqlite3.Connection, on_scraped: Optional[Callable] = None):
+    """
+    Novel info comes from the api in batches instead of a detail page per novel.
+    Impressions and content are still scraped one novel at a time unless they are skipped.
+    """
+    for batch in batched(nids, api_batch_size):
+        infos = save_api_infos(batch, connection)
+        logger.info(f'Saved info of {len(infos)} of {len(batch)} novels from the api, {batch[0]} to {batch[-1]}')
+
+        cursor = connection.cursor()
+        for nid in batch:
+            if nid in infos:
+                if dead_nids is not None:
+                    dead_nids.discard(nid)
+                # committed together with the stages, an interrupted batch leaves the rest of it unscraped
+                cursor.execute("UPDATE scrape_history SET last_info_scrape_datetime = ? WHERE nid = ?", (site_now(), nid))
+                if not (script_args.skip_content and script_args.skip_impression):
+                    info, is_r18 = infos[nid]
+                    try:
+                        scrape_stages(nid, info, is_r18, connection)
+                    except RequestFailed as e:
+                        novels_total.inc(result='failed')
+                        # back to the last checkpoint of the novel
+                        connection.rollback()
+                        skip_failed_novel(connection, nid, e)
+            # without novel18api a missing nid may still be an R18 novel
+            elif dead_nids is not None and not script_args.skip_r18 and not script_args.offline:
+                dead_nids.add(nid)
+
+            if on_scraped:
+                on_scraped(nid, connection)
+        connection.commit()
+
+
+def scrape_concurrently(nids: Iterable[str], workers: int, on_scraped: Optional[Callable] = None):
+    """
+    Scrapes several novels at once. Every database statement goes through a single DatabaseWriter.
+    Results are collected in the order the nids were given. Novels whose requests keep failing are skipped,
+    any other error stops the run like the serial path.
+    """
+    writer = DatabaseWriter(db_name)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scraper')
+    # only keep a few novels queued so that the generator isn't consumed ahead of the workers
+    in_flight = deque()
+
+    def collect():
+        nid, future = in_flight.popleft()
+        try:
+            future.result()
+        except RequestFailed as e:
+            skip_failed_novel(writer, nid, e)
+        if on_scraped:
+            on_scraped(nid, writer)
+
+    try:
+        for nid in nids:
+            in_flight.append((nid, executor.submit(scrape, nid, writer)))
+
+            if len(in_flight) >= workers * 2:
+                collect()
+
+        while in_flight:
+            collect()
+    except BaseException:
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    else:
+        executor.shutdown(wait=True)
+    finally:
+        writer.close()
+
+
+def scrape_nids(nids: Iterable[str], connection: sqlite3.Connection, on_scraped: Optional[Callable] = None):
+    """
+    on_scraped(nid, connection) is called in order once a novel and every novel before it have been scraped
+    """
+    if script_args.info_source == 'api':
+        scrape_with_api_info(nids, connection, on_scraped)
+        return
+
+    if script_args.pipeline:
+        run_pipeline(nids, on_scraped, dead_nids, parser_pool)
+        return
+
+    if script_args.workers > 1:
+        scrape_concurrently(nids, script_args.workers, on_scraped)
+        return
+
+    for nid in nids:
+        try:
+            scrape(nid, connection)
+        except RequestFailed as e:
+            # back to the last checkpoint of the novel
+            connection.rollback()
+            skip_failed_novel(connection, nid, e)
+        if on_scraped:
+            on_scraped(nid, connection)
+
+
+def get_sweep_checkpoint(connection: sqlite3.Connection, start_from: Nid, end_with: Nid) -> Optional[str]:
+    cursor = connection.cursor()
+    cursor.execute("SELECT last_nid FROM sweep_checkpoint WHERE start_from = ? AND end_with = ?",
+                   (start_from.id, end_with.id))
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+
+def sweep_checkpoint_saver(start_from: Nid, end_with: Nid) -> Callable:
+    scraped_count = 0
+
+    def save(nid: str, connection: sqlite3.Connection):
+        nonlocal scraped_count
+        scraped_count += 1
+
+        cursor = connection.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO sweep_checkpoint (start_from, end_with, last_nid, updated_datetime) VALUES (?, ?, ?, ?)",
+            (start_from.id, end_with.id, nid, site_now())
+        )
+        # the bitmaps are large, losing the last few dead nids on a crash only means probing them again
+        if dead_nids is not None and scraped_count % 1000 == 0:
+            dead_nids.save(cursor)
+        connection.commit()
+
+    return save
+
+
+def skip_dead_nids(nids: Iterable[str]) -> Iterable[str]:
+    skipped = 0
+    for nid in nids:
+        if nid in dead_nids:
+            skipped += 1
+            continue
+        yield nid
+
+    logger.info(f'Skipped {skipped} nids known to have no novel')
+
+
+def keep_lease(work_queue, batch_id: int, worker: str, stop: threading.Event):
+    while not stop.wait(script_args.lease_seconds / 3):
+        if not work_queue.renew(batch_id, worker, script_args.lease_seconds):
+            logger.warning(f'Lost the lease of batch {batch_id}')
+            return
+
+
+def scrape_from_coordinator(work_queue, connection: sqlite3.Connection):
+    """
+    Leases batches of nids from the coordinator until every batch is done.
+    The lease is renewed in the background while a batch is scraped, so only crashed workers lose their batches.
+    """
+    worker = script_args.worker_id or f'{socket.gethostname()}-{os.getpid()}'
+
+    while True:
+        batch = work_queue.lease(worker, script_args.lease_seconds)
+
+        if batch is None:
+            status = work_queue.status()
+            if status['pending'] == 0 and status['leased'] == 0 and status['expired'] == 0:
+                logger.info('Every batch has been scraped')
+                return
+            # other workers still hold batches which may expire
+            threading.Event().wait(min(script_args.lease_seconds / 3, 30))
+            continue
+
+        logger.info(f'Leased batch {batch["id"]} {describe_batch(batch)}')
+        nid_ints = range(batch['start'], batch['stop'], batch['step'])
+        dead_before = len(dead_nids)
+        start_time = default_timer()
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=keep_lease, args=(work_queue, batch['id'], worker, stop), daemon=True)
+        heartbeat.start()
+
+        try:
+            nids = iterate_nids(nid_ints)
+            if not script_args.recheck_dead:
+                nids = skip_dead_nids(nids)
+            scrape_nids(nids, connection)
+        except BaseException:
+            stop.set()
+            work_queue.release(batch['id'], worker)
+            raise
+        finally:
+            stop.set()
+            dead_nids.save(connection.cursor())
+            connection.commit()
+
+        result = {
+            'worker': worker,
+            'nids': len(nid_ints),
+            'dead_nids': len(dead_nids) - dead_before,
+            'seconds': default_timer() - start_time,
+        }
+        if not work_queue.complete(batch['id'], worker, result):
+            logger.warning(f'Batch {batch["id"]} was also leased by another worker')
+
+
 if __name__ == '__main__':
     if script_args.reset:
         try:
@@ -160,26 +534,103 @@ if __name__ == '__main__':
         except FileNotFoundError:
             logger.debug("No db file to delete")
             pass
+        # left behind by WAL mode if the last run didn't close cleanly
+        for suffix in ('-wal', '-shm'):
+            try:
+                os.remove(db_name + suffix)
+            except FileNotFoundError:
+                pass
         logger.info('Reset scrape history')
         exit()
 
     initialize_db()
-    conn = sqlite3.connect(db_name)
+    conn = connect(db_name)
+
+    # the parser processes are forked before the metrics and profiler threads start
+    if script_args.pipeline:
+        parser_pool = start_parser_pool(script_args.parsers)
+        atexit.register(parser_pool.shutdown)
+
+    if script_args.metrics_port:
+        start_http_server(script_args.metrics_port, script_args.metrics_host)
+        logger.info(f'Serving metrics on {script_args.metrics_host}:{script_args.metrics_port}')
+    if script_args.metrics_interval > 0:
+        start_summary(script_args.metrics_interval, logger.info)
+        atexit.register(lambda: logger.info(f'Metrics {summary()}'))
+    if script_args.profile:
+        profiler = start_profiler(script_args.profile_interval_ms / 1000, script_args.profile_window,
+                                  script_args.profile_output, logger.info)
+        atexit.register(profiler.stop)
 
     if script_args.nid:
         scrape(Nid(script_args.nid).id, conn)
         exit()
 
-    start_from, end_with = Nid(script_args.start_from), Nid(script_args.end_with)
-    logger.info(f'Starting scraping from {script_args.start_from} to {script_args.end_with}')
+    if script_args.coordinator:
+        dead_nids = DeadNidSet.load(conn.cursor(), ttl=script_args.dead_nid_ttl_days * 24 * 60 * 60)
+        scrape_from_coordinator(open_work_queue(script_args.coordinator, script_args.coordinator_token), conn)
+        exit()
 
-    if start_from > end_with:
-        gen = start_from.generate_nids(reverse=True)
-    else:
-        gen = start_from.generate_nids()
+    if script_args.from_queue:
+        logger.info('Scraping novels from nid_queue')
+        scrape_nids(queued_nids(conn), conn, on_scraped=mark_scraped)
+        exit()
+
+    if script_args.retry_failed:
+        retry_start = site_now()
+        failed_nids = [row[0] for row in conn.execute("SELECT nid FROM failed_nids ORDER BY failed_datetime")]
+        logger.info(f'Retrying {len(failed_nids)} novels whose requests kept failing')
+        scrape_nids(failed_nids, conn, on_scraped=failed_nid_remover(retry_start))
+        exit()
 
-    for nid in gen:
-        scrape(nid, conn)
+    if script_args.since or script_args.updated_between:
+        if script_args.updated_between:
+            updated_from, updated_to = map(datetime.fromisoformat, script_args.updated_between)
+        else:
+            updated_from, updated_to = datetime.fromisoformat(script_args.since), site_now()
 
-        if nid == script_args.end_with:
-            break
+        logger.info(f'Querying novels updated between {updated_from} and {updated_to}')
+        updated_novels = query_nids_between_time(updated_from, updated_to)
+        if not script_args.skip_r18:
+            updated_novels += query_nids_between_time(updated_from, updated_to, api='novel18api')
+        stale_nids = find_stale_nids(updated_novels, conn)
+        logger.info(f'{len(stale_nids)} of {len(updated_novels)} updated novels need scraping')
+
+        scrape_nids(stale_nids, conn)
+        exit()
+
+    start_from, end_with = Nid(script_args.start_from), Nid(script_args.end_with)
+    nid_ints = nid_range(start_from, end_with)
+
+    if script_args.shard:
+        shard_index, shard_count = map(int, script_args.shard.split('/'))
+        nid_ints = shard_range(nid_ints, shard_count, shard_index, interleaved=script_args.interleave_shards)
+        if len(nid_ints) == 0:
+            logger.info(f'Shard {script_args.shard} is empty')
+            exit()
+        # the checkpoint of a shard is kept under its own first and last nid
+        start_from, end_with = Nid.from_int(nid_ints[0]), Nid.from_int(nid_ints[-1])
+
+    logger.info(f'Starting scraping from {start_from.id} to {end_with.id}, {len(nid_ints)} nids')
+
+    last_nid = None if script_args.ignore_checkpoint else get_sweep_checkpoint(conn, start_from, end_with)
+    if last_nid == end_with.id:
+        logger.info(f'Range was already scraped until {last_nid}, use --ignore-checkpoint to scrape it again')
+        exit()
+    if last_nid is not None:
+        logger.info(f'Resuming after {last_nid}')
+        # the checkpoint itself was already scraped
+        nid_ints = nid_ints[nid_ints.index(nid_to_int(last_nid)) + 1:]
+
+    nids = iterate_nids(nid_ints)
+
+    dead_nids = DeadNidSet.load(conn.cursor(), ttl=script_args.dead_nid_ttl_days * 24 * 60 * 60)
+    if not script_args.recheck_dead:
+        logger.info(f'{len(dead_nids)} nids are known to have no novel')
+        nids = skip_dead_nids(nids)
+
+    try:
+        scrape_nids(nids, conn, on_scraped=sweep_checkpoint_saver(start_from, end_with))
+    finally:
+        dead_nids.save(conn.cursor())
+        conn.commit()
@@ -0,0 +1,150 @@
+import sqlite3
+from timeit import default_timer
+
+from args import script_args
+from logger import logger
+from models import connect, db_name, initialize_db
+
+# Table, primary key and the scrape_history column telling how recent its rows are
+merged_tables = (
+    ('novel_info', ('nid',), 'last_info_scrape_datetime'),
+    ('novel_impression', ('nid', 'created_datetime'), 'last_impression_scrape_datetime'),
+    ('novel_content', ('nid', 'created_datetime'), 'last_content_scrape_datetime'),
+    ('novel_content_text', ('nid', 'created_datetime'), 'last_content_scrape_datetime'),
+)
+
+# Dictionary ids differ between databases, see merge_dictionaries
+column_overrides = {
+    'novel_content_text': ({'dictionary_id': 'dm.main_id'}, 'LEFT JOIN temp.dictionary_map dm ON dm.shard_id = t.dictionary_id'),
+}
+
+
+def get_columns(connection: sqlite3.Connection, schema: str, table: str) -> list[str]:
+    return [row[1] for row in connection.execute(f'PRAGMA {schema}.table_info({table})')]
+
+
+def merge_table(connection: sqlite3.Connection, table: str, key: tuple, history_column: str) -> int:
+    """
+    Rows missing from the main database are added. Existing rows are replaced
+    only if the shard scraped the novel more recently than the main database did.
+    Runs as a single INSERT ... SELECT so rows never pass through python.
+    """
+    columns = [column for column in get_columns(connection, 'main', table)
+               if column in get_columns(connection, 'shard', table)]
+    key_match = ' AND '.join(f'm.{column} = t.{column}' for column in key)
+    overrides, join = column_overrides.get(table, ({}, ''))
+
+    cursor = connection.execute(
+        f"""
+        INSERT INTO main.{table} ({', '.join(columns)})
+        SELECT {', '.join(overrides.get(column, f't.{column}') for column in columns)} FROM shard.{table} t
+        {join}
+        LEFT JOIN shard.scrape_history sh ON sh.nid = t.nid
+        LEFT JOIN main.scrape_history mh ON mh.nid = t.nid
+        WHERE mh.{history_column} IS NULL
+        OR sh.{history_column} >= mh.{history_column}
+        OR NOT EXISTS (SELECT 1 FROM main.{table} m WHERE {key_match})
+        ON CONFLICT ({', '.join(key)}) DO UPDATE SET
+        {', '.join(f'{column} = excluded.{column}' for column in columns if column not in key)}
+        """
+    )
+    return cursor.rowcount
+
+
+def merge_dictionaries(connection: sqlite3.Connection):
+    """
+    Copies the compression dictionaries of the shard which the main database doesn't have yet,
+    temp.dictionary_map maps their ids in the shard to their ids in the main database
+    """
+    connection.execute("CREATE TEMP TABLE IF NOT EXISTS dictionary_map(shard_id integer PRIMARY KEY, main_id integer)")
+    connection.execute("DELETE FROM temp.dictionary_map")
+
+    shard_dictionaries = connection.execute("SELECT id, codec, dictionary, created_datetime FROM shard.compression_dictionaries")
+    for shard_id, codec, dictionary, created in shard_dictionaries.fetchall():
+        row = connection.execute(
+            "SELECT id FROM main.compression_dictionaries WHERE codec = ? AND dictionary = ?", (codec, dictionary)
+        ).fetchone()
+        if row is None:
+            main_id = connection.execute(
+                "INSERT INTO main.compression_dictionaries (codec, dictionary, created_datetime) VALUES (?, ?, ?)",
+                (codec, dictionary, created)
+            ).lastrowid
+        else:
+            main_id = row[0]
+        connection.execute("INSERT INTO temp.dictionary_map (shard_id, main_id) VALUES (?, ?)", (shard_id, main_id))
+
+
+def merge_scrape_history(connection: sqlite3.Connection) -> int:
+    """
+    Keeps the newest datetime of each stage, must run after the other tables have been compared against it
+    """
+    stages = ('last_info_scrape_datetime', 'last_impression_scrape_datetime', 'last_content_scrape_datetime')
+    newest = ', '.join(
+        f'{stage} = CASE WHEN {stage} IS NULL OR excluded.{stage} > {stage} THEN excluded.{stage} ELSE {stage} END'
+        for stage in stages
+    )
+
+    cursor = connection.execute(
+        f"""
+        INSERT INTO main.scrape_history (nid, {', '.join(stages)}, r18)
+        SELECT nid, {', '.join(stages)}, r18 FROM shard.scrape_history WHERE true
+        ON CONFLICT (nid) DO UPDATE SET {newest}, r18 = coalesce(excluded.r18, r18)
+        """
+    )
+    return cursor.rowcount
+
+
+def merge_nid_queue(connection: sqlite3.Connection) -> int:
+    cursor = connection.execute(
+        """
+        INSERT INTO main.nid_queue (nid, r18, general_firstup, general_lastup, discovered_datetime, scraped_datetime)
+        SELECT nid, r18, general_firstup, general_lastup, discovered_datetime, scraped_datetime FROM shard.nid_queue WHERE true
+        ON CONFLICT (nid) DO UPDATE SET
+        general_lastup = max(general_lastup, excluded.general_lastup),
+        scraped_datetime = coalesce(max(scraped_datetime, excluded.scraped_datetime), scraped_datetime, excluded.scraped_datetime)
+        """
+    )
+    return cursor.rowcount
+
+
+def merge_shard(connection: sqlite3.Connection, shard_path: str):
+    """
+    Merges a database written by another node into the main database in one transaction.
+    Checkpoints, progress and dead nids only make sense on the node that wrote them, so they are not merged.
+    """
+    start_time = default_timer()
+    connection.execute('ATTACH DATABASE ? AS shard', (shard_path,))
+
+    try:
+        shard_tables = {row[0] for row in connection.execute("SELECT name FROM shard.sqlite_master WHERE type = 'table'")}
+
+        with connection:
+            if 'compression_dictionaries' in shard_tables:
+                merge_dictionaries(connection)
+
+            for table, key, history_column in merged_tables:
+                if table in shard_tables:
+                    rows = merge_table(connection, table, key, history_column)
+                    logger.info(f'Merged {rows} rows of {table} from {shard_path}')
+
+            if 'scrape_history' in shard_tables:
+                rows = merge_scrape_history(connection)
+                logger.info(f'Merged {rows} rows of scrape_history from {shard_path}')
+
+            if 'nid_queue' in shard_tables:
+                rows = merge_nid_queue(connection)
+                logger.info(f'Merged {rows} rows of nid_queue from {shard_path}')
+    finally:
+        connection.execute('DETACH DATABASE shard')
+
+    logger.info(f'Merged {shard_path} in {default_timer() - start_time}s')
+
+
+if __name__ == '__main__':
+    initialize_db()
+    conn = connect(db_name)
+
+    for shard in script_args.shards or []:
+        merge_shard(conn, shard)
+
+    conn.close()
@@ -0,0 +1,248 @@
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from timeit import default_timer
+from typing import Callable
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def escape_label_value(value: str) -> str:
+    """
+    Backslashes, double quotes and line feeds have to be escaped in label values of the text format
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, label_names: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def _format_labels(self, key: tuple, extra: str = '') -> str:
+        labels = [f'{name}="{escape_label_value(value)}"' for name, value in zip(self.label_names, key)]
+        if extra:
+            labels.append(extra)
+        return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, label_names: tuple = ()):
+        super().__init__(name, help, label_names)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self) -> list[str]:
+        with self._lock:
+            return [f'{self.name}{self._format_labels(key)} {value}' for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, label_names: tuple = (), buckets: tuple = default_buckets):
+        super().__init__(name, help, label_names)
+        self.buckets = buckets
+        # bucket counts, sum and count of every label combination
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        start_time = default_timer()
+        try:
+            yield
+        finally:
+            self.observe(default_timer() - start_time, **labels)
+
+    def take(self) -> dict:
+        """
+        Everything observed since the last take, which is cleared. Lets another process send its observations to merge
+        """
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, (counts, total, count) in values.items():
+                own_counts, own_total, own_count = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+                self._values[key] = ([a + b for a, b in zip(own_counts, counts)], own_total + total, own_count + count)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            return self._values.get(self._key(labels), (None, 0.0, 0))[2]
+
+    def totals(self) -> tuple[float, int]:
+        with self._lock:
+            return sum(value[1] for value in self._values.values()), sum(value[2] for value in self._values.values())
+
+    def render(self) -> list[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                    cumulative += bucket_count
+                    bucket_label = 'le="{}"'.format(bound)
+                    lines.append(f'{self.name}_bucket{self._format_labels(key, bucket_label)} {cumulative}')
+                lines.append(f'{self.name}_sum{self._format_labels(key)} {total}')
+                lines.append(f'{self.name}_count{self._format_labels(key)} {count}')
+        return lines
+
+
+registry: dict[str, Metric] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(cls, name: str, help: str, label_names: tuple, **kwargs):
+    with _registry_lock:
+        metric = registry.get(name)
+        if metric is None:
+            metric = registry[name] = cls(name, help, label_names, **kwargs)
+        return metric
+
+
+def counter(name: str, help: str, label_names: tuple = ()) -> Counter:
+    return _get_or_create(Counter, name, help, label_names)
+
+
+def histogram(name: str, help: str, label_names: tuple = (), buckets: tuple = default_buckets) -> Histogram:
+    return _get_or_create(Histogram, name, help, label_names, buckets=buckets)
+
+
+# Metrics of the scraper, defined here so that every mode counts into the same objects
+
+# api.request_with_retries
+request_seconds = histogram('http_request_seconds', 'Time of every request, retries are separate requests', ('host',))
+rate_limit_wait_seconds = histogram('http_rate_limit_wait_seconds', 'Time spent waiting for the rate limiter', ('host',))
+responses_total = counter('http_responses_total', 'Responses by status, failed connections have status 0', ('host', 'status'))
+retries_total = counter('http_retries_total', 'Requests which were tried again', ('host', 'reason'))
+response_bytes_total = counter('http_response_bytes_total', 'Decompressed bytes of response bodies', ('host',))
+cache_hits_total = counter('http_cache_hits_total', 'Pages served from --cache-dir', ('host', 'kind'))
+
+# soup.make_soup and the extractors
+parse_seconds = histogram('html_parse_seconds', 'Time to build the tree of a page', ('page',))
+extract_seconds = histogram('extract_seconds', 'Time to extract the models from a page', ('page',))
+
+# sqlite_save and sqlite_save_many, with the DatabaseWriter this is the time to queue the statements
+rows_written_total = counter('db_rows_written_total', 'Rows passed to sqlite_save and sqlite_save_many', ('table',))
+write_seconds = histogram('db_write_seconds', 'Time of every sqlite_save and sqlite_save_many call', ('table',))
+
+# main.timing_decorator and the pipeline
+novel_seconds = histogram('novel_scrape_seconds', 'Time from the first request of a novel until it is saved',
+                          buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+novels_total = counter('novels_scraped_total', 'Novels which were scraped or failed', ('result',))
+error_pages_total = counter('error_pages_total', 'Nids which returned an error page')
+
+
+def timed(metric: Histogram, **labels):
+    """
+    Decorator observing how long every call of the function takes
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with metric.time(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    """
+    Every metric in the Prometheus text format
+    """
+    lines = []
+    with _registry_lock:
+        metrics = list(registry.values())
+    for metric in metrics:
+        help_text = metric.help.replace('\\', '\\\\').replace('\n', '\\n')
+        lines.append(f'# HELP {metric.name} {help_text}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def summary() -> str:
+    """
+    One line with the total of every counter and the mean of every histogram
+    """
+    parts = []
+    with _registry_lock:
+        metrics = list(registry.values())
+    for metric in metrics:
+        if isinstance(metric, Counter):
+            parts.append(f'{metric.name}={metric.total():g}')
+        else:
+            total, count = metric.totals()
+            if count:
+                parts.append(f'{metric.name}={count}x{total / count * 1000:.1f}ms')
+    return ' '.join(parts)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+def start_summary(interval: float, report: Callable[[str], None]) -> threading.Event:
+    """
+    Calls report with the summary every interval seconds until the returned event is set
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            report(f'Metrics {summary()}')
+
+    threading.Thread(target=run, name='metrics-summary', daemon=True).start()
+    return stop
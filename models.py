@@ -1,19 +1,102 @@
 import sqlite3
 from dataclasses import dataclass, field
-from datetime import datetime
-from typing import Union, List, Optional
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Iterable, Iterator, NamedTuple, Union, List, Optional
 
+from args import script_args
+from compression import TextCompressor, default_codec, has_zstandard, load_compressors, pack_text, unpack_text
 from logger import logger
+from metrics import rows_written_total, write_seconds
 
 db_name = 'novels.db'
 
 
+def connect(database: str = db_name) -> sqlite3.Connection:
+    """
+    Opens the database with the pragmas used for scraping.
+    NORMAL is durable enough in WAL mode, a crash can only lose the last transactions.
+    """
+    conn = sqlite3.connect(database)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    # negative values are in KiB
+    conn.execute(f'PRAGMA cache_size = {-script_args.db_cache_mb * 1024}')
+    return conn
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+# The site and the api show datetimes in Japan time without a timezone, which has no daylight saving time
+site_timezone = timezone(timedelta(hours=9), 'JST')
+
+
+def site_now() -> datetime:
+    """
+    The current time in Japan time without tzinfo, so that the scrape datetimes it stamps compare with scraped datetimes
+    on hosts in any timezone
+    """
+    return datetime.now(site_timezone).replace(tzinfo=None)
+
+
+def site_timestamp(value: datetime) -> int:
+    """
+    Unix timestamp of a datetime, which is taken to be in Japan time if it has no tzinfo
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=site_timezone)
+    return int(value.timestamp())
+
+
+def parse_datetime(value: Union[str, datetime, None]) -> Optional[datetime]:
+    """
+    sqlite3 stores datetimes as iso formatted strings, convert them back when reading
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
 class ModelBaseClass:
     # nid must be passed on init
     def __post_init__(self):
         if hasattr(self, 'nid'):
             self.nid = self.nid.upper()
 
+    @classmethod
+    def insert_sql(cls) -> str:
+        columns = cls.Meta.columns
+        return f'INSERT OR REPLACE INTO {cls.Meta.db_table} ({", ".join(columns)}) VALUES ({",".join("?" * len(columns))})'
+
+    def sqlite_params(self) -> tuple:
+        return tuple(getattr(self, column) for column in self.Meta.columns)
+
+    def to_record(self) -> tuple:
+        """
+        Only for models with a record type in Meta
+        """
+        return self.Meta.record(*self.sqlite_params())
+
+    def sqlite_save(self, cursor: sqlite3.Cursor):
+        with write_seconds.time(table=self.Meta.db_table):
+            cursor.execute(self.insert_sql(), self.sqlite_params())
+        rows_written_total.inc(table=self.Meta.db_table)
+
+    @classmethod
+    def sqlite_save_many(cls, cursor: sqlite3.Cursor, models: Iterable[Union['ModelBaseClass', tuple]]):
+        """
+        Writes all models or records with a single executemany, they are committed together by the caller
+        """
+        with write_seconds.time(table=cls.Meta.db_table):
+            # records already are the parameter tuples
+            params = [model if isinstance(model, tuple) else model.sqlite_params() for model in models]
+            cursor.executemany(cls.insert_sql(), params)
+        rows_written_total.inc(len(params), table=cls.Meta.db_table)
+
 
 @dataclass
 class NovelInfoModel(ModelBaseClass):
@@ -40,17 +123,14 @@ class NovelInfoModel(ModelBaseClass):
 
     class Meta:
         db_table = 'novel_info'
+        columns = ('nid', 'title', 'summary', 'keywords', 'genre', 'released_datetime', 'last_updated_datetime',
+                   'impression_count', 'review_count', 'bookmark_count', 'total_review_point', 'review_point',
+                   'character_count', 'user_id', 'impression_id')
 
-    def sqlite_save(self, cursor: sqlite3.Cursor):
-        cursor.execute(
-            f'INSERT OR REPLACE INTO {self.Meta.db_table} '
-            '(nid, title, summary, keywords, genre, released_datetime, last_updated_datetime, impression_count, '
-            'review_count, bookmark_count, total_review_point, review_point, character_count, user_id, impression_id) '
-            'VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
-            (self.nid, self.title, self.summary, ','.join(self.keywords), self.genre, self.released_datetime,
-             self.last_updated_datetime, self.impression_count, self.review_count, self.bookmark_count,
-             self.total_review_point, self.review_point, self.character_count, self.user_id, self.impression_id)
-        )
+    def sqlite_params(self) -> tuple:
+        return (self.nid, self.title, self.summary, ','.join(self.keywords), self.genre, self.released_datetime,
+                self.last_updated_datetime, self.impression_count, self.review_count, self.bookmark_count,
+                self.total_review_point, self.review_point, self.character_count, self.user_id, self.impression_id)
 
 
 def create_novel_info_table(cur: sqlite3.Cursor):
@@ -74,6 +154,22 @@ def create_novel_info_table(cur: sqlite3.Cursor):
         'PRIMARY KEY (nid))')
 
 
+class ContentRecord(NamedTuple):
+    """
+    NovelContentModel for bulk paths. The fields are in the order of the columns so that the record itself is the
+    parameter tuple of sqlite_save_many, and the nid is not upper cased, it has to be already.
+    """
+    nid: str
+    title: str
+    content: str
+    created_datetime: datetime
+    last_updated_datetime: Optional[datetime]
+    part: Optional[str]
+    page_num: int
+    pre_content: Optional[str]
+    post_content: Optional[str]
+
+
 @dataclass
 class NovelContentModel(ModelBaseClass):
     nid: str
@@ -88,13 +184,82 @@ class NovelContentModel(ModelBaseClass):
 
     class Meta:
         db_table = 'novel_content'
+        columns = ('nid', 'title', 'content', 'created_datetime', 'last_updated_datetime', 'part', 'page_num',
+                   'pre_content', 'post_content')
+        record = ContentRecord
 
     def sqlite_save(self, cursor: sqlite3.Cursor):
-        cursor.execute(
-            f'INSERT OR REPLACE INTO {self.Meta.db_table}'
-            '(nid, title, content, created_datetime, last_updated_datetime, part, page_num, pre_content, post_content) VALUES (?,?,?,?,?,?,?,?,?)',
-            (self.nid, self.title, self.content, self.created_datetime, self.last_updated_datetime, self.part, self.page_num, self.pre_content, self.post_content),
-        )
+        self.sqlite_save_many(cursor, [self])
+
+    @classmethod
+    def sqlite_save_many(cls, cursor: sqlite3.Cursor, models: Iterable[Union['NovelContentModel', ContentRecord]]):
+        """
+        With --compress-content the text is compressed into novel_content_text and left NULL in novel_content,
+        load_novel_contents reads chapters saved either way
+        """
+        if not script_args.compress_content:
+            super().sqlite_save_many(cursor, models)
+            return
+
+        models = list(models)
+        with write_seconds.time(table=cls.Meta.db_table):
+            compressor = get_content_compressor(cursor)
+            cursor.executemany(cls.insert_sql(), [
+                (model.nid, model.title, None, model.created_datetime, model.last_updated_datetime, model.part,
+                 model.page_num, None, None) for model in models
+            ])
+            cursor.executemany(
+                'INSERT OR REPLACE INTO novel_content_text (nid, created_datetime, codec, dictionary_id, data) VALUES (?, ?, ?, ?, ?)',
+                [(model.nid, model.created_datetime, compressor.codec, compressor.dictionary_id,
+                  compressor.compress(pack_text(model.pre_content, model.content, model.post_content))) for model in models]
+            )
+        rows_written_total.inc(len(models), table=cls.Meta.db_table)
+
+
+# Compressors by dictionary id, the one used for new text is under None
+content_compressors: dict[Optional[int], TextCompressor] = {}
+
+
+def get_content_compressor(cursor: sqlite3.Cursor) -> TextCompressor:
+    if None not in content_compressors:
+        content_compressors.update(load_compressors(cursor))
+        newest = max((key for key in content_compressors if key is not None), default=None)
+        if newest is None and not has_zstandard:
+            logger.warning('zstandard is not installed, chapter text is compressed with zlib instead')
+        content_compressors[None] = content_compressors[newest] if newest is not None else TextCompressor(default_codec())
+    return content_compressors[None]
+
+
+def load_novel_contents(cursor: sqlite3.Cursor, nid: str) -> list[NovelContentModel]:
+    """
+    Chapters of a novel in page order, compressed text is decompressed
+    """
+    cursor.execute(
+        """
+        SELECT c.nid, c.title, c.content, c.created_datetime, c.last_updated_datetime, c.part, c.page_num,
+        c.pre_content, c.post_content, t.codec, t.dictionary_id, t.data
+        FROM novel_content c LEFT JOIN novel_content_text t ON t.nid = c.nid AND t.created_datetime = c.created_datetime
+        WHERE c.nid = ? ORDER BY c.page_num
+        """,
+        (nid,)
+    )
+    rows = cursor.fetchall()
+
+    contents = []
+    for nid, title, content, created, updated, part, page_num, pre, post, codec, dictionary_id, data in rows:
+        # text saved without --compress-content after it was compressed once is newer
+        if content is None and data is not None:
+            if dictionary_id not in content_compressors:
+                content_compressors.update(load_compressors(cursor))
+            compressor = content_compressors.get(dictionary_id) if dictionary_id is not None else TextCompressor(codec)
+            pre, content, post = unpack_text(compressor.decompress(data))
+
+        contents.append(NovelContentModel(
+            nid=nid, title=title, content=content, created_datetime=parse_datetime(created),
+            last_updated_datetime=parse_datetime(updated), part=part, page_num=page_num,
+            pre_content=pre, post_content=post
+        ))
+    return contents
 
 
 def create_novel_content_table(cur: sqlite3.Cursor):
@@ -114,6 +279,43 @@ def create_novel_content_table(cur: sqlite3.Cursor):
     )
 
 
+def create_novel_content_text_tables(cur: sqlite3.Cursor):
+    """
+    Compressed chapter text, kept apart from novel_content so scanning chapters doesn't read through the text.
+    content, pre_content and post_content of novel_content are NULL for the chapters stored here.
+    """
+    cur.execute("""
+CREATE TABLE IF NOT EXISTS compression_dictionaries(
+id integer PRIMARY KEY,
+codec text,
+dictionary BLOB,
+created_datetime DATETIME
+)""")
+    cur.execute("""
+CREATE TABLE IF NOT EXISTS novel_content_text(
+nid VARCHAR(7),
+created_datetime DATETIME,
+codec text,
+dictionary_id integer NULL,
+data BLOB,
+PRIMARY KEY (nid, created_datetime),
+FOREIGN KEY (dictionary_id) REFERENCES compression_dictionaries(id)
+)""")
+
+
+class ImpressionRecord(NamedTuple):
+    """
+    NovelImpressionModel for bulk paths, see ContentRecord
+    """
+    nid: str
+    user_id: Optional[int]
+    created_datetime: datetime
+    impression_hitokoto: Optional[str]
+    impression_yoiten: Optional[str]
+    impression_kininaruten: Optional[str]
+    on_part: Optional[str]
+
+
 @dataclass
 class NovelImpressionModel(ModelBaseClass):
     nid: int
@@ -129,15 +331,9 @@ class NovelImpressionModel(ModelBaseClass):
 
     class Meta:
         db_table = 'novel_impression'
-
-    def sqlite_save(self, cursor: sqlite3.Cursor):
-        cursor.execute(
-            f'INSERT OR REPLACE INTO {self.Meta.db_table} '
-            '(nid, user_id, created_datetime, impression_hitokoto, impression_yoiten, impression_kininaruten, on_part) '
-            'VALUES (?,?,?,?,?,?,?)',
-            (self.nid, self.user_id, self.created_datetime, self.impression_hitokoto,
-             self.impression_yoiten, self.impression_kininaruten, self.on_part)
-        )
+        columns = ('nid', 'user_id', 'created_datetime', 'impression_hitokoto', 'impression_yoiten',
+                   'impression_kininaruten', 'on_part')
+        record = ImpressionRecord
 
 
 def create_novel_impression_table(cur: sqlite3.Cursor):
@@ -155,8 +351,21 @@ def create_novel_impression_table(cur: sqlite3.Cursor):
     )
 
 
-def initialize_db():
-    conn = sqlite3.connect(db_name)
+def save_failed_nid(cursor: sqlite3.Cursor, nid: str, error: Exception):
+    """
+    Remembers a novel whose requests kept failing, it is scraped again with --retry-failed
+    """
+    cursor.execute(
+        """
+        INSERT INTO failed_nids (nid, error, attempts, failed_datetime) VALUES (?, ?, 1, ?)
+        ON CONFLICT (nid) DO UPDATE SET error = excluded.error, attempts = attempts + 1, failed_datetime = excluded.failed_datetime
+        """,
+        (nid, str(error), site_now())
+    )
+
+
+def initialize_db(database: str = db_name):
+    conn = connect(database)
     cur = conn.cursor()
 
     cur.execute("""
@@ -169,9 +378,58 @@ r18 BOOLEAN,
 FOREIGN KEY (nid) REFERENCES novel_info(nid)
 )""")
 
+    # Position of range sweeps, see main.py
+    cur.execute("""
+CREATE TABLE IF NOT EXISTS sweep_checkpoint(
+start_from VARCHAR(7),
+end_with VARCHAR(7),
+last_nid VARCHAR(7),
+updated_datetime DATETIME,
+PRIMARY KEY (start_from, end_with)
+)""")
+
+    # Last committed page of a novel whose impressions or content are still being scraped
+    cur.execute("""
+CREATE TABLE IF NOT EXISTS scrape_progress(
+nid VARCHAR(7),
+stage text,
+page_num integer,
+PRIMARY KEY (nid, stage)
+)""")
+
+    # Bitmaps of nids which returned an error page, see deadlist.py
+    cur.execute("""
+CREATE TABLE IF NOT EXISTS dead_nids(
+generation integer PRIMARY KEY,
+created_timestamp REAL,
+bitmap BLOB
+)""")
+
+    # Novels whose requests kept failing, unlike dead nids they may exist
+    cur.execute("""
+CREATE TABLE IF NOT EXISTS failed_nids(
+nid VARCHAR(7) PRIMARY KEY,
+error text,
+attempts integer,
+failed_datetime DATETIME
+)""")
+
+    # Nids found through the api by retrieve_all_nids.py
+    cur.execute("""
+CREATE TABLE IF NOT EXISTS nid_queue(
+nid VARCHAR(7) PRIMARY KEY,
+r18 BOOLEAN,
+general_firstup DATETIME,
+general_lastup DATETIME,
+discovered_datetime DATETIME,
+scraped_datetime DATETIME NULL
+)""")
+    cur.execute("CREATE INDEX IF NOT EXISTS nid_queue_unscraped ON nid_queue (general_firstup, nid) WHERE scraped_datetime IS NULL")
+
     create_novel_info_table(cur)
     create_novel_impression_table(cur)
     create_novel_content_table(cur)
+    create_novel_content_text_tables(cur)
 
     conn.commit()
     conn.close()
@@ -1,4 +1,11 @@
 import re
+from functools import total_ordering
+from typing import Iterator, Optional
+
+numbers_per_suffix = 10000
+suffix_count = 26 * 26
+# N0000AA to N9999ZZ
+nid_space = numbers_per_suffix * suffix_count
 
 
 def increment_letter(letter):
@@ -29,33 +36,77 @@ def decrement_suffix(string):
         return string[0] + decrement_letter(string[1])
 
 
-class Nid:
+def nid_to_int(id: str) -> int:
     """
-    Just used for comparison
+    Position of a normalized nid in the order nids are issued, the suffix is more significant than the number.
+    N0000AA is 0, N9999AA is 9999, N0000AB is 10000 and N9999ZZ is nid_space - 1
     """
+    suffix = (ord(id[-2]) - ord('A')) * 26 + ord(id[-1]) - ord('A')
+    return suffix * numbers_per_suffix + int(id[1:5])
 
-    def generate_nids(self, reverse=False):
-        suffix = self.id[-2:]
-        number = int(self.id[1:-2])
 
-        if not reverse:
-            while True:
-                yield f'N{number:0>4}{suffix}'
+def int_to_nid(value: int) -> str:
+    suffix, number = divmod(value % nid_space, numbers_per_suffix)
+    first, second = divmod(suffix, 26)
+    return f'N{number:0>4}{chr(ord("A") + first)}{chr(ord("A") + second)}'
+
 
-                number += 1
+def nid_range(start_from: 'Nid', end_with: 'Nid', reverse: Optional[bool] = None) -> range:
+    """
+    Integers of every nid from start_from to end_with, inclusive.
+    Being a range, its length, slices and the position of a nid in it are computed without iterating.
+    """
+    if reverse is None:
+        reverse = start_from > end_with
 
-                if number > 9999:
-                    number = 0
-                    suffix = increment_suffix(suffix)
+    if reverse:
+        return range(int(start_from), int(end_with) - 1, -1)
+    return range(int(start_from), int(end_with) + 1)
 
-        while True:
-            yield f'N{number:0>4}{suffix}'
 
-            number -= 1
+def shard_range(nids: range, count: int, index: int, interleaved=False) -> range:
+    """
+    Part index of count parts of nids, so that a range can be split across processes or machines.
+    Contiguous shards are consecutive blocks, interleaved shards take every count-th nid.
+    """
+    if not 0 <= index < count:
+        raise ValueError(f'Invalid shard {index} of {count}')
+
+    if interleaved:
+        return nids[index::count]
+    return nids[index * len(nids) // count:(index + 1) * len(nids) // count]
+
+
+def iterate_nids(nids: range) -> Iterator[str]:
+    return map(int_to_nid, nids)
+
+
+def generate_nids(id: str, reverse=False) -> Iterator[str]:
+    return Nid(id).generate_nids(reverse=reverse)
+
 
-            if number < 0:
-                number = 9999
-                suffix = decrement_suffix(suffix)
+@total_ordering
+class Nid:
+    """
+    A validated nid and its integer from nid_to_int.
+    Compares, hashes and converts with int() like the integer, so it can be used in ranges and for sharding,
+    adding or subtracting an int gives the nid that many positions away.
+    """
+
+    def generate_nids(self, reverse=False):
+        """
+        Every nid after this one, wrapping around after N9999ZZ (or before N0000AA when reversed)
+        """
+        value = int(self)
+        step = -1 if reverse else 1
+
+        while True:
+            yield int_to_nid(value)
+            value += step
+
+    @classmethod
+    def from_int(cls, value: int) -> 'Nid':
+        return cls(int_to_nid(value))
 
     def __init__(self, id):
         id = id.upper()
@@ -71,10 +122,36 @@ class Nid:
             raise ValueError(f"Invalid Nid: {id}")
 
         self.id = id
+        self._value = nid_to_int(id)
+
+    def __int__(self):
+        return self._value
+
+    def __index__(self):
+        return self._value
+
+    def __hash__(self):
+        return self._value
+
+    def __repr__(self):
+        return f'Nid({self.id!r})'
 
     def __eq__(self, other):
-        return self.id == other.id
+        if not isinstance(other, Nid):
+            return NotImplemented
+        return self._value == other._value
 
     def __lt__(self, other):
-        return (self.id[-2:] < other.id[-2:]) or (
-                self.id[-2:] == other.id[-2:] and int(self.id[1:5]) < int(other.id[1:5]))
+        return self._value < other._value
+
+    def __add__(self, other: int) -> 'Nid':
+        return Nid.from_int(self._value + other)
+
+    def __sub__(self, other: int) -> 'Nid':
+        return Nid.from_int(self._value - other)
+
+    def distance(self, other: 'Nid') -> int:
+        """
+        Number of nids from this one to other, negative if other comes before
+        """
+        return other._value - self._value
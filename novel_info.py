@@ -1,14 +1,16 @@
 from datetime import datetime
 from typing import Optional
 
-import yaml
 from bs4 import BeautifulSoup
 
-from api import request_with_retries
+from api import parse_api_datetime, query_api, request_with_retries
 from impression import get_impression_id
+from metrics import extract_seconds, timed
 from models import NovelInfoModel
+from soup import make_soup
 
 
+@timed(extract_seconds, page='detail')
 def extract_novel_info(detail_page_soup: BeautifulSoup) -> NovelInfoModel:
     """
     Extracts novel info from detail page soup.
@@ -28,8 +30,7 @@ def extract_novel_info(detail_page_soup: BeautifulSoup) -> NovelInfoModel:
     except TypeError:
         # Use api to get user id
         # Sometimes there is no hyperlink to user page
-        res = request_with_retries("https://api.syosetu.com/novelapi/api/?ncode={}&of=u".format(nid))
-        data = yaml.safe_load(res)
+        data = query_api("https://api.syosetu.com/novelapi/api/?ncode={}&of=u".format(nid))
         user_id = int(data[1]['userid'])
 
     cell_to_field = {
@@ -108,6 +109,79 @@ def extract_novel_info(detail_page_soup: BeautifulSoup) -> NovelInfoModel:
     return novel_info
 
 
+# Genre codes of novelapi as they are written on detail pages
+genre_names = {
+    101: '異世界〔恋愛〕',
+    102: '現実世界〔恋愛〕',
+    201: 'ハイファンタジー〔ファンタジー〕',
+    202: 'ローファンタジー〔ファンタジー〕',
+    301: '純文学〔文芸〕',
+    302: 'ヒューマンドラマ〔文芸〕',
+    303: '歴史〔文芸〕',
+    304: '推理〔文芸〕',
+    305: 'ホラー〔文芸〕',
+    306: 'アクション〔文芸〕',
+    307: 'コメディー〔文芸〕',
+    401: 'VRゲーム〔SF〕',
+    402: '宇宙〔SF〕',
+    403: '空想科学〔SF〕',
+    404: 'パニック〔SF〕',
+    9901: '童話〔その他〕',
+    9902: '詩〔その他〕',
+    9903: 'エッセイ〔その他〕',
+    9904: 'リプレイ〔その他〕',
+    9999: 'その他〔その他〕',
+    9801: 'ノンジャンル〔ノンジャンル〕',
+}
+
+# novelapi limits lim to 500
+api_batch_size = 500
+
+
+def novel_info_from_api(novel: dict) -> NovelInfoModel:
+    """
+    The api has no impression id, it is left as None.
+    Datetimes are cut to minutes like the ones on detail pages.
+    """
+    return NovelInfoModel(
+        title=str(novel['title']),
+        summary=str(novel['story']),
+        # R18 novels have no genre
+        genre=genre_names.get(novel.get('genre'), ''),
+        keywords=[kw for kw in str(novel['keyword'] or '').split(' ') if kw.strip()],
+        impression_id=None,
+        nid=novel['ncode'],
+
+        released_datetime=parse_api_datetime(novel['general_firstup']).replace(second=0),
+        last_updated_datetime=parse_api_datetime(novel['general_lastup']).replace(second=0),
+
+        impression_count=novel['impression_cnt'],
+        review_count=novel['review_cnt'],
+        bookmark_count=novel['fav_novel_cnt'],
+        total_review_point=novel['global_point'],
+        review_point=novel['all_point'],
+        character_count=novel['length'],
+
+        user_id=novel['userid']
+    )
+
+
+def query_novel_infos(nids: list[str], api='novelapi') -> dict[str, NovelInfoModel]:
+    """
+    Info of up to api_batch_size novels in a single request, nids the api doesn't know are missing from the result
+    """
+    of = 't-n-u-s-k-gf-gl-l-gp-f-imp-r-a'
+    if api == 'novelapi':
+        of += '-g'
+
+    request_url = f'https://api.syosetu.com/{api}/api/?ncode={"-".join(nids).lower()}&of={of}&lim={api_batch_size}'
+    data = query_api(request_url)
+
+    # the first entry only has allcount
+    infos = (novel_info_from_api(novel) for novel in data[1:])
+    return {info.nid: info for info in infos}
+
+
 def get_detail_page_soup(nid: str, is_r18=False) -> Optional[BeautifulSoup]:
     url = f'https://ncode.syosetu.com/novelview/infotop/ncode/{nid}/'
 
@@ -118,5 +192,6 @@ def get_detail_page_soup(nid: str, is_r18=False) -> Optional[BeautifulSoup]:
     if response is None:
         return None
 
-    soup = BeautifulSoup(response, 'html.parser')
+    # the extractors look all over the detail page, so it is parsed whole
+    soup = make_soup(response)
     return soup
@@ -0,0 +1,489 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from itertools import count
+from timeit import default_timer
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from api import RequestFailed, request_with_retries
+from args import script_args
+from content import get_chapter_text, single_page_content, table_of_contents_entries
+from deadlist import DeadNidSet
+from impression import extract_impressions, get_max_page, get_newest_impression_datetime, reached_stored_impressions
+from logger import logger
+from metrics import error_pages_total, extract_seconds, novel_seconds, novels_total, parse_seconds
+from models import ContentRecord, ImpressionRecord, NovelContentModel, NovelImpressionModel, NovelInfoModel, db_name, parse_datetime, \
+    save_failed_nid, site_now
+from novel_info import extract_novel_info
+from profiler import start_worker_profiler
+from soup import impression_strainer, make_soup, table_of_contents_strainer
+from writer import DatabaseWriter
+
+
+def profiler_initializer() -> dict:
+    """
+    Arguments of ProcessPoolExecutor which profile the parser processes too with --profile
+    """
+    if not script_args.profile:
+        return {}
+    return {
+        'initializer': start_worker_profiler,
+        'initargs': (script_args.profile_interval_ms / 1000, script_args.profile_window, script_args.profile_output),
+    }
+
+
+def start_parser_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool for the parsers with its worker processes already running.
+    Call it before any other thread is started, forking while threads hold locks can deadlock.
+    """
+    pool = ProcessPoolExecutor(max_workers=workers, **profiler_initializer())
+    pool.submit(int).result()
+    return pool
+
+
+# Parsers run in worker processes. They get the downloaded bytes and return models, never soups.
+# Their html_parse_seconds and extract_seconds are sent back with the results, see parse_in_worker.
+
+def parse_detail_page(body: bytes) -> Optional[tuple[bool, NovelInfoModel]]:
+    soup = make_soup(body)
+    if soup.find('title').text == 'エラー':
+        return None
+    return bool(soup.find('span', {'id': 'age_limit'})), extract_novel_info(soup)
+
+
+def parse_table_of_contents(body: bytes, url: str, info: NovelInfoModel) -> tuple[Optional[ContentRecord], list]:
+    soup = make_soup(body, parse_only=table_of_contents_strainer)
+    if soup.select_one('.index_box') is None:
+        return single_page_content(info.nid, info, soup), []
+    return None, table_of_contents_entries(soup, url)
+
+
+def parse_chapter(body: bytes, nid: str, entry: tuple, page_num: int) -> ContentRecord:
+    _, title, created, last_update, chapter_title = entry
+    pre, content, post = get_chapter_text(body)
+
+    return ContentRecord(
+        nid=nid,
+        title=title,
+        last_updated_datetime=last_update,
+        created_datetime=created,
+        part=chapter_title,
+        content=content,
+        pre_content=pre,
+        post_content=post,
+        page_num=page_num  # an assumption
+    )
+
+
+def parse_impression_page(body: bytes, first_page: bool) -> tuple[list[ImpressionRecord], Optional[int]]:
+    soup = make_soup(body, parse_only=impression_strainer)
+    if not first_page:
+        return extract_impressions(soup), None
+
+    max_page = get_max_page(soup)
+    return (extract_impressions(soup) if max_page else []), max_page
+
+
+parsers = {
+    'detail': parse_detail_page,
+    'toc': parse_table_of_contents,
+    'chapter': parse_chapter,
+    'impression': parse_impression_page,
+}
+
+# Metrics observed by the parsers
+worker_metrics = (parse_seconds, extract_seconds)
+
+
+def parse_in_worker(kind: str, body: bytes, *args) -> tuple[object, list[dict]]:
+    """
+    Runs a parser and takes what it observed, which the pipeline merges into the metrics of the main process
+    """
+    result = parsers[kind](body, *args)
+    return result, [metric.take() for metric in worker_metrics]
+
+
+class Task(NamedTuple):
+    kind: str
+    nid: str
+    url: str
+    # extra arguments of the parser
+    args: tuple = ()
+    # of chapters and impression pages, for scrape_progress
+    page: int = 0
+
+
+class NovelState:
+    def __init__(self, nid: str):
+        self.nid = nid
+        self.start_time = default_timer()
+        self.is_r18 = False
+        self.info: Optional[NovelInfoModel] = None
+        self.detail_done = False
+        # outstanding tasks of each stage, a stage is finished when it drops back to 0
+        self.pending = {'impression': 0, 'content': 0}
+        self.impression_start_page = 1
+        self.impression_url = None
+        self.impression_max_page = 0
+        self.next_impression_page = 2
+        # only set for incremental impression scraping
+        self.newest_impression: Optional[datetime] = None
+        # a request kept failing, results of tasks still in flight are dropped
+        self.failed = False
+        # pages of each stage which were scheduled but haven't been parsed yet, pages finish out of order
+        self.outstanding_pages = {'impression': set(), 'content': set()}
+        # pages of each stage up to which everything has been committed, see Pipeline.save_progress
+        self.checkpoint = {'impression': 0, 'content': 0}
+        self.pages_since_checkpoint = {'impression': 0, 'content': 0}
+
+    @property
+    def done(self) -> bool:
+        return self.failed or (self.detail_done and not any(self.pending.values()))
+
+
+class Pipeline:
+    """
+    Scrapes novels in three stages connected by queues:
+    fetcher threads download pages, a process pool parses them and a single DatabaseWriter saves the results.
+    Downloads wait when the parse queue is full, so memory is bounded by the queue sizes and the number of novels in flight.
+    Follow-up pages of novels in flight are fetched before new novels are started.
+    The scheduling itself happens in the calling thread, which is the only one touching NovelState.
+    """
+
+    def __init__(self, fetchers: int, parsers: int, dead_nids: Optional[DeadNidSet] = None):
+        self.fetchers = fetchers
+        self.parsers = parsers
+        self.max_novels = fetchers * 2
+        self.dead_nids = dead_nids
+
+        # follow-ups have priority 0, new novels 1, the counter keeps the order within a priority
+        self.fetch_queue = queue.PriorityQueue()
+        self.parse_queue = queue.Queue(maxsize=parsers * 4)
+        self.results = queue.Queue()
+        self.parse_slots = threading.Semaphore(parsers * 2)
+        self.stop = threading.Event()
+        self._sequence = count()
+
+        self.novels: dict[str, NovelState] = {}
+        self.content_buffer: list[ContentRecord] = []
+        self.impression_buffer: list[ImpressionRecord] = []
+
+    def schedule(self, task: Task, priority=0):
+        self.fetch_queue.put((priority, next(self._sequence), task))
+
+    def _fetch(self):
+        while not self.stop.is_set():
+            try:
+                _, _, task = self.fetch_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            try:
+                body = request_with_retries(task.url)
+            except Exception as e:
+                self.results.put((task, e))
+                continue
+
+            if body is None:
+                self.results.put((task, None))
+                continue
+
+            while not self.stop.is_set():
+                try:
+                    self.parse_queue.put((task, body), timeout=0.5)
+                    break
+                except queue.Full:
+                    pass
+
+    def _dispatch(self, pool: ProcessPoolExecutor):
+        while True:
+            item = self.parse_queue.get()
+            if item is None:
+                return
+            if self.stop.is_set():
+                continue
+
+            task, body = item
+            self.parse_slots.acquire()
+            future = pool.submit(parse_in_worker, task.kind, body, *task.args)
+            future.add_done_callback(lambda f, task=task: self._parsed(task, f))
+
+    def _parsed(self, task: Task, future: Future):
+        self.parse_slots.release()
+        error = future.exception()
+        if error is not None:
+            self.results.put((task, error))
+            return
+
+        result, observations = future.result()
+        for metric, values in zip(worker_metrics, observations):
+            metric.merge(values)
+        self.results.put((task, result))
+
+    def flush(self, cursor):
+        if self.content_buffer:
+            NovelContentModel.sqlite_save_many(cursor, self.content_buffer)
+            self.content_buffer = []
+        if self.impression_buffer:
+            NovelImpressionModel.sqlite_save_many(cursor, self.impression_buffer)
+            self.impression_buffer = []
+
+    def schedule_page(self, novel: NovelState, stage: str, task: Task):
+        novel.pending[stage] += 1
+        novel.outstanding_pages[stage].add(task.page)
+        self.schedule(task)
+
+    def save_progress(self, writer: DatabaseWriter, novel: NovelState, stage: str):
+        """
+        Like main.save_progress, commits everything saved so far and records the page before the first one still
+        outstanding, every page up to it has been saved. A crash after this only repeats the pages after it.
+        """
+        outstanding = novel.outstanding_pages[stage]
+        if not outstanding or min(outstanding) - 1 <= novel.checkpoint[stage]:
+            return
+
+        novel.checkpoint[stage] = min(outstanding) - 1
+        novel.pages_since_checkpoint[stage] = 0
+        cursor = writer.cursor()
+        self.flush(cursor)
+        cursor.execute(
+            "INSERT OR REPLACE INTO scrape_progress (nid, stage, page_num) VALUES (?, ?, ?)",
+            (novel.nid, stage, novel.checkpoint[stage])
+        )
+        writer.commit()
+
+    def finish_stage(self, writer: DatabaseWriter, novel: NovelState, stage: str):
+        cursor = writer.cursor()
+        self.flush(cursor)
+        cursor.execute(f"UPDATE scrape_history SET last_{stage}_scrape_datetime = ? WHERE nid = ?", (site_now(), novel.nid))
+        cursor.execute("DELETE FROM scrape_progress WHERE nid = ? AND stage = ?", (novel.nid, stage))
+        writer.commit()
+
+    def start_novel(self, writer: DatabaseWriter, novel: NovelState, result: Optional[tuple[bool, NovelInfoModel]]):
+        nid = novel.nid
+        novel.detail_done = True
+
+        # a 404 or an error page, failed requests arrive as RequestFailed and skip the novel instead
+        if result is None:
+            logger.info(f'Novel {nid} returned error page')
+            error_pages_total.inc()
+            # offline the page may just not have been cached
+            if self.dead_nids is not None and not script_args.offline:
+                self.dead_nids.add(nid)
+            return
+
+        if self.dead_nids is not None:
+            self.dead_nids.discard(nid)
+
+        novel.is_r18, novel.info = result
+        cursor = writer.cursor()
+
+        cursor.execute("SELECT last_impression_scrape_datetime, last_content_scrape_datetime FROM scrape_history WHERE nid = ?", (nid,))
+        history = cursor.fetchone()
+        if history is None:
+            cursor.execute("INSERT INTO scrape_history (nid, r18) VALUES (?, ?)", (nid, novel.is_r18))
+            history = (None, None)
+
+        if script_args.skip_r18 and novel.is_r18:
+            logger.info(f'Skip R18 novel {nid}')
+            writer.commit()
+            return
+
+        already_scraped_impression, already_scraped_content = map(bool, history)
+        will_skip_content = (script_args.skip_existing and already_scraped_content) or script_args.skip_content
+        will_skip_impression = (script_args.skip_existing and already_scraped_impression) or script_args.skip_impression
+
+        novel.info.sqlite_save(cursor)
+        cursor.execute("UPDATE scrape_history SET last_info_scrape_datetime = ? WHERE nid = ?", (site_now(), nid))
+        writer.commit()
+
+        host = 'novelcom18' if novel.is_r18 else 'novelcom'
+        if will_skip_impression:
+            logger.info(f'Skip impression scraping for {nid}')
+        else:
+            cursor.execute("SELECT page_num FROM scrape_progress WHERE nid = ? AND stage = 'impression'", (nid,))
+            progress = cursor.fetchone()
+            novel.impression_start_page = progress[0] + 1 if progress else 1
+            novel.checkpoint['impression'] = novel.impression_start_page - 1
+            # an interrupted walk has to be finished, the pages after it are older than what it saved
+            if not script_args.refresh_impressions and novel.impression_start_page == 1:
+                novel.newest_impression = get_newest_impression_datetime(cursor, nid)
+
+            novel.impression_url = f'https://{host}.syosetu.com/impression/list/ncode/{novel.info.impression_id}/'
+            first_page = Task('impression', nid, novel.impression_url, (True,), 1)
+            # a resumed walk only reads the page count from the first page
+            if novel.impression_start_page <= 1:
+                self.schedule_page(novel, 'impression', first_page)
+            else:
+                novel.pending['impression'] += 1
+                self.schedule(first_page)
+
+        host = 'novel18' if novel.is_r18 else 'ncode'
+        if will_skip_content:
+            logger.info(f'Skip content scraping for {nid}')
+        else:
+            url = f'https://{host}.syosetu.com/{nid}/'
+            novel.pending['content'] += 1
+            self.schedule(Task('toc', nid, url, (url, novel.info)))
+
+    def schedule_chapters(self, writer: DatabaseWriter, novel: NovelState, entries: list):
+        nid = novel.nid
+        cursor = writer.cursor()
+
+        stored_chapters = {}
+        if not script_args.refresh_content:
+            cursor.execute("SELECT created_datetime, last_updated_datetime FROM novel_content WHERE nid = ?", (nid,))
+            stored_chapters = {parse_datetime(created): parse_datetime(updated) for created, updated in cursor.fetchall()}
+
+        cursor.execute("SELECT page_num FROM scrape_progress WHERE nid = ? AND stage = 'content'", (nid,))
+        progress = cursor.fetchone()
+        skip_pages = progress[0] if progress else 0
+        novel.checkpoint['content'] = skip_pages
+
+        skipped = 0
+        for page_num, entry in enumerate(entries, start=1):
+            url, _, created, last_update, _ = entry
+            if page_num <= skip_pages or (created in stored_chapters and stored_chapters[created] == last_update):
+                skipped += 1
+                continue
+
+            self.schedule_page(novel, 'content', Task('chapter', nid, url, (nid, entry, page_num), page_num))
+
+        if skipped:
+            logger.info(f'Skipped {skipped} unchanged chapters of {nid}')
+
+    def handle(self, writer: DatabaseWriter, task: Task, result):
+        novel = self.novels.get(task.nid)
+        if novel is None or novel.failed:
+            return
+
+        if isinstance(result, RequestFailed):
+            # skipped instead of stopping the run, so that one novel can't stop a sweep at the same nid every run
+            logger.error(f'Skipping {task.nid} {task.url} {result}')
+            novel.failed = True
+            novels_total.inc(result='failed')
+            save_failed_nid(writer.cursor(), task.nid, result)
+            writer.commit()
+            return
+
+        if isinstance(result, Exception):
+            logger.error(f'Failed {task.nid} {task.url} {result}')
+            novels_total.inc(result='failed')
+            raise result
+
+        if task.kind == 'detail':
+            self.start_novel(writer, novel, result)
+            return
+
+        if result is None:
+            raise RuntimeError(f'{task.url} of {task.nid} was not found')
+
+        stage = 'impression' if task.kind == 'impression' else 'content'
+
+        if task.kind == 'toc':
+            single_page, entries = result
+            if single_page is not None:
+                self.content_buffer.append(single_page)
+            self.schedule_chapters(writer, novel, entries)
+        elif task.kind == 'chapter':
+            self.content_buffer.append(result)
+            logger.info(f'[{result.page_num}] {novel.nid} content')
+        elif task.kind == 'impression':
+            impressions, max_page = result
+            first_page = task.args[0]
+            if not first_page or novel.impression_start_page <= 1:
+                self.impression_buffer.extend(impressions)
+
+            if first_page:
+                novel.impression_max_page = max_page or 0
+                novel.next_impression_page = max(2, novel.impression_start_page)
+
+            # incremental scraping fetches one page at a time until it reaches stored impressions
+            if novel.newest_impression is None:
+                last_page = novel.impression_max_page if first_page else 0
+            elif reached_stored_impressions(impressions, novel.newest_impression):
+                last_page = 0
+            else:
+                last_page = novel.next_impression_page
+
+            for page in range(novel.next_impression_page, min(last_page, novel.impression_max_page) + 1):
+                self.schedule_page(novel, 'impression', Task('impression', novel.nid, f'{novel.impression_url}?p={page}', (False,), page))
+                novel.next_impression_page = page + 1
+
+        if task.page in novel.outstanding_pages[stage]:
+            novel.outstanding_pages[stage].remove(task.page)
+            novel.pages_since_checkpoint[stage] += 1
+
+        if novel.pages_since_checkpoint[stage] >= script_args.checkpoint_pages:
+            self.save_progress(writer, novel, stage)
+        if len(self.content_buffer) + len(self.impression_buffer) >= script_args.db_batch_size:
+            self.flush(writer.cursor())
+
+        novel.pending[stage] -= 1
+        if novel.pending[stage] == 0:
+            self.finish_stage(writer, novel, stage)
+
+    def run(self, nids: Iterable[str], on_scraped: Optional[Callable] = None, pool: Optional[ProcessPoolExecutor] = None):
+        """
+        on_scraped(nid, writer) is called in order once a novel and every novel before it have been scraped.
+        pool is a pool of start_parser_pool which is left running, without one a pool is started for this run.
+        """
+        own_pool = pool is None
+        if own_pool:
+            pool = start_parser_pool(self.parsers)
+        writer = DatabaseWriter(db_name)
+        threads = [threading.Thread(target=self._fetch, name=f'fetcher-{i}', daemon=True) for i in range(self.fetchers)]
+        threads.append(threading.Thread(target=self._dispatch, args=(pool,), name='parse-dispatcher', daemon=True))
+        for thread in threads:
+            thread.start()
+
+        nids = iter(nids)
+        exhausted = False
+        # nids in the order they were started
+        order = deque()
+
+        try:
+            while True:
+                while not exhausted and len(self.novels) < self.max_novels:
+                    nid = next(nids, None)
+                    if nid is None:
+                        exhausted = True
+                        break
+
+                    logger.debug(f'Start scraping {nid}')
+                    self.novels[nid] = NovelState(nid)
+                    order.append(nid)
+                    self.schedule(Task('detail', nid, f'https://ncode.syosetu.com/novelview/infotop/ncode/{nid}/'), priority=1)
+
+                while order and self.novels[order[0]].done:
+                    novel = self.novels.pop(order.popleft())
+                    if not novel.failed:
+                        novel_seconds.observe(default_timer() - novel.start_time)
+                        novels_total.inc(result='scraped')
+                    if on_scraped:
+                        on_scraped(novel.nid, writer)
+
+                if exhausted and not order:
+                    break
+
+                task, result = self.results.get()
+                self.handle(writer, task, result)
+
+            self.flush(writer.cursor())
+            writer.commit()
+        finally:
+            self.stop.set()
+            self.parse_queue.put(None)
+            for thread in threads:
+                thread.join()
+            if own_pool:
+                pool.shutdown(wait=True, cancel_futures=True)
+            writer.close()
+
+
+def run_pipeline(nids: Iterable[str], on_scraped: Optional[Callable] = None, dead_nids: Optional[DeadNidSet] = None,
+                 pool: Optional[ProcessPoolExecutor] = None):
+    Pipeline(script_args.fetchers, script_args.parsers, dead_nids).run(nids, on_scraped, pool)
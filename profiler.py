@@ -0,0 +1,131 @@
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from time import monotonic
+from typing import Callable, Optional
+
+# Modules whose functions are listed in the summary of every window
+focus_modules = ('content', 'impression', 'novel_info', 'models')
+
+
+def frame_label(code) -> str:
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f'{module}:{getattr(code, "co_qualname", code.co_name)}'
+
+
+def thread_label(name: str) -> str:
+    # fetcher-3 and novelapi_0 are merged with the other threads of their pool
+    return re.sub(r'([-_]\d+)+$', '', name)
+
+
+def window_path(output: str, started: datetime) -> str:
+    root, ext = os.path.splitext(output)
+    return f'{root}-{started:%Y%m%d-%H%M%S}{ext}'
+
+
+def function_summary(stacks: Counter, modules=focus_modules) -> list[tuple[str, int, int]]:
+    """
+    Samples in which every function of the modules was on the stack and at the top of it, most samples first
+    """
+    inclusive = Counter()
+    exclusive = Counter()
+    for stack, samples in stacks.items():
+        functions = set(label for label in stack[1:] if label.split(':')[0] in modules)
+        for function in functions:
+            inclusive[function] += samples
+        if stack[-1] in functions:
+            exclusive[stack[-1]] += samples
+    return [(function, samples, exclusive[function]) for function, samples in inclusive.most_common()]
+
+
+class StackSampler:
+    """
+    Samples the stack of every thread each interval seconds with sys._current_frames and writes them in the
+    collapsed format of flamegraph.pl and speedscope, one file per window.
+    Only the sampler thread does any work, the sampled threads are never interrupted.
+    """
+
+    def __init__(self, interval: float, window: float, output: str, report: Optional[Callable[[str], None]] = None):
+        self.interval = interval
+        self.window = window
+        self.output = output
+        self.report = report
+
+        self.stacks = Counter()
+        self.window_start = datetime.now()
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = self._labels.get(code)
+                if label is None:
+                    label = self._labels[code] = frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+
+            stack.append(thread_label(names.get(ident, 'unknown')))
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+
+    def flush(self):
+        stacks, self.stacks = self.stacks, Counter()
+        started, self.window_start = self.window_start, datetime.now()
+        if not stacks:
+            return
+
+        path = window_path(self.output, started)
+        with open(path, 'w') as f:
+            for stack, samples in stacks.most_common():
+                f.write(f'{";".join(stack)} {samples}\n')
+
+        if self.report is not None:
+            total = sum(stacks.values())
+            top = ', '.join(f'{function} {samples / total:.1%} (self {exclusive / total:.1%})'
+                            for function, samples, exclusive in function_summary(stacks)[:10])
+            self.report(f'Profile of {total} samples written to {path}: {top or "no samples in the focus modules"}')
+
+    def _run(self):
+        next_flush = monotonic() + self.window if self.window else None
+        while not self._stop.wait(self.interval):
+            self.sample()
+            if next_flush is not None and monotonic() >= next_flush:
+                self.flush()
+                next_flush += self.window
+        self.flush()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def start_profiler(interval: float, window: float, output: str,
+                   report: Optional[Callable[[str], None]] = None) -> StackSampler:
+    sampler = StackSampler(interval, window, output, report)
+    sampler.start()
+    return sampler
+
+
+def start_worker_profiler(interval: float, window: float, output: str):
+    """
+    Initializer of parser processes. Their windows are written next to the main output with the pid appended,
+    the last unfinished window is lost when the pool shuts the process down.
+    """
+    root, ext = os.path.splitext(output)
+    start_profiler(interval, window, f'{root}-{os.getpid()}{ext}')
@@ -0,0 +1,124 @@
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from timeit import default_timer
+from typing import Optional
+
+from archive import PageArchive, RecordLocation, read_record
+from args import script_args
+from logger import logger
+from models import ContentRecord, ImpressionRecord, NovelContentModel, NovelImpressionModel, NovelInfoModel, connect, db_name, \
+    initialize_db
+from pipeline import parse_chapter, parse_detail_page, parse_impression_page, parse_table_of_contents, start_parser_pool
+from profiler import start_profiler
+
+
+def reextract_novel(directory: str, nid: str, records: list[tuple[str, RecordLocation]]
+                    ) -> Optional[tuple[bool, NovelInfoModel, list[ContentRecord]]]:
+    """
+    Extracts the info and content of a novel from its latest archived pages, None for error pages.
+    Runs in a worker process, only the record locations are sent to it.
+    """
+    locations = {kind: location for kind, location in records if kind in ('detail', 'toc')}
+    chapters = {location.url: location for kind, location in records if kind == 'chapter'}
+
+    result = parse_detail_page(read_record(directory, locations['detail']))
+    if result is None:
+        return None
+    is_r18, info = result
+
+    contents = []
+    toc = locations.get('toc')
+    if toc is not None:
+        single_page, entries = parse_table_of_contents(read_record(directory, toc), toc.url, info)
+        if single_page is not None:
+            contents.append(single_page)
+
+        for page_num, entry in enumerate(entries, start=1):
+            # chapters which were never downloaded are left as they are in the database
+            location = chapters.get(entry[0])
+            if location is not None:
+                contents.append(parse_chapter(read_record(directory, location), nid, entry, page_num))
+
+    return is_r18, info, contents
+
+
+def reextract_impressions(directory: str, location: RecordLocation) -> list[ImpressionRecord]:
+    impressions, _ = parse_impression_page(read_record(directory, location), first_page=True)
+    return impressions
+
+
+def save_novel(cursor: sqlite3.Cursor, result: Optional[tuple[bool, NovelInfoModel, list[ContentRecord]]]):
+    if result is None:
+        return
+
+    is_r18, info, contents = result
+    cursor.execute("INSERT OR IGNORE INTO scrape_history (nid, r18) VALUES (?, ?)", (info.nid, is_r18))
+    info.sqlite_save(cursor)
+    NovelContentModel.sqlite_save_many(cursor, contents)
+
+
+def save_impressions(cursor: sqlite3.Cursor, impressions: list[ImpressionRecord]):
+    NovelImpressionModel.sqlite_save_many(cursor, impressions)
+
+
+def reextract(archive: PageArchive, connection: sqlite3.Connection, executor: ProcessPoolExecutor, workers: int):
+    """
+    Refills novel_info, novel_content and novel_impression from the archive with the processes of executor.
+    Only the latest record of every url is used. Pages which fail to parse are logged and skipped.
+    """
+    cursor = connection.cursor()
+    in_flight = deque()
+    done = failed = 0
+    start_time = default_timer()
+
+    def tasks():
+        for nid in archive.nids():
+            yield nid, save_novel, reextract_novel, (nid, archive.latest_of_nid(nid))
+        for location in archive.latest_impression_pages():
+            yield location.url, save_impressions, reextract_impressions, (location,)
+
+    def collect():
+        nonlocal done, failed
+        name, save, future = in_flight.popleft()
+        try:
+            save(cursor, future.result())
+        except Exception as e:
+            failed += 1
+            logger.warning(f'Failed to extract {name} {e}')
+
+        done += 1
+        if done % 1000 == 0:
+            connection.commit()
+            logger.info(f'Extracted {done} archived novels and impression pages, {done / (default_timer() - start_time):.1f}/s')
+
+    try:
+        for name, save, extract, args in tasks():
+            in_flight.append((name, save, executor.submit(extract, archive.directory, *args)))
+            if len(in_flight) >= workers * 4:
+                collect()
+
+        while in_flight:
+            collect()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        connection.commit()
+
+    logger.info(f'Extracted {done} archived novels and impression pages, {failed} failed')
+
+
+if __name__ == '__main__':
+    if not script_args.archive_dir:
+        raise SystemExit('--archive-dir is required')
+
+    initialize_db()
+    conn = connect(db_name)
+    # the worker processes are forked before the profiler thread starts
+    executor = start_parser_pool(script_args.parsers)
+    if script_args.profile:
+        profiler = start_profiler(script_args.profile_interval_ms / 1000, script_args.profile_window,
+                                  script_args.profile_output, logger.info)
+    reextract(PageArchive(script_args.archive_dir), conn, executor, script_args.parsers)
+    conn.close()
+    if script_args.profile:
+        profiler.stop()
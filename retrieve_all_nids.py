@@ -1,55 +1,106 @@
 import sqlite3
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
 
-import yaml
-
-from api import request_with_retries
+from api import parse_api_datetime, query_api, query_novels_between
+from args import script_args
 from logger import logger
-from nid import generate_nids
+from models import connect, db_name, initialize_db, parse_datetime, site_now, site_timestamp
+
+# Novels can't have been posted before the site opened
+first_novel_datetime = datetime(2004, 1, 1)
 
 
-def scrape_novel_info_from(start_from):
-    request_url = f'https://api.syosetu.com/novelapi/api/?lim=500&of=n-gf&order=ncodedesc&st={start_from}'
-    response_data = request_with_retries(request_url)
-    data = yaml.safe_load(response_data.decode('utf-8'))
-    conn = sqlite3.connect('novels.db')
-    cur = conn.cursor()
+def get_total_novel_count(api='novelapi'):
+    data = query_api(f'https://api.syosetu.com/{api}/api/?lim=1&of=n-gf')
+    return int(data[0]['allcount'])
 
-    for novel in data[1:]:
-        cur.execute('INSERT OR IGNORE INTO scrape_history (nid, novel_creation_datetime) VALUES (?, ?)',
-                    (novel['ncode'], novel['general_firstup']))
 
-    conn.commit()
+def save_to_queue(cursor: sqlite3.Cursor, novels: list[dict], is_r18: bool):
+    now = site_now()
+    # Existing rows keep their scraped_datetime, only the timestamps from the api are refreshed
+    cursor.executemany(
+        """
+        INSERT INTO nid_queue (nid, r18, general_firstup, general_lastup, discovered_datetime) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (nid) DO UPDATE SET general_firstup = excluded.general_firstup, general_lastup = excluded.general_lastup
+        """,
+        [(novel['ncode'].upper(), is_r18, parse_api_datetime(novel['general_firstup']),
+          parse_api_datetime(novel['general_lastup']), now) for novel in novels]
+    )
 
 
-def get_total_novel_count():
-    request_url = f'https://api.syosetu.com/novelapi/api/?lim=1&of=n-gf'
-    response_data = request_with_retries(request_url)
-    data = yaml.safe_load(response_data.decode('utf-8'))
-    return int(data[0]['allcount'])
+def discover_nids(connection: sqlite3.Connection, api='novelapi', since: Optional[datetime] = None) -> int:
+    """
+    Pages through every novel by general_firstup and saves their nids to nid_queue.
+    Windows of firstup are split until they fit in the api's offset limit, so the whole catalogue can be retrieved.
+    """
+    start = site_timestamp(since or first_novel_datetime)
+    end = site_timestamp(site_now())
+    is_r18 = api == 'novel18api'
+
+    cursor = connection.cursor()
+    discovered = 0
+
+    for novels in query_novels_between('firstup', start, end, of='n-gf-gl', api=api,
+                                       workers=script_args.discovery_workers):
+        save_to_queue(cursor, novels, is_r18)
+        connection.commit()
+
+        discovered += len(novels)
+        logger.info(f'Discovered {discovered} novels from {api}')
+
+    return discovered
+
+
+def get_last_discovered(connection: sqlite3.Connection, is_r18: bool) -> Optional[datetime]:
+    cursor = connection.cursor()
+    cursor.execute("SELECT MAX(general_firstup) FROM nid_queue WHERE r18 = ?", (is_r18,))
+    return parse_datetime(cursor.fetchone()[0])
+
+
+def queued_nids(connection: sqlite3.Connection, batch_size=1000) -> Iterable[str]:
+    """
+    Nids in the queue which haven't been scraped yet, newest first like the default range sweep.
+    Rows are read in batches so the whole queue is never held in memory.
+    """
+    cursor = connection.cursor()
+    last = (datetime.max, '')
+
+    while True:
+        cursor.execute(
+            """
+            SELECT general_firstup, nid FROM nid_queue
+            WHERE scraped_datetime IS NULL AND (general_firstup, nid) < (?, ?)
+            ORDER BY general_firstup DESC, nid DESC LIMIT ?
+            """,
+            (*last, batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+
+        for _, nid in rows:
+            yield nid
 
+        last = rows[-1]
 
-def scrape_all_novels():
-    total_novel_count = get_total_novel_count()
-    logger.debug(f'Total novel count: {total_novel_count}')
-    start_from = 0
-    while start_from < total_novel_count:
-        scrape_novel_info_from(start_from)
-        # only increase by 450 to avoid missing any
-        start_from += 450
-        logger.info(f'Scraped {start_from} / {total_novel_count}')
 
+def mark_scraped(nid: str, connection: sqlite3.Connection):
+    connection.cursor().execute("UPDATE nid_queue SET scraped_datetime = ? WHERE nid = ?", (site_now(), nid))
+    connection.commit()
 
-def scrape_backwards(nid_from):
-    gen = generate_nids(nid_from, reverse=True)
 
-    request_url = f'https://api.syosetu.com/novelapi/api/?lim=500&of=n-gf&ncode={nid_from}'
-    response_data = request_with_retries(request_url)
-    data = yaml.safe_load(response_data.decode('utf-8'))
-    conn = sqlite3.connect('novels.db')
-    cur = conn.cursor()
+if __name__ == '__main__':
+    initialize_db()
+    conn = connect(db_name)
 
-    for novel in data[1:]:
-        cur.execute('INSERT OR IGNORE INTO scrape_history (nid, novel_creation_datetime) VALUES (?, ?)',
-                    (novel['ncode'], novel['general_firstup']))
+    apis = ['novelapi'] if script_args.skip_r18 else ['novelapi', 'novel18api']
+    for api in apis:
+        since = None
+        if not script_args.full_discovery:
+            since = get_last_discovered(conn, api == 'novel18api')
+            # novels posted at the same time as the last run may have been missed
+            since = since - timedelta(days=1) if since else None
 
-    conn.commit()
+        logger.info(f'Discovering {get_total_novel_count(api)} novels from {api} since {since or first_novel_datetime}')
+        discover_nids(conn, api, since)
@@ -0,0 +1,66 @@
+import re
+from typing import Optional
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from args import script_args
+from metrics import parse_seconds
+
+try:
+    import lxml  # noqa: F401
+    has_lxml = True
+except ImportError:
+    has_lxml = False
+
+
+def get_parser_name() -> str:
+    if script_args.html_parser == 'auto':
+        return 'lxml' if has_lxml else 'html.parser'
+    return script_args.html_parser
+
+
+def make_soup(markup, parse_only: Optional[SoupStrainer] = None) -> BeautifulSoup:
+    """
+    All pages are parsed here so that the parser backend can be switched with --html-parser.
+    parse_only limits the tree to the subtrees the extractors look at.
+    """
+    with parse_seconds.time(page=_strainer_pages.get(id(parse_only), 'detail')):
+        return BeautifulSoup(markup, get_parser_name(), parse_only=parse_only)
+
+
+def _has_class(attrs: dict, classes: set) -> bool:
+    value = attrs.get('class') or ''
+    if isinstance(value, str):
+        value = value.split()
+    return not classes.isdisjoint(value)
+
+
+chapter_ids = ['novel_p', 'novel_honbun', 'novel_a']
+
+
+def _is_table_of_contents_part(name, attrs) -> bool:
+    # novels without a table of contents have their content on the same page
+    return _has_class(attrs, {'index_box'}) or attrs.get('id') in chapter_ids
+
+
+# Table of contents, see content.novel_content_generator
+table_of_contents_strainer = SoupStrainer(_is_table_of_contents_part)
+
+
+# Link to the top page of a novel, the first one on an impression page is the novel the impressions are about
+novel_link_pattern = re.compile(r'//(?:ncode|novel18)\.syosetu\.com/n\w+/$', re.IGNORECASE)
+
+
+def _is_impression_part(name, attrs) -> bool:
+    # the comment blocks, the pager and the link to the novel
+    return _has_class(attrs, {'waku', 'naviall'}) or (name == 'a' and bool(novel_link_pattern.search(attrs.get('href') or '')))
+
+
+# Impression list pages, see impression.extract_impressions
+impression_strainer = SoupStrainer(_is_impression_part)
+
+
+_strainer_pages = {
+    id(table_of_contents_strainer): 'toc',
+    id(impression_strainer): 'impression',
+}
@@ -0,0 +1,30 @@
+import tempfile
+from unittest import TestCase
+
+from archive import PageArchive, classify_url
+
+
+class Test(TestCase):
+    def test_classify_url(self):
+        self.assertEqual(classify_url('https://ncode.syosetu.com/novelview/infotop/ncode/N1234AB/'), ('detail', 'N1234AB'))
+        self.assertEqual(classify_url('https://novel18.syosetu.com/n1234ab/'), ('toc', 'N1234AB'))
+        self.assertEqual(classify_url('https://ncode.syosetu.com/n1234ab/12/'), ('chapter', 'N1234AB'))
+        self.assertEqual(classify_url('https://novelcom.syosetu.com/impression/list/ncode/555/?p=2'), ('impression', None))
+        self.assertEqual(classify_url('https://api.syosetu.com/novelapi/api/?ncode=n1234ab'), (None, None))
+
+    def test_append_read(self):
+        with tempfile.TemporaryDirectory() as directory:
+            archive = PageArchive(directory)
+            archive.append('https://ncode.syosetu.com/n1234ab/1/', b'first\r\n\r\nversion')
+            archive.append('https://ncode.syosetu.com/n1234ab/2/', b'other')
+            archive.append('https://ncode.syosetu.com/n1234ab/1/', b'second')
+
+            self.assertEqual(archive.read('https://ncode.syosetu.com/n1234ab/1/'), b'second')
+            self.assertEqual(archive.read('https://ncode.syosetu.com/n1234ab/2/'), b'other')
+            self.assertIsNone(archive.read('https://ncode.syosetu.com/n1234ab/3/'))
+
+            latest = {location.url: location for _, location in archive.latest_of_nid('N1234AB')}
+            self.assertEqual(len(latest), 2)
+            self.assertEqual(latest['https://ncode.syosetu.com/n1234ab/1/'],
+                             archive.latest('https://ncode.syosetu.com/n1234ab/1/'))
+            archive.close()
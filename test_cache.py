@@ -0,0 +1,47 @@
+import tempfile
+from unittest import TestCase
+
+from cache import ResponseCache
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_put_get(self):
+        cache = ResponseCache(self.directory.name, max_bytes=1024 * 1024)
+        cache.put('https://example.com/a', b'page', etag='"1"')
+        cache.put('https://example.com/b', b'page')
+
+        self.assertEqual(cache.get('https://example.com/a'), (b'page', '"1"', None))
+        self.assertIsNone(cache.get('https://example.com/c'))
+        self.assertEqual(len(cache), 2)
+
+        # identical bodies are stored once
+        cached_bytes = cache.total_bytes
+        cache.put('https://example.com/c', b'page')
+        self.assertEqual(cache.total_bytes, cached_bytes)
+        cache.close()
+
+        # the index survives reopening
+        cache = ResponseCache(self.directory.name, max_bytes=1024 * 1024)
+        self.assertEqual(cache.total_bytes, cached_bytes)
+        self.assertEqual(cache.get('https://example.com/c').body, b'page')
+        cache.close()
+
+    def test_eviction(self):
+        cache = ResponseCache(self.directory.name, max_bytes=1024 * 1024)
+        cache.put('https://example.com/a', b'a' * 100)
+        # room for two pages
+        cache.max_bytes = cache.total_bytes * 2.5
+
+        cache.put('https://example.com/b', b'b' * 100)
+        cache.get('https://example.com/a')
+        cache.put('https://example.com/c', b'c' * 100)
+
+        # b was used least recently
+        self.assertIsNone(cache.get('https://example.com/b'))
+        self.assertIsNotNone(cache.get('https://example.com/a'))
+        self.assertIsNotNone(cache.get('https://example.com/c'))
+        cache.close()
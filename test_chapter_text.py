@@ -0,0 +1,31 @@
+from unittest import TestCase
+
+from chapter_text import extract_chapter_text
+
+chapter_page = '''<html><body><div id="novel_contents"><div id="novel_color">
+<div id="novel_p" class="novel_view"><p id="Lp1">前書き</p><p id="Lp2"><br /></p></div>
+<div id="novel_honbun" class="novel_view">
+<p id="L1">　「こんにちは」&amp;<ruby>漢字<rp>(</rp><rt>かんじ</rt><rp>)</rp></ruby>です  </p>
+<p id="L2"><br /></p>
+<p id="L3">a<br>b <!-- comment --> c<span> d </span>e</p>
+<p class="not_a_line">skipped</p>
+<div class="koukoku"><p id="L4">nested</p></div>
+<p id="L5">unclosed
+</div>
+</div></div>
+<div id="novel_a" class="novel_view"><p id="La1">後書き</p></div>
+</body></html>'''
+
+
+class Test(TestCase):
+    def test_extract_chapter_text(self):
+        pre, content, post = extract_chapter_text(chapter_page.encode('utf-8'))
+
+        self.assertEqual(pre, '前書き\n\n')
+        # every text node is stripped like get_text(strip=True), empty lines become line breaks
+        self.assertEqual(content, '「こんにちは」&漢字(かんじ)です\n\n\nabcde\nnested\nunclosed')
+        self.assertEqual(post, '後書き')
+
+    def test_missing_sections(self):
+        self.assertEqual(extract_chapter_text('<html><body><p id="L1">outside</p></body></html>'.encode('utf-8')),
+                         ('', '', ''))
@@ -0,0 +1,19 @@
+from unittest import TestCase
+
+from compression import TextCompressor, pack_text, train_dictionary, unpack_text
+
+
+class Test(TestCase):
+    def test_zlib_dictionary(self):
+        chapters = [pack_text(None, f'「おはようございます」\n　彼は{i}回目の朝を迎えた。\n「今日もいい天気だ」', 'あとがき')
+                    for i in range(20)]
+        dictionary = train_dictionary(chapters, 'zlib')
+        self.assertIn('「今日もいい天気だ」'.encode('utf-8'), dictionary)
+
+        with_dictionary = TextCompressor('zlib', 1, dictionary)
+        without_dictionary = TextCompressor('zlib')
+        for compressor in (with_dictionary, without_dictionary):
+            self.assertEqual(unpack_text(compressor.decompress(compressor.compress(chapters[0]))),
+                             (None, '「おはようございます」\n　彼は0回目の朝を迎えた。\n「今日もいい天気だ」', 'あとがき'))
+
+        self.assertLess(len(with_dictionary.compress(chapters[0])), len(without_dictionary.compress(chapters[0])))
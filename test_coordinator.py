@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+import threading
+import urllib.error
+from time import sleep
+from unittest import TestCase
+
+# args.py parses the command line when it is imported, the arguments of the test runner aren't meant for it
+sys.argv[1:] = ['--log-file', os.devnull]
+
+from coordinator import HttpWorkQueue, WorkQueue, make_server  # noqa: E402
+
+lease_seconds = 0.2
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.queue = WorkQueue(os.path.join(self.directory.name, 'queue.db'))
+        self.queue.create_batches(range(0, 25), 10)
+
+    def test_create_batches(self):
+        self.assertEqual(self.queue.status(), {'pending': 3, 'leased': 0, 'expired': 0, 'done': 0})
+        # a restarted coordinator keeps the batches it has
+        self.assertEqual(self.queue.create_batches(range(0, 25), 5), 0)
+
+        batches = [self.queue.lease(f'worker-{i}', lease_seconds) for i in range(3)]
+        self.assertEqual([(batch['start'], batch['stop']) for batch in batches], [(0, 10), (10, 20), (20, 25)])
+        self.assertIsNone(self.queue.lease('worker-3', lease_seconds))
+
+    def test_lease_expiry(self):
+        batch = self.queue.lease('crashed', lease_seconds)
+        self.queue.lease('other', 60)
+        self.queue.lease('other', 60)
+        self.assertIsNone(self.queue.lease('next', lease_seconds))
+
+        sleep(lease_seconds * 2)
+        self.assertEqual(self.queue.status(), {'pending': 0, 'leased': 2, 'expired': 1, 'done': 0})
+
+        # the batch of the crashed node goes to the next worker that asks
+        reassigned = self.queue.lease('next', 60)
+        self.assertEqual(reassigned, batch)
+        self.assertEqual(self.queue.status(), {'pending': 0, 'leased': 3, 'expired': 0, 'done': 0})
+
+    def test_renew(self):
+        batch = self.queue.lease('worker', lease_seconds)
+        for _ in range(3):
+            sleep(lease_seconds / 2)
+            self.assertTrue(self.queue.renew(batch['id'], 'worker', lease_seconds))
+
+        # renewed leases don't expire
+        self.assertNotEqual(self.queue.lease('other', 60)['id'], batch['id'])
+        self.assertNotEqual(self.queue.lease('other', 60)['id'], batch['id'])
+        self.assertIsNone(self.queue.lease('other', 60))
+
+    def test_stolen_lease(self):
+        batch = self.queue.lease('slow', lease_seconds)
+        sleep(lease_seconds * 2)
+        self.assertEqual(self.queue.lease('fast', 60)['id'], batch['id'])
+
+        # the first worker finds out when it renews, and its result still finishes the batch
+        self.assertFalse(self.queue.renew(batch['id'], 'slow', lease_seconds))
+        self.assertFalse(self.queue.release(batch['id'], 'slow'))
+        self.assertFalse(self.queue.complete(batch['id'], 'slow', {'worker': 'slow'}))
+        self.assertEqual(self.queue.status()['done'], 1)
+
+        self.assertTrue(self.queue.complete(batch['id'], 'fast', {'worker': 'fast'}))
+        self.assertEqual(self.queue.status()['done'], 1)
+
+    def test_release(self):
+        batch = self.queue.lease('failing', 60)
+        self.assertTrue(self.queue.release(batch['id'], 'failing'))
+        self.assertEqual(self.queue.lease('other', 60)['id'], batch['id'])
+
+    def test_token(self):
+        server = make_server(self.queue, '127.0.0.1', 0, token='secret')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+
+        self.assertEqual(HttpWorkQueue(url, 'secret').status()['pending'], 3)
+        for token in (None, 'wrong'):
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                HttpWorkQueue(url, token).lease('intruder', 60)
+            self.assertEqual(context.exception.code, 403)
+        self.assertEqual(self.queue.status()['pending'], 3)
+
+        with self.assertRaises(SystemExit):
+            make_server(self.queue, '0.0.0.0', 0)
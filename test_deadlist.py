@@ -0,0 +1,46 @@
+import sqlite3
+from time import time
+from unittest import TestCase
+
+from deadlist import DeadNidSet
+
+
+class Test(TestCase):
+    def test_add_discard(self):
+        dead = DeadNidSet(ttl=100)
+        dead.add('N1234AB')
+        dead.add('N9999ZZ')
+
+        self.assertIn('N1234AB', dead)
+        self.assertIn('N9999ZZ', dead)
+        self.assertNotIn('N1235AB', dead)
+        self.assertEqual(len(dead), 2)
+
+        dead.discard('N1234AB')
+        self.assertNotIn('N1234AB', dead)
+        self.assertEqual(len(dead), 1)
+
+    def test_ttl(self):
+        dead = DeadNidSet(ttl=100)
+        dead.add('N0001AA')
+
+        # after half the ttl the entry moves to the previous bitmap and is still skipped
+        dead.current_created = time() - 60
+        self.assertIn('N0001AA', dead)
+        self.assertIsNotNone(dead.previous)
+
+        # after the full ttl it has to be probed again
+        dead.previous_created = time() - 110
+        self.assertNotIn('N0001AA', dead)
+
+    def test_save_load(self):
+        cursor = sqlite3.connect(':memory:').cursor()
+        cursor.execute("CREATE TABLE dead_nids(generation integer PRIMARY KEY, created_timestamp REAL, bitmap BLOB)")
+
+        dead = DeadNidSet(ttl=100)
+        dead.add('N0042XY')
+        dead.save(cursor)
+
+        loaded = DeadNidSet.load(cursor, ttl=100)
+        self.assertIn('N0042XY', loaded)
+        self.assertEqual(len(loaded), 1)
@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+# args.py parses the command line when it is imported, the arguments of the test runner aren't meant for it
+sys.argv[1:] = ['--log-file', os.devnull]
+
+import api  # noqa: E402
+import main  # noqa: E402
+from args import script_args  # noqa: E402
+from fixture_server import FixtureSite, start_fixture_server  # noqa: E402
+from main import find_stale_nids, scrape_nids  # noqa: E402
+from models import connect, initialize_db  # noqa: E402
+from nid import int_to_nid, nid_to_int  # noqa: E402
+
+day = [datetime(2023, 1, i) for i in range(1, 10)]
+
+
+def dump(path: str) -> dict:
+    """
+    Every row of every table, without the times of the scrapes
+    """
+    connection = sqlite3.connect(path)
+    tables = [name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+    rows = {}
+    for table in tables:
+        columns = [column for _, column, *_ in connection.execute(f"PRAGMA table_info({table})")
+                   if not column.endswith(('scrape_datetime', 'failed_datetime', 'dead_datetime'))]
+        rows[table] = sorted(connection.execute(f"SELECT {', '.join(columns)} FROM {table}").fetchall(), key=repr)
+    connection.close()
+    return rows
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        path = os.path.join(self.directory.name, 'novels.db')
+        initialize_db(path)
+        self.connection = connect(path)
+        self.addCleanup(self.connection.close)
+
+    def test_find_stale_nids(self):
+        history = {
+            # the info was committed after the update, but the content stage never finished
+            'N0000AA': (day[5], None),
+            'N0000AB': (day[5], day[4]),
+            'N0000AC': (day[5], day[5]),
+            # interrupted in the middle of the content
+            'N0000AD': (day[5], day[5]),
+        }
+        self.connection.executemany(
+            "INSERT INTO scrape_history (nid, last_info_scrape_datetime, last_content_scrape_datetime) VALUES (?, ?, ?)",
+            [(nid, info, content) for nid, (info, content) in history.items()]
+        )
+        self.connection.execute("INSERT INTO scrape_progress (nid, stage, page_num) VALUES ('N0000AD', 'content', 50)")
+        updated_novels = [(nid, day[4].replace(hour=12)) for nid in [*history, 'N0000AE']]
+
+        self.assertEqual(find_stale_nids(updated_novels, self.connection), ['N0000AA', 'N0000AB', 'N0000AD', 'N0000AE'])
+
+        self.addCleanup(setattr, script_args, 'skip_content', script_args.skip_content)
+        script_args.skip_content = True
+        self.assertEqual(find_stale_nids(updated_novels, self.connection), ['N0000AD', 'N0000AE'])
+
+    def test_workers_match_serial(self):
+        server = start_fixture_server(FixtureSite(chapters=7, paragraphs=3, impression_pages=3, comments=4, dead_rate=0.3), 0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        for obj, name, value in ((api.session, 'host_override', f'127.0.0.1:{server.server_address[1]}'),
+                                 (api, 'rate_limiter', api.RateLimiter({}, 1000)),
+                                 (script_args, 'checkpoint_pages', 2)):
+            self.addCleanup(setattr, obj, name, getattr(obj, name))
+            setattr(obj, name, value)
+        self.addCleanup(setattr, main, 'db_name', main.db_name)
+        self.addCleanup(setattr, script_args, 'workers', script_args.workers)
+        nids = [int_to_nid(nid_to_int('N1234AB') + i) for i in range(8)]
+
+        dumps = []
+        for workers in (1, 3):
+            main.db_name = os.path.join(self.directory.name, f'workers-{workers}.db')
+            initialize_db(main.db_name)
+            script_args.workers = workers
+            connection = connect(main.db_name)
+            scrape_nids(nids, connection)
+            connection.commit()
+            connection.close()
+            dumps.append(dump(main.db_name))
+
+        serial, concurrent = dumps
+        self.assertTrue(serial['novel_content'] and serial['novel_impression'])
+        self.assertEqual(serial, concurrent)
@@ -0,0 +1,118 @@
+import os
+import sys
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+# args.py parses the command line when it is imported, the arguments of the test runner aren't meant for it
+sys.argv[1:] = ['--log-file', os.devnull]
+
+from merge import merge_shard  # noqa: E402
+from models import connect, initialize_db  # noqa: E402
+
+day = [datetime(2023, 1, i) for i in range(1, 10)]
+
+
+def add_novel(connection, nid: str, title: str, info=None, impression=None, content=None, r18=None):
+    connection.execute(
+        "INSERT INTO scrape_history (nid, last_info_scrape_datetime, last_impression_scrape_datetime, "
+        "last_content_scrape_datetime, r18) VALUES (?, ?, ?, ?, ?)",
+        (nid, info, impression, content, r18)
+    )
+    connection.execute("INSERT INTO novel_info (nid, title) VALUES (?, ?)", (nid, title))
+    connection.execute("INSERT INTO novel_content (nid, title, content, created_datetime, page_num) VALUES (?, ?, ?, ?, 1)",
+                       (nid, 'chapter', title, day[0]))
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.paths = {}
+        for name in ('main', 'shard-1', 'shard-2'):
+            self.paths[name] = os.path.join(self.directory.name, f'{name}.db')
+            initialize_db(self.paths[name])
+
+    def connect(self, name: str):
+        connection = connect(self.paths[name])
+        self.addCleanup(connection.close)
+        return connection
+
+    def test_newest_wins(self):
+        main, shard_1, shard_2 = (self.connect(name) for name in ('main', 'shard-1', 'shard-2'))
+
+        # N0000AA was scraped everywhere: shard-1 has the newest info and content, main the newest impressions
+        add_novel(main, 'N0000AA', 'main', info=day[2], impression=day[5], content=day[2])
+        add_novel(shard_1, 'N0000AA', 'shard-1', info=day[3], impression=day[1], content=day[3], r18=True)
+        add_novel(shard_2, 'N0000AA', 'shard-2', info=day[1], impression=day[1], content=day[1])
+        # N0000AB was only scraped by shard-2, its content stage never finished on shard-1
+        add_novel(shard_1, 'N0000AB', 'shard-1', info=day[4])
+        add_novel(shard_2, 'N0000AB', 'shard-2', info=day[2], content=day[2])
+
+        for connection in (main, shard_1, shard_2):
+            connection.commit()
+        merge_shard(main, self.paths['shard-1'])
+        merge_shard(main, self.paths['shard-2'])
+
+        self.assertEqual(main.execute("SELECT nid, title FROM novel_info ORDER BY nid").fetchall(),
+                         [('N0000AA', 'shard-1'), ('N0000AB', 'shard-1')])
+        self.assertEqual(main.execute("SELECT nid, content FROM novel_content ORDER BY nid").fetchall(),
+                         [('N0000AA', 'shard-1'), ('N0000AB', 'shard-2')])
+
+        history = main.execute(
+            "SELECT nid, last_info_scrape_datetime, last_impression_scrape_datetime, last_content_scrape_datetime, r18 "
+            "FROM scrape_history ORDER BY nid"
+        ).fetchall()
+        self.assertEqual(history, [
+            ('N0000AA', str(day[3]), str(day[5]), str(day[3]), 1),
+            ('N0000AB', str(day[4]), None, str(day[2]), None),
+        ])
+
+    def test_nid_queue(self):
+        main, shard_1 = self.connect('main'), self.connect('shard-1')
+        insert = ("INSERT INTO nid_queue (nid, general_firstup, general_lastup, discovered_datetime, scraped_datetime) "
+                  "VALUES (?, ?, ?, ?, ?)")
+        main.execute(insert, ('N0000AA', day[0], day[3], day[3], day[4]))
+        main.execute(insert, ('N0000AB', day[0], day[1], day[1], None))
+        shard_1.execute(insert, ('N0000AA', day[0], day[2], day[2], None))
+        shard_1.execute(insert, ('N0000AB', day[0], day[5], day[5], day[6]))
+        shard_1.execute(insert, ('N0000AC', day[0], day[1], day[1], None))
+        main.commit()
+        shard_1.commit()
+
+        merge_shard(main, self.paths['shard-1'])
+
+        # the newest update and scrape of each nid are kept, a scrape is never forgotten
+        self.assertEqual(main.execute("SELECT nid, general_lastup, scraped_datetime FROM nid_queue ORDER BY nid").fetchall(), [
+            ('N0000AA', str(day[3]), str(day[4])),
+            ('N0000AB', str(day[5]), str(day[6])),
+            ('N0000AC', str(day[1]), None),
+        ])
+
+    def test_dictionary_ids(self):
+        main, shard_1 = self.connect('main'), self.connect('shard-1')
+        insert_dictionary = "INSERT INTO compression_dictionaries (codec, dictionary, created_datetime) VALUES (?, ?, ?)"
+        main.execute(insert_dictionary, ('zlib', b'main only', day[0]))
+        main.execute(insert_dictionary, ('zlib', b'shared', day[0]))
+        shard_1.execute(insert_dictionary, ('zlib', b'shared', day[1]))
+        shard_1.execute(insert_dictionary, ('zlib', b'shard only', day[1]))
+
+        add_novel(shard_1, 'N0000AA', 'shard-1', content=day[1])
+        add_novel(shard_1, 'N0000AB', 'shard-1', content=day[1])
+        insert_text = "INSERT INTO novel_content_text (nid, created_datetime, codec, dictionary_id, data) VALUES (?, ?, 'zlib', ?, ?)"
+        shard_1.execute(insert_text, ('N0000AA', day[0], 1, b'with shared'))
+        shard_1.execute(insert_text, ('N0000AB', day[0], 2, b'with shard only'))
+        main.commit()
+        shard_1.commit()
+
+        merge_shard(main, self.paths['shard-1'])
+
+        dictionaries = dict(main.execute("SELECT dictionary, id FROM compression_dictionaries").fetchall())
+        self.assertEqual(dictionaries, {b'main only': 1, b'shared': 2, b'shard only': 3})
+        # text keeps pointing at the dictionary it was compressed with
+        texts = main.execute(
+            "SELECT t.data, d.dictionary FROM novel_content_text t JOIN compression_dictionaries d ON d.id = t.dictionary_id "
+            "ORDER BY t.nid"
+        ).fetchall()
+        self.assertEqual(texts, [(b'with shared', b'shared'), (b'with shard only', b'shard only')])
@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+from metrics import Counter, Histogram, counter, registry
+
+
+class Test(TestCase):
+    def test_counter(self):
+        requests = Counter('requests_total', 'Requests', ('host', 'status'))
+        requests.inc(host='a', status=200)
+        requests.inc(2, host='a', status=200)
+        requests.inc(host='b', status=503)
+
+        self.assertEqual(requests.value(host='a', status=200), 3)
+        self.assertEqual(requests.total(), 4)
+        self.assertEqual(requests.render(), [
+            'requests_total{host="a",status="200"} 3',
+            'requests_total{host="b",status="503"} 1',
+        ])
+
+    def test_escape_labels(self):
+        errors = Counter('errors_total', 'Errors', ('url',))
+        errors.inc(url='https://example.com/"a"\\b\nc')
+
+        self.assertEqual(errors.render(), ['errors_total{url="https://example.com/\\"a\\"\\\\b\\nc"} 1'])
+
+    def test_histogram(self):
+        seconds = Histogram('seconds', 'Seconds', buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 5):
+            seconds.observe(value)
+
+        self.assertEqual(seconds.count(), 4)
+        self.assertEqual(seconds.render(), [
+            'seconds_bucket{le="0.1"} 2',
+            'seconds_bucket{le="1"} 3',
+            'seconds_bucket{le="+Inf"} 4',
+            'seconds_sum 5.65',
+            'seconds_count 4',
+        ])
+
+    def test_take_merge(self):
+        worker = Histogram('seconds', 'Seconds', ('page',), buckets=(0.1, 1))
+        main = Histogram('seconds', 'Seconds', ('page',), buckets=(0.1, 1))
+        worker.observe(0.5, page='toc')
+        main.observe(5, page='toc')
+
+        main.merge(worker.take())
+        self.assertEqual(worker.count(page='toc'), 0)
+        self.assertEqual(main.count(page='toc'), 2)
+        self.assertEqual(main.render()[1:], ['seconds_bucket{page="toc",le="1"} 1', 'seconds_bucket{page="toc",le="+Inf"} 2',
+                                             'seconds_sum{page="toc"} 5.5', 'seconds_count{page="toc"} 2'])
+
+    def test_registry(self):
+        metric = counter('test_registry_total', 'Registered once')
+        self.assertIs(counter('test_registry_total', 'Registered once'), metric)
+        self.assertIs(registry['test_registry_total'], metric)
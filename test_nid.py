@@ -1,6 +1,7 @@
 from unittest import TestCase
 
-from nid import decrement_suffix, increment_suffix, generate_nids, Nid
+from nid import decrement_suffix, increment_suffix, generate_nids, Nid, int_to_nid, nid_range, nid_space, nid_to_int, \
+    shard_range
 
 
 class Test(TestCase):
@@ -79,3 +80,50 @@ class Test(TestCase):
         id1 = Nid("N9999AA")
         id2 = Nid("N0000AB")
         assert id1 < id2
+
+    def test_nid_to_int(self):
+        self.assertEqual(nid_to_int('N0000AA'), 0)
+        self.assertEqual(nid_to_int('N9999AA'), 9999)
+        self.assertEqual(nid_to_int('N0000AB'), 10000)
+        self.assertEqual(nid_to_int('N9999ZZ'), nid_space - 1)
+
+        for nid in ('N0000AA', 'N1955HZ', 'N6879IG', 'N9999ZZ'):
+            self.assertEqual(int_to_nid(nid_to_int(nid)), nid)
+
+        # wraps around like generate_nids
+        self.assertEqual(int_to_nid(nid_space), 'N0000AA')
+        self.assertEqual(int_to_nid(-1), 'N9999ZZ')
+
+    def test_nid_arithmetic(self):
+        self.assertEqual(Nid('N9999AA') + 1, Nid('N0000AB'))
+        self.assertEqual(Nid('N0000AB') - 1, Nid('N9999AA'))
+        self.assertEqual(Nid('N0000AA').distance(Nid('N0000AB')), 10000)
+        self.assertEqual(Nid('N0000AB').distance(Nid('N0000AA')), -10000)
+        self.assertEqual(len({Nid('n1234ab'), Nid('N1234AB')}), 1)
+
+    def test_nid_range(self):
+        to_test = (
+            ("N9998AA", "N0001AB", ["N9998AA", "N9999AA", "N0000AB", "N0001AB"]),
+            ("N0001AB", "N9998AA", ["N0001AB", "N0000AB", "N9999AA", "N9998AA"]),
+            ("N1234AB", "N1234AB", ["N1234AB"]),
+        )
+
+        for start, end, expected in to_test:
+            nids = nid_range(Nid(start), Nid(end))
+            self.assertEqual([int_to_nid(n) for n in nids], expected)
+            # same as walking with generate_nids
+            gen = generate_nids(start, reverse=Nid(start) > Nid(end))
+            self.assertEqual([next(gen) for _ in expected], expected)
+
+    def test_shard_range(self):
+        nids = nid_range(Nid('N0000AA'), Nid('N0099AA'))
+
+        for interleaved in (False, True):
+            shards = [shard_range(nids, 3, i, interleaved=interleaved) for i in range(3)]
+            # no overlaps or gaps
+            self.assertEqual(sorted(n for shard in shards for n in shard), list(nids))
+            self.assertTrue(all(33 <= len(shard) <= 34 for shard in shards))
+
+        self.assertEqual(list(shard_range(nids, 3, 1, interleaved=True))[:2], [1, 4])
+        self.assertEqual(shard_range(nids, 3, 1)[0], 33)
+        self.assertRaises(ValueError, shard_range, nids, 3, 3)
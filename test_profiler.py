@@ -0,0 +1,56 @@
+import os
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime
+from unittest import TestCase
+
+from profiler import StackSampler, function_summary, thread_label, window_path
+
+
+def busy(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class Test(TestCase):
+    def test_labels(self):
+        self.assertEqual(thread_label('fetcher-3'), 'fetcher')
+        self.assertEqual(thread_label('ThreadPoolExecutor-0_1'), 'ThreadPoolExecutor')
+        self.assertEqual(window_path('out/profile.folded', datetime(2024, 1, 2, 3, 4, 5)),
+                         'out/profile-20240102-030405.folded')
+
+    def test_function_summary(self):
+        stacks = Counter({
+            ('MainThread', 'main:scrape', 'content:novel_content_generator', 'content:get_content_string'): 3,
+            ('MainThread', 'main:scrape', 'content:novel_content_generator', 'api:request_with_retries'): 1,
+            ('MainThread', 'main:scrape', 'models:sqlite_save'): 2,
+        })
+        self.assertEqual(function_summary(stacks), [
+            ('content:novel_content_generator', 4, 0),
+            ('content:get_content_string', 3, 3),
+            ('models:sqlite_save', 2, 2),
+        ])
+
+    def test_sampler(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        stop = threading.Event()
+        thread = threading.Thread(target=busy, args=(stop,), name='busy-1')
+        thread.start()
+
+        sampler = StackSampler(0.001, 0, os.path.join(directory.name, 'profile.folded'))
+        for _ in range(5):
+            sampler.sample()
+        stop.set()
+        thread.join()
+        sampler.flush()
+
+        [name] = os.listdir(directory.name)
+        with open(os.path.join(directory.name, name)) as f:
+            lines = f.read().splitlines()
+        # collapsed stacks start with the thread and end with the number of samples
+        busy_samples = sum(int(line.rsplit(' ', 1)[1]) for line in lines
+                           if line.startswith('busy;') and 'test_profiler:busy' in line)
+        self.assertEqual(busy_samples, 5)
@@ -0,0 +1,91 @@
+import os
+import sys
+from unittest import TestCase, skipUnless
+
+# args.py parses the command line when it is imported, the arguments of the test runner aren't meant for it
+sys.argv[1:] = ['--log-file', os.devnull]
+
+from args import script_args  # noqa: E402
+from content import get_chapter_text, get_content_string, table_of_contents_entries  # noqa: E402
+from fixture_server import chapter_page, detail_page, impression_page, table_of_contents_page  # noqa: E402
+from impression import extract_impressions, get_max_page  # noqa: E402
+from novel_info import extract_novel_info  # noqa: E402
+from soup import has_lxml, impression_strainer, make_soup, table_of_contents_strainer  # noqa: E402
+
+nid = 'N1234AB'
+toc_url = f'https://ncode.syosetu.com/{nid.lower()}/'
+
+# a single comment has no pager, and a reader who left has no link
+single_impression_page = impression_page(nid, 1, 1, 1) \
+    .replace('<div class="naviall"><a href="?p=1">1</a></div>', '') \
+    .replace('<a href="https://mypage.syosetu.com/1/">読者0</a>', '読者0') \
+    .replace('良い点', '気になる点')
+impression_pages = [
+    impression_page(nid, 1, 5, 10),
+    impression_page(nid, 5, 5, 3),
+    single_impression_page,
+    impression_page(nid, 1, 0, 0).replace('<div class="naviall"></div>', ''),
+]
+
+
+def encode(page: str) -> bytes:
+    return page.encode('utf-8')
+
+
+def extract_fixtures() -> dict:
+    """
+    Everything the scraper extracts from the fixture pages with the current --html-parser
+    """
+    chapter = encode(chapter_page(nid, 1, 20))
+    results = {
+        'info': extract_novel_info(make_soup(encode(detail_page(nid)))),
+        'toc': table_of_contents_entries(make_soup(encode(table_of_contents_page(nid, 25)), table_of_contents_strainer), toc_url),
+        # short stories have their text on the table of contents page
+        'single_page': get_content_string(make_soup(chapter, table_of_contents_strainer)),
+        'chapter': get_content_string(make_soup(chapter)),
+    }
+    for strainer in (impression_strainer, None):
+        soups = [make_soup(encode(page), strainer) for page in impression_pages]
+        results[f'impressions {strainer is None}'] = [(get_max_page(soup), extract_impressions(soup)) for soup in soups]
+    return results
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, script_args, 'html_parser', script_args.html_parser)
+
+    def test_fixtures(self):
+        script_args.html_parser = 'html.parser'
+        results = extract_fixtures()
+
+        self.assertEqual(results['info'].nid, nid)
+        self.assertEqual(results['info'].bookmark_count, 1234)
+        self.assertEqual(len(results['toc']), 25)
+        self.assertEqual(results['toc'][10][4], '第2章')
+        self.assertEqual(results['chapter'], get_chapter_text(encode(chapter_page(nid, 1, 20))))
+        self.assertEqual(results['single_page'], results['chapter'])
+
+        # the strainer keeps everything the extractors need
+        self.assertEqual(results['impressions False'], results['impressions True'])
+        (max_page, impressions), (_, last_page), (single_max_page, (single,)), (no_max_page, none) = results['impressions False']
+        self.assertEqual((max_page, len(impressions), len(last_page)), (5, 10, 3))
+        self.assertEqual({impression.nid for impression in impressions + last_page}, {nid})
+        self.assertEqual((single_max_page, single.user_id, single.impression_kininaruten), (1, None, '面白いです' * 10))
+        self.assertEqual((no_max_page, none), (0, []))
+
+    @skipUnless(has_lxml, 'lxml is not installed')
+    def test_parsers_agree(self):
+        results = {}
+        for parser in ('lxml', 'html.parser'):
+            script_args.html_parser = parser
+            results[parser] = extract_fixtures()
+
+        self.assertEqual(results['lxml'], results['html.parser'])
+
+    def test_impression_strainer(self):
+        page = encode(impression_pages[0])
+        strained = make_soup(page, impression_strainer)
+
+        self.assertLess(len(str(strained)), len(str(make_soup(page))))
+        self.assertIsNone(strained.find(class_='novel_title'))
+        self.assertEqual(len(strained.find_all(class_='waku')), 10)
@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from unittest import TestCase
+
+# args.py parses the command line when it is imported, the arguments of the test runner aren't meant for it
+sys.argv[1:] = ['--log-file', os.devnull]
+
+from models import connect  # noqa: E402
+from writer import DatabaseWriter  # noqa: E402
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'writer.db')
+        with connect(self.path) as connection:
+            connection.execute("CREATE TABLE log (id INTEGER PRIMARY KEY, value TEXT)")
+        connection.close()
+
+        self.writer = DatabaseWriter(self.path)
+        self.addCleanup(self.writer.close)
+
+    def committed(self) -> list:
+        connection = sqlite3.connect(self.path)
+        self.addCleanup(connection.close)
+        return [value for value, in connection.execute("SELECT value FROM log ORDER BY id")]
+
+    def test_order(self):
+        cursor = self.writer.cursor()
+        cursor.execute("INSERT INTO log (value) VALUES ('a')")
+        cursor.executemany("INSERT INTO log (value) VALUES (?)", ((value,) for value in 'bc'))
+        cursor.execute("UPDATE log SET value = 'B' WHERE value = 'b'")
+        cursor.execute("DELETE FROM log WHERE value = 'c'")
+        self.writer.commit()
+
+        self.assertEqual(self.committed(), ['a', 'B'])
+
+    def test_read_your_writes(self):
+        cursor = self.writer.cursor()
+        cursor.execute("INSERT INTO log (value) VALUES ('a')")
+        # queries wait for the queued writes, before anything was committed
+        self.assertEqual(cursor.execute("SELECT value FROM log").fetchall(), [('a',)])
+        self.assertEqual(self.committed(), [])
+
+    def test_error_in_submitting_thread(self):
+        errors = {}
+
+        def write(name: str, *statements: str):
+            cursor = self.writer.cursor()
+            for sql in statements:
+                cursor.execute(sql, (name,))
+            try:
+                self.writer.commit()
+            except sqlite3.Error as e:
+                errors[name] = e
+
+        failing = threading.Thread(target=write, args=('failing', "INSERT INTO log (value) VALUES (?)",
+                                                         "INSERT INTO missing (value) VALUES (?)"))
+        failing.start()
+        failing.join()
+        self.assertIsInstance(errors.get('failing'), sqlite3.OperationalError)
+        # the error is raised before the write in front of it could be committed
+        self.assertEqual(self.committed(), [])
+
+        working = threading.Thread(target=write, args=('working', "INSERT INTO log (value) VALUES (?)"))
+        working.start()
+        working.join()
+        self.assertNotIn('working', errors)
+        # the other thread's commit carries what the failing thread wrote, see DatabaseWriter
+        self.assertEqual(self.committed(), ['failing', 'working'])
@@ -0,0 +1,126 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+from logger import logger
+from models import connect
+
+
+class DatabaseWriter:
+    """
+    Owns the only sqlite connection while several workers are scraping.
+    Statements are applied by a single thread in the order they were submitted,
+    so sqlite never sees more than one writer.
+    A failed write that nobody waited for is raised by the next commit of the thread that submitted it,
+    every worker thread scrapes one novel at a time so the error stays with the novel that caused it.
+
+    There is only one transaction: a commit from any thread also commits what the other threads wrote so far,
+    half of a novel included. That is the same state a crash of the serial scraper leaves behind, a stage
+    is only stamped in scrape_history once all of it was written and resumes start from scrape_progress.
+    """
+
+    def __init__(self, database: str, max_pending=10000):
+        self._queue = queue.Queue(maxsize=max_pending)
+        # futures of the writes each thread submitted since its last commit
+        self._local = threading.local()
+
+        connected = Future()
+        self._thread = threading.Thread(target=self._run, args=(database, connected), name='db-writer', daemon=True)
+        self._thread.start()
+        # surface connection errors in the calling thread
+        connected.result()
+
+    def _run(self, database: str, connected: Future):
+        try:
+            connection = connect(database)
+        except Exception as e:
+            connected.set_exception(e)
+            return
+
+        connected.set_result(None)
+        cursor = connection.cursor()
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            method, sql, parameters, future, wait = item
+            try:
+                if method == 'commit':
+                    connection.commit()
+                    result = None
+                else:
+                    getattr(cursor, method)(sql, parameters)
+                    result = cursor.fetchall()
+            except Exception as e:
+                if not wait:
+                    logger.error(f'Failed to write to database {e}')
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+        connection.close()
+
+    def _pending(self) -> list:
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = []
+        return pending
+
+    def submit(self, method: str, sql: str = None, parameters=(), wait=False):
+        future = Future()
+        self._queue.put((method, sql, parameters, future, wait))
+        if wait:
+            return future.result()
+        self._pending().append(future)
+
+    def cursor(self) -> 'WriterCursor':
+        return WriterCursor(self)
+
+    def commit(self):
+        """
+        Waits for the writes this thread submitted since its last commit and raises the first error among them
+        instead of committing. Its successful writes stay in the shared transaction, see the class docstring.
+        """
+        pending, self._local.pending = self._pending(), []
+        for future in pending:
+            error = future.exception()
+            if error is not None:
+                raise error
+        self.submit('commit', wait=True)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class WriterCursor:
+    """
+    Stand-in for sqlite3.Cursor which forwards statements to a DatabaseWriter.
+    Writes are queued without waiting, queries block until the writer has caught up.
+    """
+
+    def __init__(self, writer: DatabaseWriter):
+        self._writer = writer
+        self._rows = iter(())
+
+    def execute(self, sql: str, parameters=()):
+        if sql.lstrip().upper().startswith('SELECT'):
+            self._rows = iter(self._writer.submit('execute', sql, parameters, wait=True))
+        else:
+            self._writer.submit('execute', sql, parameters)
+            self._rows = iter(())
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters):
+        # parameters may be a generator, it has to be consumed in this thread
+        self._writer.submit('executemany', sql, list(seq_of_parameters))
+        self._rows = iter(())
+        return self
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchall(self):
+        return list(self._rows)